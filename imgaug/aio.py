@@ -0,0 +1,80 @@
+"""
+Augmentation of batches from asyncio code.
+
+This module requires python 3.7 or newer. It is not imported by default,
+use `Augmenter.augment_batches_async()` instead of importing it directly.
+
+"""
+from __future__ import print_function, division, absolute_import
+
+import asyncio
+import collections
+import concurrent.futures
+import multiprocessing
+import threading
+
+from . import imgaug as ia
+
+# augmenter of the current pool worker, set by _init_worker()
+_WORKER_LOCAL = threading.local()
+
+
+def _init_worker(augseq):
+    # each thread gets its own copy, as augmenters are reseeded for each batch
+    _WORKER_LOCAL.augseq = augseq.deepcopy()
+
+
+def _augment_batch(batch, seedval):
+    augseq = _WORKER_LOCAL.augseq
+    augseq.reseed(seedval)
+    return augseq.augment_batch(batch.load_images_()).store_images_aug_()
+
+
+async def _iterate(batches):
+    if hasattr(batches, "__aiter__"):
+        async for batch in batches:
+            yield batch
+    else:
+        for batch in batches:
+            yield batch
+
+
+async def augment_batches_async(augseq, batches, nb_workers="auto", max_in_flight=None, processes=False):
+    """
+    Augment batches on a pool of threads or processes without blocking the
+    event loop.
+
+    See `Augmenter.augment_batches_async()`.
+
+    """
+    if nb_workers == "auto":
+        try:
+            nb_workers = multiprocessing.cpu_count()
+        except (ImportError, NotImplementedError):
+            nb_workers = 1
+    ia.do_assert(nb_workers >= 1, "Expected nb_workers to be 'auto' or at least 1, got %s." % (nb_workers,))
+    if max_in_flight is None:
+        max_in_flight = 2 * nb_workers
+    ia.do_assert(max_in_flight >= 1, "Expected max_in_flight to be at least 1, got %s." % (max_in_flight,))
+
+    pool_class = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+    executor = pool_class(nb_workers, initializer=_init_worker, initargs=(augseq,))
+    source = _iterate(batches)
+    pending = collections.deque()
+    try:
+        async for batch in source:
+            ia.do_assert(isinstance(batch, ia.Batch), "Expected batches to contain imgaug.Batch objects, got %s." % (type(batch),))
+            # seeds are sampled in order, so that the results don't depend on
+            # the order in which the workers finish
+            seedval = augseq.random_state.randint(0, 10**6)
+            pending.append(asyncio.wrap_future(executor.submit(_augment_batch, batch, seedval)))
+            if len(pending) >= max_in_flight:
+                yield await pending.popleft()
+        while len(pending) > 0:
+            yield await pending.popleft()
+    finally:
+        # reached on cancellation, exceptions or when the consumer stops early
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+        await source.aclose()
@@ -30,7 +30,7 @@ from scipy import ndimage
 import cv2
 import six.moves as sm
 
-from .meta import Augmenter
+from .meta import Augmenter, map_per_image
 
 class GaussianBlur(Augmenter): # pylint: disable=locally-disabled, unused-variable, line-too-long
     """
@@ -90,7 +90,8 @@ class GaussianBlur(Augmenter): # pylint: disable=locally-disabled, unused-variab
         result = images
         nb_images = len(images)
         samples = self.sigma.draw_samples((nb_images,), random_state=random_state)
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             nb_channels = images[i].shape[2]
             sig = samples[i]
             if sig > 0 + self.eps:
@@ -100,6 +101,8 @@ class GaussianBlur(Augmenter): # pylint: disable=locally-disabled, unused-variab
                 # values might be mixed with blue values in RGB)
                 for channel in sm.xrange(nb_channels):
                     result[i][:, :, channel] = ndimage.gaussian_filter(result[i][:, :, channel], sig)
+
+        map_per_image(_augment_image, nb_images)
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -206,7 +209,8 @@ class AverageBlur(Augmenter): # pylint: disable=locally-disabled, unused-variabl
                 self.k[0].draw_samples((nb_images,), random_state=random_state),
                 self.k[1].draw_samples((nb_images,), random_state=random_state),
             )
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             kh, kw = samples[0][i], samples[1][i]
             #print(images.shape, result.shape, result[i].shape)
             kernel_impossible = (kh == 0 or kw == 0)
@@ -217,6 +221,8 @@ class AverageBlur(Augmenter): # pylint: disable=locally-disabled, unused-variabl
                 if image_aug.ndim == 2:
                     image_aug = image_aug[..., np.newaxis]
                 result[i] = image_aug
+
+        map_per_image(_augment_image, nb_images)
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -295,7 +301,8 @@ class MedianBlur(Augmenter): # pylint: disable=locally-disabled, unused-variable
         result = images
         nb_images = len(images)
         samples = self.k.draw_samples((nb_images,), random_state=random_state)
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             ki = samples[i]
             if ki > 1:
                 ki = ki + 1 if ki % 2 == 0 else ki
@@ -305,6 +312,8 @@ class MedianBlur(Augmenter): # pylint: disable=locally-disabled, unused-variable
                 if image_aug.ndim == 2:
                     image_aug = image_aug[..., np.newaxis]
                 result[i] = image_aug
+
+        map_per_image(_augment_image, nb_images)
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -409,7 +418,8 @@ class BilateralBlur(Augmenter): # pylint: disable=locally-disabled, unused-varia
         samples_d = self.d.draw_samples((nb_images,), random_state=ia.new_random_state(seed))
         samples_sigma_color = self.sigma_color.draw_samples((nb_images,), random_state=ia.new_random_state(seed+1))
         samples_sigma_space = self.sigma_space.draw_samples((nb_images,), random_state=ia.new_random_state(seed+2))
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             ia.do_assert(images[i].shape[2] == 3, "BilateralBlur can currently only be applied to images with 3 channels.")
             di = samples_d[i]
             sigma_color_i = samples_sigma_color[i]
@@ -417,6 +427,8 @@ class BilateralBlur(Augmenter): # pylint: disable=locally-disabled, unused-varia
 
             if di != 1:
                 result[i] = cv2.bilateralFilter(images[i], di, sigma_color_i, sigma_space_i)
+
+        map_per_image(_augment_image, nb_images)
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -31,7 +31,7 @@ import cv2
 import six.moves as sm
 import warnings
 
-from .meta import Augmenter, Sequential, WithChannels, handle_children_list
+from .meta import Augmenter, Sequential, WithChannels, handle_children_list, map_per_image
 from .arithmetic import Add
 
 # legacy support
@@ -89,19 +89,25 @@ class WithColorspace(Augmenter):
     def _augment_images(self, images, random_state, parents, hooks):
         result = images
         if hooks.is_propagating(images, augmenter=self, parents=parents, default=True):
+            # the conversions get their own random state, otherwise they
+            # would advance the global one (used by children without own
+            # random state) only for images, but not for heatmaps/keypoints
             result = ChangeColorspace(
                 to_colorspace=self.to_colorspace,
                 from_colorspace=self.from_colorspace,
-            ).augment_images(images=result)
+                random_state=ia.copy_random_state(random_state)
+            ).augment_images(images=result, copy=False)
             result = self.children.augment_images(
                 images=result,
                 parents=parents + [self],
                 hooks=hooks,
+                copy=False,
             )
             result = ChangeColorspace(
                 to_colorspace=self.from_colorspace,
                 from_colorspace=self.to_colorspace,
-            ).augment_images(images=result)
+                random_state=ia.copy_random_state(random_state)
+            ).augment_images(images=result, copy=False)
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -111,6 +117,7 @@ class WithColorspace(Augmenter):
                 result,
                 parents=parents + [self],
                 hooks=hooks,
+                copy=False,
             )
         return result
 
@@ -121,6 +128,7 @@ class WithColorspace(Augmenter):
                 result,
                 parents=parents + [self],
                 hooks=hooks,
+                copy=False,
             )
         return result
 
@@ -320,7 +328,8 @@ class ChangeColorspace(Augmenter):
         nb_images = len(images)
         alphas = self.alpha.draw_samples((nb_images,), random_state=ia.copy_random_state(random_state))
         to_colorspaces = self.to_colorspace.draw_samples((nb_images,), random_state=ia.copy_random_state(random_state))
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             alpha = alphas[i]
             to_colorspace = to_colorspaces[i]
             image = images[i]
@@ -371,6 +380,8 @@ class ChangeColorspace(Augmenter):
                 else:
                     result[i] = (alpha * img_to_cs + (1 - alpha) * image).astype(np.uint8)
 
+        map_per_image(_augment_image, nb_images)
+
         return images
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
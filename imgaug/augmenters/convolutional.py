@@ -114,7 +114,8 @@ class Convolve(Augmenter):
         result = images
         nb_images = len(images)
         seed = random_state.randint(0, 10**6, 1)[0]
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             _height, _width, nb_channels = images[i].shape
             if self.matrix_type == "None":
                 matrices = [None] * nb_channels
@@ -150,6 +151,8 @@ class Convolve(Augmenter):
                     result_ic = meta.restore_augmented_images_dtypes_(result_ic, input_dtypes[i])
                     result[i][..., channel] = result_ic
 
+        meta.map_per_image(_augment_image, nb_images)
+
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
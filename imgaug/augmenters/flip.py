@@ -98,6 +98,21 @@ class Fliplr(Augmenter): # pylint: disable=locally-disabled, unused-variable, li
                     keypoint.x = (width - 1) - keypoint.x
         return keypoints_on_images
 
+    def _get_homography_settings(self):
+        return None, None
+
+    def _draw_homographies(self, shapes, random_state):
+        nb_images = len(shapes)
+        samples = self.p.draw_samples((nb_images,), random_state=random_state)
+        matrices = []
+        for i in sm.xrange(nb_images):
+            matrix = np.eye(3)
+            if samples[i] == 1:
+                matrix[0, 0] = -1
+                matrix[0, 2] = shapes[i][1] - 1
+            matrices.append(matrix)
+        return matrices, list(shapes)
+
     def get_parameters(self):
         return [self.p]
 
@@ -171,5 +186,20 @@ class Flipud(Augmenter): # pylint: disable=locally-disabled, unused-variable, li
                     keypoint.y = (height - 1) - keypoint.y
         return keypoints_on_images
 
+    def _get_homography_settings(self):
+        return None, None
+
+    def _draw_homographies(self, shapes, random_state):
+        nb_images = len(shapes)
+        samples = self.p.draw_samples((nb_images,), random_state=random_state)
+        matrices = []
+        for i in sm.xrange(nb_images):
+            matrix = np.eye(3)
+            if samples[i] == 1:
+                matrix[1, 1] = -1
+                matrix[1, 2] = shapes[i][0] - 1
+            matrices.append(matrix)
+        return matrices, list(shapes)
+
     def get_parameters(self):
         return [self.p]
@@ -18,6 +18,7 @@ List of augmenters:
     * PiecewiseAffine
     * PerspectiveTransform
     * ElasticTransformation
+    * HomographyChain
 
 """
 from __future__ import print_function, division, absolute_import
@@ -31,7 +32,8 @@ from skimage import transform as tf
 import cv2
 import six.moves as sm
 
-from .meta import Augmenter
+from . import meta
+from .meta import Augmenter, handle_children_list
 
 class Affine(Augmenter):
     """
@@ -506,7 +508,8 @@ class Affine(Augmenter):
     def _augment_images_by_samples(self, images, scale_samples, translate_samples, rotate_samples, shear_samples, cval_samples, mode_samples, order_samples):
         nb_images = len(images)
         result = images
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             image = images[i]
             scale_x, scale_y = scale_samples[0][i], scale_samples[1][i]
             translate_x, translate_y = translate_samples[0][i], translate_samples[1][i]
@@ -558,11 +561,16 @@ class Affine(Augmenter):
             else:
                 result[i] = images[i]
 
+        meta.map_per_image(_augment_image, nb_images)
+
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
         nb_heatmaps = len(heatmaps)
-        scale_samples, translate_samples, rotate_samples, shear_samples, cval_samples, mode_samples, order_samples = self._draw_samples(nb_heatmaps, random_state)
+        samples = self._draw_samples(nb_heatmaps, random_state)
+        return self._augment_heatmaps_by_samples(heatmaps, *samples)
+
+    def _augment_heatmaps_by_samples(self, heatmaps, scale_samples, translate_samples, rotate_samples, shear_samples, cval_samples, mode_samples, order_samples):
         cval_samples = np.zeros((cval_samples.shape[0], 1), dtype=np.float32)
         mode_samples = ["constant"] * len(mode_samples)
 
@@ -575,14 +583,14 @@ class Affine(Augmenter):
         return heatmaps
 
     def _augment_keypoints(self, keypoints_on_images, random_state, parents, hooks):
-        result = []
         nb_images = len(keypoints_on_images)
-        scale_samples, translate_samples, rotate_samples, shear_samples, _cval_samples, _mode_samples, _order_samples = self._draw_samples(nb_images, random_state)
+        samples = self._draw_samples(nb_images, random_state)
+        return self._augment_keypoints_by_samples(keypoints_on_images, *samples)
 
+    def _augment_keypoints_by_samples(self, keypoints_on_images, scale_samples, translate_samples, rotate_samples, shear_samples, _cval_samples, _mode_samples, _order_samples):
+        result = []
         for i, keypoints_on_image in enumerate(keypoints_on_images):
             height, width = keypoints_on_image.height, keypoints_on_image.width
-            shift_x = width / 2.0 - 0.5
-            shift_y = height / 2.0 - 0.5
             scale_x, scale_y = scale_samples[0][i], scale_samples[1][i]
             translate_x, translate_y = translate_samples[0][i], translate_samples[1][i]
             #ia.do_assert(isinstance(translate_x, (float, int)))
@@ -601,15 +609,7 @@ class Affine(Augmenter):
             #mode = mode_samples[i]
             #order = order_samples[i]
             if scale_x != 1.0 or scale_y != 1.0 or translate_x_px != 0 or translate_y_px != 0 or rotate != 0 or shear != 0:
-                matrix_to_topleft = tf.SimilarityTransform(translation=[-shift_x, -shift_y])
-                matrix_transforms = tf.AffineTransform(
-                    scale=(scale_x, scale_y),
-                    translation=(translate_x_px, translate_y_px),
-                    rotation=math.radians(rotate),
-                    shear=math.radians(shear)
-                )
-                matrix_to_center = tf.SimilarityTransform(translation=[shift_x, shift_y])
-                matrix = (matrix_to_topleft + matrix_transforms + matrix_to_center)
+                matrix = self._create_matrix(height, width, scale_x, scale_y, translate_x_px, translate_y_px, rotate, shear)
 
                 coords = keypoints_on_image.get_coords_array()
                 #print("coords", coords)
@@ -622,9 +622,72 @@ class Affine(Augmenter):
                 result.append(keypoints_on_image)
         return result
 
+    def _augment_batch(self, batch, random_state, parents, hooks):
+        # sample only once for all columns, the results are the same as for
+        # separate calls of _augment_images(), _augment_heatmaps() and
+        # _augment_keypoints() with the same random state
+        samples = self._draw_samples(batch.nb_rows, random_state)
+        for column, value in batch.get_columns():
+            if column in batch.IMAGE_COLUMNS:
+                value = self._augment_images_by_samples(value, *samples)
+            elif column in batch.HEATMAPS_COLUMNS:
+                value = self._augment_heatmaps_by_samples(value, *samples)
+            else:
+                value = self._augment_keypoints_by_samples(value, *samples)
+            setattr(batch, column, value)
+        return batch
+
+    def _get_homography_settings(self):
+        params_fixed = all([isinstance(param, Deterministic) for param in [self.order, self.cval, self.mode]])
+        if self.backend == "skimage" or not params_fixed:
+            return None
+        if self.mode.value != "constant" or self.order.value not in [0, 1, 3]:
+            return None
+        return self.order_map_skimage_cv2[self.order.value], self.cval.value
+
+    def _draw_homographies(self, shapes, random_state):
+        nb_images = len(shapes)
+        scale_samples, translate_samples, rotate_samples, shear_samples, _cval_samples, _mode_samples, _order_samples = self._draw_samples(nb_images, random_state)
+        matrices = []
+        for i, shape in enumerate(shapes):
+            height, width = shape[0:2]
+            translate_x, translate_y = translate_samples[0][i], translate_samples[1][i]
+            if ia.is_single_float(translate_y):
+                translate_y_px = int(round(translate_y * height))
+            else:
+                translate_y_px = translate_y
+            if ia.is_single_float(translate_x):
+                translate_x_px = int(round(translate_x * width))
+            else:
+                translate_x_px = translate_x
+            matrix = self._create_matrix(
+                height, width,
+                scale_samples[0][i], scale_samples[1][i],
+                translate_x_px, translate_y_px,
+                rotate_samples[i], shear_samples[i]
+            )
+            matrices.append(matrix.params)
+        return matrices, list(shapes)
+
     def get_parameters(self):
         return [self.scale, self.translate, self.rotate, self.shear, self.order, self.cval, self.mode, self.backend]
 
+    @staticmethod
+    def _create_matrix(height, width, scale_x, scale_y, translate_x_px, translate_y_px, rotate, shear):
+        # all transformations are applied around the image center
+        shift_x = width / 2.0 - 0.5
+        shift_y = height / 2.0 - 0.5
+
+        matrix_to_topleft = tf.SimilarityTransform(translation=[-shift_x, -shift_y])
+        matrix_transforms = tf.AffineTransform(
+            scale=(scale_x, scale_y),
+            translation=(translate_x_px, translate_y_px),
+            rotation=math.radians(rotate),
+            shear=math.radians(shear)
+        )
+        matrix_to_center = tf.SimilarityTransform(translation=[shift_x, shift_y])
+        return matrix_to_topleft + matrix_transforms + matrix_to_center
+
     def _draw_samples(self, nb_samples, random_state):
         seed = random_state.randint(0, 10**6, 1)[0]
 
@@ -660,18 +723,7 @@ class Affine(Augmenter):
 
     def _warp_skimage(self, image, scale_x, scale_y, translate_x_px, translate_y_px, rotate, shear, cval, mode, order):
         height, width = image.shape[0], image.shape[1]
-        shift_x = width / 2.0 - 0.5
-        shift_y = height / 2.0 - 0.5
-
-        matrix_to_topleft = tf.SimilarityTransform(translation=[-shift_x, -shift_y])
-        matrix_transforms = tf.AffineTransform(
-            scale=(scale_x, scale_y),
-            translation=(translate_x_px, translate_y_px),
-            rotation=math.radians(rotate),
-            shear=math.radians(shear)
-        )
-        matrix_to_center = tf.SimilarityTransform(translation=[shift_x, shift_y])
-        matrix = (matrix_to_topleft + matrix_transforms + matrix_to_center)
+        matrix = self._create_matrix(height, width, scale_x, scale_y, translate_x_px, translate_y_px, rotate, shear)
         image_warped = tf.warp(
             image,
             matrix.inverse,
@@ -687,18 +739,7 @@ class Affine(Augmenter):
 
     def _warp_cv2(self, image, scale_x, scale_y, translate_x_px, translate_y_px, rotate, shear, cval, mode, order):
         height, width = image.shape[0], image.shape[1]
-        shift_x = width / 2.0 - 0.5
-        shift_y = height / 2.0 - 0.5
-
-        matrix_to_topleft = tf.SimilarityTransform(translation=[-shift_x, -shift_y])
-        matrix_transforms = tf.AffineTransform(
-            scale=(scale_x, scale_y),
-            translation=(translate_x_px, translate_y_px),
-            rotation=math.radians(rotate),
-            shear=math.radians(shear)
-        )
-        matrix_to_center = tf.SimilarityTransform(translation=[shift_x, shift_y])
-        matrix = (matrix_to_topleft + matrix_transforms + matrix_to_center)
+        matrix = self._create_matrix(height, width, scale_x, scale_y, translate_x_px, translate_y_px, rotate, shear)
 
         image_warped = cv2.warpAffine(
             image,
@@ -1151,7 +1192,8 @@ class AffineCv2(Augmenter):
 
         nb_images = len(images)
         result = images
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             height, width = images[i].shape[0], images[i].shape[1]
             shift_x = width / 2.0 - 0.5
             shift_y = height / 2.0 - 0.5
@@ -1210,6 +1252,8 @@ class AffineCv2(Augmenter):
             else:
                 result[i] = images[i]
 
+        meta.map_per_image(_augment_image, nb_images)
+
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -1519,7 +1563,7 @@ class PiecewiseAffine(Augmenter):
         mode_samples = self.mode.draw_samples((nb_images,), random_state=ia.new_random_state(seed + 4))
         order_samples = self.order.draw_samples((nb_images,), random_state=ia.new_random_state(seed + 5))
 
-        for i in sm.xrange(nb_images):
+        def _augment_image(i):
             rs_image = ia.new_random_state(seeds[i])
             h, w = images[i].shape[0:2]
             transformer = self._get_transformer(h, w, nb_rows_samples[i], nb_cols_samples[i], rs_image)
@@ -1542,6 +1586,8 @@ class PiecewiseAffine(Augmenter):
 
                 result[i] = image_warped
 
+        meta.map_per_image(_augment_image, nb_images)
+
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -1815,7 +1861,8 @@ class PerspectiveTransform(Augmenter):
             random_state
         )
 
-        for i, (M, max_height, max_width) in enumerate(zip(matrices, max_heights, max_widths)):
+        def _augment_image(i):
+            M, max_height, max_width = matrices[i], max_heights[i], max_widths[i]
             # cv2.warpPerspective only supports <=4 channels
             nb_channels = images[i].shape[2]
             if nb_channels <= 4:
@@ -1834,6 +1881,8 @@ class PerspectiveTransform(Augmenter):
                 warped = ia.imresize_single_image(warped, (h, w), interpolation="cubic")
             result[i] = warped
 
+        meta.map_per_image(_augment_image, len(images))
+
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
@@ -1980,6 +2029,26 @@ class PerspectiveTransform(Augmenter):
         # return the ordered coordinates
         return pts_ordered
 
+    def _get_homography_settings(self):
+        # with keep_size, images are warped with linear interpolation and
+        # then resized with cubic interpolation, which a single warp
+        # cannot reproduce
+        if self.keep_size:
+            return None
+        return cv2.INTER_LINEAR, 0
+
+    def _draw_homographies(self, shapes, random_state):
+        matrices, max_heights, max_widths = self._create_matrices(shapes, random_state)
+        shapes_out = []
+        for i, (shape, max_height, max_width) in enumerate(zip(shapes, max_heights, max_widths)):
+            shape_warped = (max_height, max_width) + tuple(shape[2:])
+            if self.keep_size:
+                matrices[i] = np.dot(meta.compute_resize_homography(shape_warped, shape), matrices[i])
+                shapes_out.append(tuple(shape))
+            else:
+                shapes_out.append(shape_warped)
+        return matrices, shapes_out
+
     def get_parameters(self):
         return [self.jitter, self.keep_size]
 
@@ -2182,13 +2251,9 @@ class ElasticTransformation(Augmenter):
     def _augment_images(self, images, random_state, parents, hooks):
         result = images
         nb_images = len(images)
-        seeds = ia.copy_random_state(random_state).randint(0, 10**6, (nb_images+1,))
-        alphas = self.alpha.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10000))
-        sigmas = self.sigma.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10100))
-        orders = self.order.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10200))
-        cvals = self.cval.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10300))
-        modes = self.mode.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10400))
-        for i in sm.xrange(nb_images):
+        seeds, alphas, sigmas, orders, cvals, modes = self._draw_samples(nb_images, random_state)
+
+        def _augment_image(i):
             image = images[i]
             image_first_channel = np.squeeze(image[..., 0])  # TODO why this weird formulation instead of image.shape[0:2] ?
             indices_x, indices_y = ElasticTransformation.generate_indices(image_first_channel.shape, alpha=alphas[i], sigma=sigmas[i], random_state=ia.new_random_state(seeds[i]))
@@ -2200,49 +2265,95 @@ class ElasticTransformation(Augmenter):
                 cval=cvals[i],
                 mode=modes[i]
             )
+
+        meta.map_per_image(_augment_image, nb_images)
         return result
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
         nb_heatmaps = len(heatmaps)
-        seeds = ia.copy_random_state(random_state).randint(0, 10**6, (nb_heatmaps+1,))
-        alphas = self.alpha.draw_samples((nb_heatmaps,), random_state=ia.new_random_state(seeds[-1]+10000))
-        sigmas = self.sigma.draw_samples((nb_heatmaps,), random_state=ia.new_random_state(seeds[-1]+10100))
-        orders = self.order.draw_samples((nb_heatmaps,), random_state=ia.new_random_state(seeds[-1]+10200))
+        seeds, alphas, sigmas, orders, _cvals, _modes = self._draw_samples(nb_heatmaps, random_state)
         for i in sm.xrange(nb_heatmaps):
-            heatmaps_i = heatmaps[i]
-            if heatmaps_i.arr_0to1.shape[0:2] == heatmaps_i.shape[0:2]:
-                indices_x, indices_y = ElasticTransformation.generate_indices(heatmaps_i.arr_0to1.shape[0:2], alpha=alphas[i], sigma=sigmas[i], random_state=ia.new_random_state(seeds[i]))
-                heatmaps_i.arr_0to1 = ElasticTransformation.map_coordinates(
-                    heatmaps_i.arr_0to1,
-                    indices_x,
-                    indices_y,
-                    order=orders[i],
-                    cval=0,
-                    mode="constant"
-                )
-            else:
-                # heatmaps do not have the same size as augmented images
-                # this may result in indices of moved pixels being different
-                # to prevent this, we use the same image size as for the base images, but that
-                # requires resizing the heatmaps temporarily to the image sizes
-                height_orig, width_orig = heatmaps_i.arr_0to1
-                heatmaps_i = heatmaps_i.scale(heatmaps_i.shape[0:2])
-                arr_0to1 = heatmaps_i.arr_0to1
-                indices_x, indices_y = ElasticTransformation.generate_indices(arr_0to1.shape[0:2], alpha=alphas[i], sigma=sigmas[i], random_state=ia.new_random_state(seeds[i]))
-                arr_0to1_warped = ElasticTransformation.map_coordinates(
-                    arr_0to1,
-                    indices_x,
-                    indices_y,
-                    order=orders[i],
-                    cval=0,
-                    mode="constant"
-                )
-                heatmaps_i_warped = ia.HeatmapsOnImage.from_0to1(arr_0to1_warped, shape=heatmaps_i.shape, min_value=heatmaps_i.min_value, max_value=heatmaps_i.max_value)
-                heatmaps_i_warped = heatmaps_i_warped.scale((height_orig, width_orig))
-                heatmaps[i] = heatmaps_i_warped
-
+            def _generate_indices(shape):
+                return ElasticTransformation.generate_indices(shape, alpha=alphas[i], sigma=sigmas[i], random_state=ia.new_random_state(seeds[i]))
+            heatmaps[i] = self._augment_heatmaps_i(heatmaps[i], _generate_indices, orders[i])
         return heatmaps
 
+    def _augment_heatmaps_i(self, heatmaps_i, generate_indices, order):
+        if heatmaps_i.arr_0to1.shape[0:2] == heatmaps_i.shape[0:2]:
+            indices_x, indices_y = generate_indices(heatmaps_i.arr_0to1.shape[0:2])
+            heatmaps_i.arr_0to1 = ElasticTransformation.map_coordinates(
+                heatmaps_i.arr_0to1,
+                indices_x,
+                indices_y,
+                order=order,
+                cval=0,
+                mode="constant"
+            )
+            return heatmaps_i
+        else:
+            # heatmaps do not have the same size as augmented images
+            # this may result in indices of moved pixels being different
+            # to prevent this, we use the same image size as for the base images, but that
+            # requires resizing the heatmaps temporarily to the image sizes
+            height_orig, width_orig = heatmaps_i.arr_0to1.shape[0:2]
+            heatmaps_i = heatmaps_i.scale(heatmaps_i.shape[0:2])
+            arr_0to1 = heatmaps_i.arr_0to1
+            indices_x, indices_y = generate_indices(arr_0to1.shape[0:2])
+            arr_0to1_warped = ElasticTransformation.map_coordinates(
+                arr_0to1,
+                indices_x,
+                indices_y,
+                order=order,
+                cval=0,
+                mode="constant"
+            )
+            # higher interpolation orders can overshoot the [0.0, 1.0] interval
+            arr_0to1_warped = np.clip(arr_0to1_warped, 0.0, 1.0)
+            heatmaps_i_warped = ia.HeatmapsOnImage.from_0to1(arr_0to1_warped, shape=heatmaps_i.shape, min_value=heatmaps_i.min_value, max_value=heatmaps_i.max_value)
+            return heatmaps_i_warped.scale((height_orig, width_orig))
+
+    def _augment_batch(self, batch, random_state, parents, hooks):
+        # the displacement fields are generated only once per image and
+        # shared between all columns (if they have the same size), instead
+        # of once per column
+        seeds, alphas, sigmas, orders, cvals, modes = self._draw_samples(batch.nb_rows, random_state)
+        columns = [(column, value) for column, value in batch.get_columns() if column not in batch.KEYPOINTS_COLUMNS]
+
+        def _augment_row(i):
+            indices_by_shape = dict()
+
+            def _generate_indices(shape):
+                shape = tuple(shape)
+                if shape not in indices_by_shape:
+                    indices_by_shape[shape] = ElasticTransformation.generate_indices(shape, alpha=alphas[i], sigma=sigmas[i], random_state=ia.new_random_state(seeds[i]))
+                return indices_by_shape[shape]
+
+            for column, value in columns:
+                if column in batch.IMAGE_COLUMNS:
+                    indices_x, indices_y = _generate_indices(np.squeeze(value[i][..., 0]).shape)
+                    value[i] = ElasticTransformation.map_coordinates(
+                        value[i],
+                        indices_x,
+                        indices_y,
+                        order=orders[i],
+                        cval=cvals[i],
+                        mode=modes[i]
+                    )
+                else:
+                    value[i] = self._augment_heatmaps_i(value[i], _generate_indices, orders[i])
+
+        meta.map_per_image(_augment_row, batch.nb_rows)
+        return batch
+
+    def _draw_samples(self, nb_images, random_state):
+        seeds = ia.copy_random_state(random_state).randint(0, 10**6, (nb_images+1,))
+        alphas = self.alpha.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10000))
+        sigmas = self.sigma.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10100))
+        orders = self.order.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10200))
+        cvals = self.cval.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10300))
+        modes = self.mode.draw_samples((nb_images,), random_state=ia.new_random_state(seeds[-1]+10400))
+        return seeds, alphas, sigmas, orders, cvals, modes
+
     """
     def _augment_keypoints(self, keypoints_on_images, random_state, parents, hooks):
         # TODO do keypoints even have to be augmented for elastic transformations?
@@ -2298,3 +2409,250 @@ class ElasticTransformation(Augmenter):
             remapped = remapped_flat.reshape((height, width))
             result[..., c] = remapped
         return result
+
+class HomographyChain(Augmenter):
+    """
+    Augmenter that applies several geometric child augmenters using only a
+    single warp per image.
+
+    Each child must be an augmenter whose transformation of an image can be
+    expressed as a 3x3 matrix, e.g. `Fliplr`, `Flipud`, `Affine`,
+    `PerspectiveTransform`, `CropAndPad` (`Crop`, `Pad`) or `Scale`. The
+    children's matrices are sampled in the same way as during their
+    normal augmentation, multiplied to a single homography per image and then
+    applied via `cv2.warpPerspective()`. The output size of each image
+    is the size it would have after applying all children one by one.
+    Keypoints and heatmaps are transformed using the same matrices.
+
+    Instances of this augmenter are usually created automatically via
+    `Sequential.compile()`.
+
+    Parameters
+    ----------
+    children : Augmenter or list of Augmenter
+        The geometric augmenters to fuse. They are applied in the provided
+        order and keep their own random states.
+
+    interpolation : None or int, optional(default=None)
+        The cv2 interpolation flag to use for the warp, e.g.
+        `cv2.INTER_LINEAR`. If None, the interpolation used by the children
+        will be picked (nearest neighbour if no child interpolates). In that
+        case all interpolating children must use the same interpolation.
+
+    cval : None or number, optional(default=None)
+        The value to use for new pixels (e.g. created by translations).
+        If None, the value will be derived from the children (0 if none of
+        them creates new pixels).
+
+    name : string, optional(default=None)
+        See `Augmenter.__init__()`
+
+    deterministic : bool, optional(default=False)
+        See `Augmenter.__init__()`
+
+    random_state : int or np.random.RandomState or None, optional(default=None)
+        See `Augmenter.__init__()`
+
+    Examples
+    --------
+    >>> aug = iaa.HomographyChain([
+    >>>     iaa.Fliplr(0.5),
+    >>>     iaa.Affine(rotate=(-45, 45)),
+    >>>     iaa.Scale({"height": 64, "width": 64}, interpolation="linear")
+    >>> ])
+
+    flips 50 percent of all images horizontally, rotates them and resizes
+    them to 64x64 pixels, all within a single warp.
+
+    """
+
+    def __init__(self, children, interpolation=None, cval=None, name=None, deterministic=False, random_state=None):
+        super(HomographyChain, self).__init__(name=name, deterministic=deterministic, random_state=random_state)
+
+        self.children = handle_children_list(children, self.name, "then")
+        settings = [child._get_homography_settings() for child in self.children]
+        ia.do_assert(
+            all([settings_i is not None for settings_i in settings]),
+            "Expected all children of HomographyChain to be expressable as homographies, got %s." % (
+                [child.__class__.__name__ for child, settings_i in zip(self.children, settings) if settings_i is None],)
+        )
+
+        if interpolation is None:
+            interpolations = [settings_i[0] for settings_i in settings if settings_i[0] is not None]
+            ia.do_assert(
+                len(set(interpolations)) <= 1,
+                "Expected all children of HomographyChain to use the same interpolation, got %s. "
+                "Provide the interpolation explicitly to fuse them anyways." % (sorted(set(interpolations)),)
+            )
+            interpolation = interpolations[0] if len(interpolations) > 0 else cv2.INTER_NEAREST
+        ia.do_assert(interpolation in [cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC], "Expected interpolation to be cv2.INTER_NEAREST, cv2.INTER_LINEAR or cv2.INTER_CUBIC, got %s." % (interpolation,))
+        self.interpolation = interpolation
+
+        if cval is None:
+            cvals = [settings_i[1] for settings_i in settings if settings_i[1] is not None]
+            cval = cvals[0] if len(cvals) > 0 else 0
+        ia.do_assert(ia.is_single_number(cval), "Expected cval to be a number, got %s." % (type(cval),))
+        self.cval = cval
+
+    def _augment_images(self, images, random_state, parents, hooks):
+        matrices, shapes_out = self._draw_homographies([image.shape for image in images], random_state)
+        return self._augment_images_by_homographies(images, matrices, shapes_out)
+
+    def _augment_images_by_homographies(self, images, matrices, shapes_out):
+        if ia.is_np_array(images) and all([shape_out == images.shape[1:] for shape_out in shapes_out]):
+            result = images
+        else:
+            result = list(images)
+
+        def _augment_image(i):
+            matrix, shape_out = matrices[i], shapes_out[i]
+            if shape_out != images[i].shape or not np.allclose(matrix, np.eye(3)):
+                result[i] = self._warp(images[i], matrix, shape_out, self.interpolation, self.cval)
+
+        meta.map_per_image(_augment_image, len(images))
+
+        if ia.is_np_array(images) and not ia.is_np_array(result):
+            if len(set([image.shape for image in result])) == 1:
+                result = np.array(result, dtype=images.dtype)
+
+        return result
+
+    def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
+        matrices, shapes_out = self._draw_homographies([heatmaps_i.shape for heatmaps_i in heatmaps], random_state)
+        return self._augment_heatmaps_by_homographies(heatmaps, matrices, shapes_out)
+
+    def _augment_heatmaps_by_homographies(self, heatmaps, matrices, shapes_out):
+        for heatmaps_i, matrix, shape_out in zip(heatmaps, matrices, shapes_out):
+            # heatmaps may have a different size than their images, so the matrix
+            # is adapted to map from heatmap coordinates to heatmap coordinates
+            arr = heatmaps_i.arr_0to1
+            height_arr, width_arr = arr.shape[0:2]
+            height_img, width_img = heatmaps_i.shape[0:2]
+            shape_arr_out = (
+                max(int(round(shape_out[0] * (height_arr / height_img))), 1),
+                max(int(round(shape_out[1] * (width_arr / width_img))), 1),
+                arr.shape[2]
+            )
+            matrix_arr = np.dot(
+                meta.compute_resize_homography(shape_out, shape_arr_out),
+                np.dot(matrix, meta.compute_resize_homography(arr.shape, heatmaps_i.shape))
+            )
+            arr_warped = self._warp(arr, matrix_arr, shape_arr_out, self.interpolation, 0.0)
+
+            # cubic interpolation can lead to values outside of [0.0, 1.0],
+            # see https://github.com/opencv/opencv/issues/7195
+            heatmaps_i.arr_0to1 = np.clip(arr_warped, 0.0, 1.0, out=arr_warped)
+            heatmaps_i.shape = shape_out
+
+        return heatmaps
+
+    def _augment_keypoints(self, keypoints_on_images, random_state, parents, hooks):
+        matrices, shapes_out = self._draw_homographies([kps.shape for kps in keypoints_on_images], random_state)
+        return self._augment_keypoints_by_homographies(keypoints_on_images, matrices, shapes_out)
+
+    def _augment_keypoints_by_homographies(self, keypoints_on_images, matrices, shapes_out):
+        result = []
+        for keypoints_on_image, matrix, shape_out in zip(keypoints_on_images, matrices, shapes_out):
+            if keypoints_on_image.empty:
+                result.append(ia.KeypointsOnImage([], shape=shape_out))
+            else:
+                coords = keypoints_on_image.get_coords_array().astype(np.float64)
+                coords_aug = cv2.perspectiveTransform(coords[np.newaxis, ...], matrix)[0]
+                result.append(ia.KeypointsOnImage.from_coords_array(coords_aug, shape=shape_out))
+
+        return result
+
+    def _augment_batch(self, batch, random_state, parents, hooks):
+        # the homographies only depend on the image heights and widths, so
+        # they can be drawn once for all columns if these agree
+        shapes = batch.get_rowwise_shapes()
+        if shapes is None:
+            return super(HomographyChain, self)._augment_batch(batch, random_state, parents, hooks)
+
+        matrices, shapes_out = self._draw_homographies(shapes, random_state)
+        for column, value in batch.get_columns():
+            # keep the channel axis of each column
+            shapes_out_column = [shape_out[0:2] + row.shape[2:] for shape_out, row in zip(shapes_out, value)]
+            if column in batch.IMAGE_COLUMNS:
+                value = self._augment_images_by_homographies(value, matrices, shapes_out_column)
+            elif column in batch.HEATMAPS_COLUMNS:
+                value = self._augment_heatmaps_by_homographies(value, matrices, shapes_out_column)
+            else:
+                value = self._augment_keypoints_by_homographies(value, matrices, shapes_out_column)
+            setattr(batch, column, value)
+        return batch
+
+    def _get_homography_settings(self):
+        return self.interpolation, self.cval
+
+    def _draw_homographies(self, shapes, random_state):
+        # The children are not called via augment_images(), so the handling of
+        # their random states (including determinism) is replicated here.
+        # The random_state of this augmenter itself is not used.
+        shapes = [tuple(shape) for shape in shapes]
+        matrices = [np.eye(3) for _ in shapes]
+        for child in self.children:
+            if not child.activated:
+                continue
+
+            if child.deterministic:
+                state_orig = ia.get_rng_state(child.random_state)
+
+            matrices_child, shapes = child._draw_homographies(shapes, ia.copy_random_state(child.random_state))
+            ia.forward_random_state(child.random_state)
+
+            if child.deterministic:
+                ia.set_rng_state(child.random_state, state_orig)
+
+            matrices = [np.dot(matrix_child, matrix) for matrix_child, matrix in zip(matrices_child, matrices)]
+
+        return matrices, shapes
+
+    @staticmethod
+    def _warp(image, matrix, shape_out, interpolation, cval):
+        ia.do_assert(image.dtype in [np.uint8, np.uint16, np.int16, np.float32, np.float64], "HomographyChain can only handle images of dtype uint8, uint16, int16, float32 and float64, got %s." % (image.dtype,))
+        height, width = shape_out[0:2]
+        nb_channels = image.shape[2]
+        # cv2.warpPerspective only supports <=4 channels
+        if nb_channels <= 4:
+            warped = cv2.warpPerspective(
+                image,
+                matrix,
+                (width, height),
+                flags=interpolation,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=(cval,) * 4
+            )
+            # cv2 warp drops last axis if shape is (H, W, 1)
+            if warped.ndim == 2:
+                warped = warped[..., np.newaxis]
+        else:
+            warped = [
+                cv2.warpPerspective(
+                    image[..., c],
+                    matrix,
+                    (width, height),
+                    flags=interpolation,
+                    borderMode=cv2.BORDER_CONSTANT,
+                    borderValue=(cval,) * 4
+                )
+                for c in sm.xrange(nb_channels)
+            ]
+            warped = np.dstack([warped_c[..., np.newaxis] for warped_c in warped])
+        return warped
+
+    def _to_deterministic(self):
+        aug = self.copy()
+        aug.children = aug.children.to_deterministic()
+        aug.deterministic = True
+        aug.random_state = ia.new_random_state()
+        return aug
+
+    def get_parameters(self):
+        return [self.interpolation, self.cval]
+
+    def get_children_lists(self):
+        return [self.children]
+
+    def __str__(self):
+        return "HomographyChain(interpolation=%s, cval=%s, name=%s, children=%s, deterministic=%s)" % (self.interpolation, self.cval, self.name, self.children, self.deterministic)
@@ -38,7 +38,12 @@ from scipy import misc
 import itertools
 import six
 import six.moves as sm
+import os
+import sys
 import warnings
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 
 def copy_dtypes_for_restore(images, force_list=False):
@@ -131,6 +136,518 @@ def invert_reduce_to_nonempty(objs, ids, objs_reduced):
     return objs_inv
 
 
+def compute_resize_homography(from_shape, to_shape):
+    """
+    Compute the 3x3 matrix that maps pixel coordinates of an image of shape
+    `from_shape` onto an image of shape `to_shape`, i.e. a resize.
+
+    Pixel centers are aligned in the same way as in `cv2.resize()`.
+
+    Parameters
+    ----------
+    from_shape : tuple
+        Shape of the image before the resize. Only height and width are used.
+
+    to_shape : tuple
+        Shape of the image after the resize. Only height and width are used.
+
+    Returns
+    -------
+    matrix : (3,3) ndarray
+        Homography matrix of dtype float64.
+
+    """
+    from_height, from_width = from_shape[0:2]
+    to_height, to_width = to_shape[0:2]
+    scale_x = to_width / from_width
+    scale_y = to_height / from_height
+    return np.float64([
+        [scale_x, 0, 0.5 * scale_x - 0.5],
+        [0, scale_y, 0.5 * scale_y - 0.5],
+        [0, 0, 1]
+    ])
+
+
+# number of threads used by map_per_image(), see set_n_jobs()
+_N_JOBS = 1
+_THREAD_POOL = None
+_THREAD_POOL_LOCK = threading.Lock()
+_THREAD_POOL_LOCAL = threading.local()
+_THREAD_POOL_PID = os.getpid()
+
+
+def _reset_thread_pool_after_fork():
+    # forked processes inherit the pool, but not its threads, and the lock
+    # may have been held by another thread of the parent
+    global _THREAD_POOL, _THREAD_POOL_LOCK, _THREAD_POOL_PID
+    _THREAD_POOL = None
+    _THREAD_POOL_LOCK = threading.Lock()
+    _THREAD_POOL_PID = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_thread_pool_after_fork)
+
+
+def _check_thread_pool_pid():
+    # fallback for python versions without os.register_at_fork()
+    if _THREAD_POOL_PID != os.getpid():
+        _reset_thread_pool_after_fork()
+
+
+def set_n_jobs(n_jobs):
+    """
+    Set the number of threads that augmenters use to process the images of a
+    batch.
+
+    Augmenters that loop over the images of a batch and process each image
+    on its own (e.g. `Affine`, `GaussianBlur`, `Superpixels`) distribute that
+    work over a shared thread pool of the given size. Most of the per-image
+    work is done by cv2, scipy or skimage, which release the GIL, so this
+    allows to use several cores within a single process.
+    All random values are still sampled in the calling thread before the
+    images are processed, hence the results are the same for any number
+    of threads.
+
+    Parameters
+    ----------
+    n_jobs : None or int
+        Number of threads to use. 1 deactivates multithreading (default).
+        None or -1 uses as many threads as there are CPU cores.
+
+    Examples
+    --------
+    >>> iaa.set_n_jobs(4)
+    >>> images_aug = iaa.GaussianBlur(sigma=2.0).augment_images(images)
+
+    blurs the images with four threads.
+
+    """
+    global _N_JOBS, _THREAD_POOL
+    if n_jobs is None or n_jobs == -1:
+        n_jobs = multiprocessing.cpu_count()
+    ia.do_assert(ia.is_single_integer(n_jobs) and n_jobs >= 1, "Expected n_jobs to be None, -1 or an integer >= 1, got %s." % (n_jobs,))
+
+    _check_thread_pool_pid()
+    with _THREAD_POOL_LOCK:
+        if n_jobs != _N_JOBS and _THREAD_POOL is not None:
+            _THREAD_POOL.close()
+            _THREAD_POOL = None
+        _N_JOBS = n_jobs
+
+
+def get_n_jobs():
+    """
+    Get the number of threads that augmenters use to process the images of a
+    batch.
+
+    Returns
+    -------
+    n_jobs : int
+        See `set_n_jobs()`.
+
+    """
+    return _N_JOBS
+
+
+def _get_thread_pool():
+    global _THREAD_POOL
+    _check_thread_pool_pid()
+    with _THREAD_POOL_LOCK:
+        if _THREAD_POOL is None:
+            _THREAD_POOL = ThreadPool(_N_JOBS, initializer=_init_thread_pool_worker)
+        return _THREAD_POOL
+
+
+def _init_thread_pool_worker():
+    _THREAD_POOL_LOCAL.is_worker = True
+
+
+def map_per_image(func, nb_images):
+    """
+    Call `func(i)` for each image index `i`, using the thread pool if
+    `set_n_jobs()` was called with a value above 1.
+
+    `func` must not sample random values from shared random states, i.e.
+    all samples should be drawn before calling this function.
+    Calls from within the thread pool (e.g. nested augmenters) are executed
+    sequentially.
+
+    Parameters
+    ----------
+    func : callable
+        Function that receives the index of an image and augments it.
+
+    nb_images : int
+        Number of images.
+
+    Returns
+    -------
+    results : list
+        Return values of `func`, ordered by image index.
+
+    """
+    if _N_JOBS <= 1 or nb_images <= 1 or getattr(_THREAD_POOL_LOCAL, "is_worker", False):
+        return [func(i) for i in sm.xrange(nb_images)]
+    return _get_thread_pool().map(func, sm.xrange(nb_images))
+
+
+def _segmaps_to_heatmaps(segmaps):
+    heatmaps_with_nonempty = [segmap.to_heatmaps(only_nonempty=True, not_none_if_no_nonempty=True) for segmap in segmaps]
+    heatmaps = [heatmaps_i for heatmaps_i, nonempty_class_indices_i in heatmaps_with_nonempty]
+    nonempty_class_indices = [nonempty_class_indices_i for heatmaps_i, nonempty_class_indices_i in heatmaps_with_nonempty]
+    return heatmaps, nonempty_class_indices
+
+
+def _heatmaps_to_segmaps(heatmaps_aug, segmaps, nonempty_class_indices):
+    segmaps_aug = []
+    for segmap, heatmaps_aug_i, nonempty_class_indices_i in zip(segmaps, heatmaps_aug, nonempty_class_indices):
+        segmap_aug = ia.SegmentationMapOnImage.from_heatmaps(heatmaps_aug_i, class_indices=nonempty_class_indices_i, nb_classes=segmap.nb_classes)
+        segmap_aug.input_was = segmap.input_was
+        segmaps_aug.append(segmap_aug)
+    return segmaps_aug
+
+
+def _bounding_boxes_to_keypoints(bounding_boxes_on_images):
+    kps_ois = []
+    for bbs_oi in bounding_boxes_on_images:
+        kps = []
+        for bb in bbs_oi.bounding_boxes:
+            kps.extend(bb.to_keypoints())
+        kps_ois.append(ia.KeypointsOnImage(kps, shape=bbs_oi.shape))
+    return kps_ois
+
+
+def _keypoints_to_bounding_boxes(kps_ois_aug, bounding_boxes_on_images):
+    result = []
+    for img_idx, kps_oi_aug in enumerate(kps_ois_aug):
+        bbs_aug = []
+        for i in sm.xrange(len(kps_oi_aug.keypoints) // 4):
+            bb_kps = kps_oi_aug.keypoints[i*4:i*4+4]
+            x1 = min([kp.x for kp in bb_kps])
+            x2 = max([kp.x for kp in bb_kps])
+            y1 = min([kp.y for kp in bb_kps])
+            y2 = max([kp.y for kp in bb_kps])
+            bbs_aug.append(
+                bounding_boxes_on_images[img_idx].bounding_boxes[i].copy(
+                    x1=x1,
+                    y1=y1,
+                    x2=x2,
+                    y2=y2
+                )
+            )
+        result.append(
+            ia.BoundingBoxesOnImage(
+                bbs_aug,
+                shape=kps_oi_aug.shape
+            )
+        )
+    return result
+
+
+def _indices_to_slice(indices):
+    # indices are expected to be sorted and unique, as returned by np.where()
+    if len(indices) > 0 and indices[-1] - indices[0] + 1 == len(indices):
+        return slice(indices[0], indices[-1] + 1)
+    return indices
+
+
+def _is_same_view(arr1, arr2):
+    return (
+        arr1.shape == arr2.shape
+        and arr1.dtype == arr2.dtype
+        and arr1.strides == arr2.strides
+        and arr1.__array_interface__["data"][0] == arr2.__array_interface__["data"][0]
+    )
+
+
+def subselect_rows(rows, indices):
+    """
+    Select the rows (e.g. images) with the given indices.
+
+    If `rows` is an array and the indices form a contiguous range, a view
+    is returned instead of a copy.
+
+    Parameters
+    ----------
+    rows : (N,...) ndarray or list
+        Rows to select from.
+
+    indices : (M,) ndarray
+        Sorted and unique indices of the rows to select.
+
+    Returns
+    -------
+    rows_sub : (M,...) ndarray or list
+        Selected rows.
+
+    """
+    if ia.is_np_array(rows):
+        return rows[_indices_to_slice(indices)]
+    return [rows[idx] for idx in indices]
+
+
+def invert_subselect_rows_(rows, indices, rows_sub):
+    """
+    Write rows selected via `subselect_rows()` back to their positions.
+
+    Arrays are changed in-place. Rows that were augmented in-place through
+    a view are not copied again. If the written rows have a different shape
+    than `rows`, the array is turned into a list of views of its rows.
+
+    Parameters
+    ----------
+    rows : (N,...) ndarray or list
+        Rows to write into.
+
+    indices : (M,) ndarray
+        Indices that were used in `subselect_rows()`.
+
+    rows_sub : (M,...) ndarray or list
+        The (augmented) selected rows.
+
+    Returns
+    -------
+    rows : (N,...) ndarray or list
+        The changed rows. This is only a new object if an array had to be
+        turned into a list.
+
+    """
+    if len(indices) == 0:
+        return rows
+
+    if ia.is_np_array(rows):
+        if not ia.is_np_array(rows_sub) and len(set([row.shape for row in rows_sub])) == 1:
+            rows_sub = np.array(rows_sub, dtype=rows.dtype)
+
+        if ia.is_np_array(rows_sub) and rows_sub.shape[1:] == rows.shape[1:]:
+            index = _indices_to_slice(indices)
+            if not isinstance(index, slice) or not _is_same_view(rows[index], rows_sub):
+                rows[index] = rows_sub
+            return rows
+        rows = list(rows)
+
+    for idx_sub, idx in enumerate(indices):
+        rows[idx] = rows_sub[idx_sub]
+    return rows
+
+
+class _BatchInAugmentation(object):
+    """
+    Normalized version of an `ia.Batch` that is augmented in-place while it is
+    passed through the augmenter tree, see `Augmenter.augment_batch()`.
+
+    Images (and other image-like columns) always have a channel axis,
+    segmentation maps are represented as heatmaps and bounding boxes as
+    keypoints. Each column is either None or contains exactly one entry per
+    row (i.e. per image).
+
+    """
+
+    IMAGE_COLUMNS = ["images", "images_gt", "mask_gt"]
+    HEATMAPS_COLUMNS = ["heatmaps", "segmentation_maps"]
+    KEYPOINTS_COLUMNS = ["keypoints", "bounding_boxes"]
+
+    def __init__(self, images=None, images_gt=None, mask_gt=None, heatmaps=None, segmentation_maps=None,
+                 keypoints=None, bounding_boxes=None):
+        self.images = images
+        self.images_gt = images_gt
+        self.mask_gt = mask_gt
+        self.heatmaps = heatmaps
+        self.segmentation_maps = segmentation_maps
+        self.keypoints = keypoints
+        self.bounding_boxes = bounding_boxes
+        self.segmentation_maps_class_indices = None
+
+        nb_rows = set([len(value) for _, value in self.get_columns()])
+        ia.do_assert(len(nb_rows) <= 1, "Expected all columns of the batch to contain the same number of entries, got %s." % (
+            ", ".join(["%d %s" % (len(value), column) for column, value in self.get_columns()]),))
+
+    @property
+    def nb_rows(self):
+        for _, value in self.get_columns():
+            return len(value)
+        return 0
+
+    def get_columns(self):
+        """
+        Get all columns that are not None.
+
+        Returns
+        -------
+        columns : list of tuple
+            List of `(column name, value)` tuples.
+
+        """
+        columns = self.IMAGE_COLUMNS + self.HEATMAPS_COLUMNS + self.KEYPOINTS_COLUMNS
+        return [(column, getattr(self, column)) for column in columns if getattr(self, column) is not None]
+
+    def get_rowwise_shapes(self):
+        """
+        Get the image shape of each row.
+
+        Returns
+        -------
+        shapes : None or list of tuple
+            Image shape per row. None if the columns disagree about the
+            image height and width of any row.
+
+        """
+        shapes = None
+        for column, value in self.get_columns():
+            shapes_column = [row.shape for row in value]
+            if shapes is None:
+                shapes = shapes_column
+            elif any([shape[0:2] != shape_column[0:2] for shape, shape_column in zip(shapes, shapes_column)]):
+                return None
+        return shapes
+
+    def subselect_rows_by_indices(self, indices):
+        """
+        Create a batch containing only the given rows.
+
+        Arrays are views if the indices are contiguous and copies otherwise,
+        lists contain the same objects as in this batch.
+
+        Parameters
+        ----------
+        indices : iterable of int
+            Indices of the rows to select.
+
+        Returns
+        -------
+        batch : _BatchInAugmentation
+            Batch containing the selected rows.
+
+        """
+        kwargs = dict()
+        for column, value in self.get_columns():
+            kwargs[column] = subselect_rows(value, indices)
+        return _BatchInAugmentation(**kwargs)
+
+    def invert_subselect_rows_by_indices_(self, indices, batch_subselected):
+        """
+        Write the rows of a batch created by `subselect_rows_by_indices()`
+        back to their original positions in this batch.
+
+        Image arrays are converted to lists if the rows changed their shapes.
+
+        Parameters
+        ----------
+        indices : iterable of int
+            Indices that were used to create the subselected batch.
+
+        batch_subselected : _BatchInAugmentation
+            The (augmented) subselected batch.
+
+        Returns
+        -------
+        self : _BatchInAugmentation
+            This batch, changed in-place.
+
+        """
+        if len(indices) == 0:
+            return self
+
+        for column, value in self.get_columns():
+            setattr(self, column, invert_subselect_rows_(value, indices, getattr(batch_subselected, column)))
+        return self
+
+    @classmethod
+    def from_batch(cls, batch):
+        """
+        Create a normalized copy of an `ia.Batch`.
+
+        Parameters
+        ----------
+        batch : ia.Batch
+            The batch to normalize. It is not changed.
+
+        Returns
+        -------
+        batch_norm : _BatchInAugmentation
+            Normalized batch with copies of all data.
+
+        """
+        kwargs = dict()
+        for column in cls.IMAGE_COLUMNS:
+            kwargs[column] = cls._normalize_images(getattr(batch, column))
+        if batch.heatmaps is not None:
+            kwargs["heatmaps"] = [heatmaps_i.deepcopy() for heatmaps_i in batch.heatmaps]
+        nonempty_class_indices = None
+        if batch.segmentation_maps is not None:
+            kwargs["segmentation_maps"], nonempty_class_indices = _segmaps_to_heatmaps(batch.segmentation_maps)
+        if batch.keypoints is not None:
+            kwargs["keypoints"] = [kpsoi.deepcopy() for kpsoi in batch.keypoints]
+        if batch.bounding_boxes is not None:
+            kwargs["bounding_boxes"] = _bounding_boxes_to_keypoints(batch.bounding_boxes)
+        batch_norm = cls(**kwargs)
+        # required to convert the heatmaps back to segmentation maps
+        batch_norm.segmentation_maps_class_indices = nonempty_class_indices
+        return batch_norm
+
+    def to_batch_(self, batch):
+        """
+        Write the augmented columns to the `*_aug` attributes of an `ia.Batch`.
+
+        Parameters
+        ----------
+        batch : ia.Batch
+            The batch from which this normalized batch was created via
+            `from_batch()`.
+
+        Returns
+        -------
+        batch : ia.Batch
+            The input batch with its `*_aug` attributes set.
+
+        """
+        for column in self.IMAGE_COLUMNS:
+            value = getattr(self, column)
+            if value is not None:
+                value = self._unnormalize_images(value, getattr(batch, column))
+            setattr(batch, column + "_aug", value)
+        batch.heatmaps_aug = self.heatmaps
+        if self.segmentation_maps is not None:
+            batch.segmentation_maps_aug = _heatmaps_to_segmaps(self.segmentation_maps, batch.segmentation_maps, self.segmentation_maps_class_indices)
+        else:
+            batch.segmentation_maps_aug = None
+        batch.keypoints_aug = self.keypoints
+        if self.bounding_boxes is not None:
+            batch.bounding_boxes_aug = _keypoints_to_bounding_boxes(self.bounding_boxes, batch.bounding_boxes)
+        else:
+            batch.bounding_boxes_aug = None
+        return batch
+
+    @staticmethod
+    def _normalize_images(images):
+        if images is None:
+            return None
+        elif ia.is_np_array(images):
+            ia.do_assert(images.ndim in [3, 4], "Expected 3d/4d array of form (N, height, width) or (N, height, width, channels), got shape %s." % (images.shape,))
+            images_copy = np.copy(images)
+            return images_copy[..., np.newaxis] if images_copy.ndim == 3 else images_copy
+        else:
+            ia.do_assert(all([image.ndim in [2, 3] for image in images]), "Expected list of images with each image having shape (height, width) or (height, width, channels), got shapes %s." % ([image.shape for image in images],))
+            return [np.copy(image)[..., np.newaxis] if image.ndim == 2 else np.copy(image) for image in images]
+
+    @staticmethod
+    def _unnormalize_images(images_aug, images):
+        # remove channel axis that was added for 2D input images
+        if ia.is_np_array(images):
+            if images.ndim == 3:
+                if ia.is_np_array(images_aug):
+                    return np.squeeze(images_aug, axis=3)
+                return [np.squeeze(image, axis=2) for image in images_aug]
+            return images_aug
+        else:
+            images_aug = list(images_aug)
+            for i, image in enumerate(images):
+                if image.ndim == 2:
+                    images_aug[i] = np.squeeze(images_aug[i], axis=2)
+            return images_aug
+
+
 @six.add_metaclass(ABCMeta)
 class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, line-too-long
     """
@@ -194,11 +711,11 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         elif isinstance(random_state, np.random.RandomState):
             self.random_state = random_state
         else:
-            self.random_state = np.random.RandomState(random_state)
+            self.random_state = ia.new_random_state(random_state)
 
         self.activated = True
 
-    def augment_batches(self, batches, hooks=None, background=False):
+    def augment_batches(self, batches, hooks=None, background=False, pool=None):
         """
         Augment multiple batches of images.
 
@@ -219,6 +736,11 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
 
             where N = number of images, H = height, W = width, C = number of channels.
             Each image is recommended to have dtype uint8 (range 0-255).
+            Batches with heatmaps, segmentation maps, bounding boxes or
+            ground truth images are augmented via `augment_batch()`, also in
+            background processes. Encoded images (`ia.Batch.images_encoded`)
+            are decoded and images of `ia.Batch.images_filepath` read before
+            the augmentation.
 
         hooks : None or ia.HooksImages, optional(default=None)
             HooksImages object to dynamically interfere with the augmentation
@@ -229,6 +751,11 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             If true, hooks can currently not be used as that would require
             pickling functions.
 
+        pool : None or ia.AugmentationPool, optional(default=None)
+            A pool of background processes to use instead of starting new
+            ones. Implies `background=True`. The pool's augmenter is set to
+            this augmenter. Batches are yielded in their input order.
+
         Yields
         -------
         augmented_batch : ia.Batch or list of ia.KeypointsOnImage or list of (H,W,C) ndarray or list of (H,W) ndarray or (N,H,W,C) ndarray or (N,H,W) ndarray
@@ -238,7 +765,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         """
         ia.do_assert(isinstance(batches, list))
         ia.do_assert(len(batches) > 0)
-        if background:
+        if background or pool is not None:
             ia.do_assert(hooks is None, "Hooks can not be used when background augmentation is activated.")
 
         batches_normalized = []
@@ -291,19 +818,30 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
                 batch_unnormalized = batch_aug.keypoints_aug
             return batch_unnormalized
 
-        if not background:
+        if pool is not None:
+            for batch_aug in pool.map_batches(batches_normalized, augseq=self):
+                yield unnormalize_batch(batch_aug)
+        elif not background:
             for batch_normalized in batches_normalized:
+                batch_normalized.load_images_()
                 batch_augment_images = batch_normalized.images is not None
                 batch_augment_keypoints = batch_normalized.keypoints is not None
-
-                if batch_augment_images and batch_augment_keypoints:
-                    augseq_det = self.to_deterministic() if not self.deterministic else self
-                    batch_normalized.images_aug = augseq_det.augment_images(batch_normalized.images, hooks=hooks)
-                    batch_normalized.keypoints_aug = augseq_det.augment_keypoints(batch_normalized.keypoints, hooks=hooks)
+                batch_augment_other = any([getattr(batch_normalized, column) is not None
+                                           for column in ["images_gt", "mask_gt", "heatmaps", "segmentation_maps",
+                                                          "bounding_boxes"]])
+
+                if batch_augment_other:
+                    batch_normalized = self.augment_batch(batch_normalized, hooks=hooks)
+                elif batch_augment_images and batch_augment_keypoints:
+                    snapshot = self.snapshot_random_states()
+                    batch_normalized.images_aug = self.augment_images(batch_normalized.images, hooks=hooks)
+                    self.restore_random_states(snapshot)
+                    batch_normalized.keypoints_aug = self.augment_keypoints(batch_normalized.keypoints, hooks=hooks)
                 elif batch_augment_images:
                     batch_normalized.images_aug = self.augment_images(batch_normalized.images, hooks=hooks)
                 elif batch_augment_keypoints:
                     batch_normalized.keypoints_aug = self.augment_keypoints(batch_normalized.keypoints, hooks=hooks)
+                batch_normalized.store_images_aug_()
                 batch_unnormalized = unnormalize_batch(batch_normalized)
                 yield batch_unnormalized
         else:
@@ -323,7 +861,240 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             batch_loader.terminate()
             bg_augmenter.terminate()
 
-    def augment_image(self, image, hooks=None):
+    def augment_batches_async(self, batches, nb_workers="auto", max_in_flight=None, processes=False):
+        """
+        Augment batches from asyncio code.
+
+        The batches are augmented on a pool of threads or processes, the event
+        loop only waits for the results. Each batch is augmented via
+        `augment_batch()` with its own seed, which is sampled from this
+        augmenter's random state in the order of `batches`. The results are
+        hence independent of the number of workers.
+        Requires python 3.7 or newer.
+
+        Parameters
+        ----------
+        batches : iterable or async iterable of ia.Batch
+            The batches to augment. Synchronous iterables are iterated in the
+            event loop and should therefore not block.
+
+        nb_workers : "auto" or int, optional(default="auto")
+            Number of threads or processes. If "auto", it will be set to the
+            number of CPU cores.
+
+        max_in_flight : None or int, optional(default=None)
+            Maximum number of batches that are augmented at the same time or
+            wait to be consumed. No further batches are read from `batches`
+            while this number is reached. If None, it will be set to twice
+            the number of workers.
+
+        processes : bool, optional(default=False)
+            Whether to augment in processes (True) or threads (False).
+            Threads work well for augmenters that spend most of their time in
+            cv2, scipy or skimage, which release the GIL. Processes require
+            the augmenter and batches to be picklable.
+
+        Returns
+        -------
+        batches_aug : async generator of ia.Batch
+            The augmented batches, in the order of `batches`. Stopping the
+            iteration or cancelling the consuming task cancels all batches
+            that were not yet augmented.
+
+        Examples
+        --------
+        >>> async def train(seq, source):
+        >>>     async for batch in seq.augment_batches_async(source, max_in_flight=8):
+        >>>         await model.train_step(batch.images_aug)
+
+        """
+        if sys.version_info < (3, 7):
+            raise Exception("augment_batches_async() requires python 3.7 or newer.")
+        from ..aio import augment_batches_async
+        return augment_batches_async(self, batches, nb_workers=nb_workers, max_in_flight=max_in_flight,
+                                     processes=processes)
+
+    def augment_batch(self, batch, hooks=None, seed=None):
+        """
+        Augment all modalities of a batch in a single pass.
+
+        In contrast to calling `augment_images()`, `augment_heatmaps()`,
+        `augment_keypoints()` etc. on a deterministic augmenter, each
+        augmenter samples its random values only once and applies them to all
+        modalities of the batch. Augmenters that support this (e.g. `Affine`,
+        `ElasticTransformation`) also compute their transformations only once
+        per image. All other augmenters fall back to augmenting each modality
+        on its own with the same random states (their own and those of their
+        children).
+
+        Parameters
+        ----------
+        batch : ia.Batch
+            The batch to augment. Its `images`, `images_gt`, `mask_gt`,
+            `heatmaps`, `segmentation_maps`, `keypoints` and `bounding_boxes`
+            are augmented (if not None), each of them must contain one entry
+            per image. They are not changed in-place.
+
+        hooks : None or ia.HooksImages, optional(default=None)
+            HooksImages object to dynamically interfere with the augmentation
+            process. The hooks receive the batch's images as their first
+            argument.
+
+        seed : None or int, optional(default=None)
+            If set, each image is augmented on its own, after reseeding this
+            augmenter with a random state derived from
+            `(seed, batch.epoch, batch.sample_ids[i])` via
+            `ia.new_random_state_for_index()`. The augmentation of an image
+            then only depends on the seed, epoch and its sample id, but not on
+            the other images in the batch or on the augmenter's previous
+            random states. `batch.sample_ids` must be set. Note that this
+            replaces the random states of this augmenter and its children.
+
+        Returns
+        -------
+        batch : ia.Batch
+            The input batch with its `*_aug` attributes set to the augmented
+            data.
+
+        Examples
+        --------
+        >>> batch = ia.Batch(images=images, heatmaps=heatmaps, keypoints=keypoints)
+        >>> batch = seq.augment_batch(batch)
+        >>> images_aug, heatmaps_aug = batch.images_aug, batch.heatmaps_aug
+
+        >>> batch = ia.Batch(images=images, sample_ids=[10, 11, 12], epoch=3)
+        >>> batch = seq.augment_batch(batch, seed=1)
+
+        augments the images with sample ids 10 to 12 in the same way in which
+        they would be augmented in any other batch with `epoch=3` and `seed=1`.
+
+        """
+        ia.do_assert(isinstance(batch, ia.Batch), "Expected ia.Batch, got %s." % (type(batch),))
+        batch_norm = _BatchInAugmentation.from_batch(batch)
+        if seed is None:
+            batch_norm = self.augment_batch_(batch_norm, hooks=hooks)
+        else:
+            batch_norm = self._augment_batch_per_sample(batch_norm, seed, batch.epoch, batch.sample_ids, hooks)
+        return batch_norm.to_batch_(batch)
+
+    def _augment_batch_per_sample(self, batch, seed, epoch, sample_ids, hooks):
+        ia.do_assert(sample_ids is not None and len(sample_ids) == batch.nb_rows,
+                     "Expected batch.sample_ids to contain one id per image, got %s." % (sample_ids,))
+        epoch = 0 if epoch is None else epoch
+        for i, sample_id in enumerate(sample_ids):
+            self.reseed(ia.new_random_state_for_index(seed, (epoch, sample_id)))
+            batch_i = self.augment_batch_(batch.subselect_rows_by_indices([i]), hooks=hooks)
+            batch.invert_subselect_rows_by_indices_([i], batch_i)
+        return batch
+
+    def augment_batch_(self, batch, parents=None, hooks=None):
+        """
+        Augment a normalized batch in-place.
+
+        This is the equivalent of `augment_images()` for batches, i.e. it
+        handles determinism and hooks and is used by augmenters to pass
+        batches to their children. Usually you will want to call
+        `augment_batch()` instead.
+
+        Parameters
+        ----------
+        batch : _BatchInAugmentation
+            The normalized batch to augment.
+
+        parents : None or list of Augmenter, optional(default=None)
+            See `augment_images()`.
+
+        hooks : None or ia.HooksImages, optional(default=None)
+            See `augment_batch()`.
+
+        Returns
+        -------
+        batch : _BatchInAugmentation
+            The augmented batch.
+
+        """
+        if self.deterministic:
+            state_orig = ia.get_rng_state(self.random_state)
+
+        if parents is None:
+            parents = []
+
+        if hooks is None:
+            hooks = ia.HooksImages()
+
+        if batch.images is not None:
+            batch.images = hooks.preprocess(batch.images, augmenter=self, parents=parents)
+
+        if hooks.is_activated(batch.images, augmenter=self, parents=parents, default=self.activated):
+            if batch.nb_rows > 0:
+                batch = self._augment_batch(
+                    batch,
+                    random_state=ia.copy_random_state(self.random_state),
+                    parents=parents,
+                    hooks=hooks
+                )
+                ia.forward_random_state(self.random_state)
+
+        if batch.images is not None:
+            batch.images = hooks.postprocess(batch.images, augmenter=self, parents=parents)
+
+        if self.deterministic:
+            ia.set_rng_state(self.random_state, state_orig)
+
+        return batch
+
+    def _augment_batch(self, batch, random_state, parents, hooks):
+        """
+        Augment all columns of a normalized batch.
+
+        This is the internal variation of `augment_batch_()`.
+        The default implementation calls `_augment_images()`,
+        `_augment_heatmaps()` and `_augment_keypoints()` for each column
+        with copies of the same random state. The random states of the
+        children are restored before each column, as the children advance
+        them in each call. Augmenters may override it to sample random values
+        or compute transformations only once for all columns.
+
+        Parameters
+        ----------
+        batch : _BatchInAugmentation
+            The batch to augment. It may be changed in-place.
+
+        random_state : np.random.RandomState
+            The random state to use for all sampling tasks during the
+            augmentation.
+
+        parents : list of Augmenter
+            See augment_images().
+
+        hooks : ia.HooksImages
+            See augment_batch().
+
+        Returns
+        -------
+        batch : _BatchInAugmentation
+            The augmented batch.
+
+        """
+        snapshot = None
+        for column, value in batch.get_columns():
+            # containers (e.g. Alpha) pass each column to their children via
+            # augment_*(), which advances the children's random states
+            if snapshot is None:
+                snapshot = self.snapshot_random_states()
+            else:
+                self.restore_random_states(snapshot)
+
+            if column in batch.IMAGE_COLUMNS:
+                value = self._augment_images(value, random_state=ia.copy_random_state(random_state), parents=parents, hooks=hooks)
+            elif column in batch.HEATMAPS_COLUMNS:
+                value = self._augment_heatmaps(value, random_state=ia.copy_random_state(random_state), parents=parents, hooks=hooks)
+            else:
+                value = self._augment_keypoints(value, random_state=ia.copy_random_state(random_state), parents=parents, hooks=hooks)
+            setattr(batch, column, value)
+        return batch
+
+    def augment_image(self, image, hooks=None, copy=True):
         """
         Augment a single image.
 
@@ -336,6 +1107,9 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             HooksImages object to dynamically interfere with the augmentation
             process.
 
+        copy : bool, optional(default=True)
+            See `augment_images()`.
+
         Returns
         -------
         img : ndarray
@@ -343,9 +1117,9 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
 
         """
         ia.do_assert(image.ndim in [2, 3], "Expected image to have shape (height, width, [channels]), got shape %s." % (image.shape,))
-        return self.augment_images([image], hooks=hooks)[0]
+        return self.augment_images([image], hooks=hooks, copy=copy)[0]
 
-    def augment_images(self, images, parents=None, hooks=None):
+    def augment_images(self, images, parents=None, hooks=None, copy=True):
         """
         Augment multiple images.
 
@@ -369,6 +1143,16 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             HooksImages object to dynamically interfere with the augmentation
             process.
 
+        copy : bool, optional(default=True)
+            Whether to copy the images before augmenting them.
+            If True, the input is never changed.
+            If False, the caller hands over ownership of the images and they
+            may be changed in-place. Note that in this case the same array
+            must not appear several times in a list of images.
+            Augmenters call their children with `copy=False`, as they only
+            hand over buffers that they own. A nested augmentation tree
+            therefore copies the images only once, in the top-level call.
+
         Returns
         -------
         images_result : ndarray or list
@@ -376,7 +1160,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
 
         """
         if self.deterministic:
-            state_orig = self.random_state.get_state()
+            state_orig = ia.get_rng_state(self.random_state)
 
         if parents is None:
             parents = []
@@ -391,7 +1175,8 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             ia.do_assert(images.ndim in [3, 4], "Expected 3d/4d array of form (N, height, width) or (N, height, width, channels), got shape %s." % (images.shape,))
 
             # copy the input, we don't want to augment it in-place
-            images_copy = np.copy(images)
+            # (unless the caller handed over ownership of the images)
+            images_copy = np.copy(images) if copy else images
 
             if images_copy.ndim == 3 and images_copy.shape[-1] in [1, 3]:
                 warnings.warn("You provided a numpy array of shape %s as input to augment_images(), "
@@ -422,7 +1207,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
                 images_copy = []
                 input_added_axis = []
                 for image in images:
-                    image_copy = np.copy(image)
+                    image_copy = np.copy(image) if copy else image
                     if image.ndim == 2:
                         image_copy = image_copy[:, :, np.newaxis]
                         input_added_axis.append(True)
@@ -488,7 +1273,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
                     images_result[i] = np.squeeze(images_result[i], axis=2)
 
         if self.deterministic:
-            self.random_state.set_state(state_orig)
+            ia.set_rng_state(self.random_state, state_orig)
 
         return images_result
 
@@ -534,7 +1319,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         """
         raise NotImplementedError()
 
-    def augment_heatmaps(self, heatmaps, parents=None, hooks=None):
+    def augment_heatmaps(self, heatmaps, parents=None, hooks=None, copy=True):
         """
         Augment a heatmap.
 
@@ -552,6 +1337,10 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             HooksHeatmaps object to dynamically interfere with the augmentation
             process.
 
+        copy : bool, optional(default=True)
+            Whether to deep-copy the heatmaps before augmenting them.
+            See `augment_images()` for details.
+
         Returns
         -------
         heatmap_result : list of ia.HeatmapsOnImage
@@ -559,7 +1348,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
 
         """
         if self.deterministic:
-            state_orig = self.random_state.get_state()
+            state_orig = ia.get_rng_state(self.random_state)
 
         if parents is None:
             parents = []
@@ -570,7 +1359,10 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         ia.do_assert(ia.is_iterable(heatmaps), "Expected to get list of imgaug.HeatmapsOnImage() instances, got %s." % (type(heatmaps),))
         ia.do_assert(all([isinstance(heatmaps_i, ia.HeatmapsOnImage) for heatmaps_i in heatmaps]), "Expected to get list of imgaug.HeatmapsOnImage() instances, got %s." % ([type(el) for el in heatmaps],))
 
-        heatmaps_copy = [heatmaps_i.deepcopy() for heatmaps_i in heatmaps]
+        if copy:
+            heatmaps_copy = [heatmaps_i.deepcopy() for heatmaps_i in heatmaps]
+        else:
+            heatmaps_copy = list(heatmaps)
 
         heatmaps_copy = hooks.preprocess(heatmaps_copy, augmenter=self, parents=parents)
 
@@ -591,7 +1383,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         heatmaps_result = hooks.postprocess(heatmaps_result, augmenter=self, parents=parents)
 
         if self.deterministic:
-            self.random_state.set_state(state_orig)
+            ia.set_rng_state(self.random_state, state_orig)
 
         return heatmaps_result
 
@@ -636,7 +1428,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         # TODO keep this? it is afaik not used anywhere
         heatmaps_uint8 = [heatmaps_i.to_uint8() for heatmaps_i in heatmaps]
         heatmaps_uint8_aug = [
-            self.augment_images([heatmaps_uint8_i], parents=parents, hooks=hooks)[0]
+            self.augment_images([heatmaps_uint8_i], parents=parents, hooks=hooks, copy=False)[0]
             for heatmaps_uint8_i
             in heatmaps_uint8
         ]
@@ -676,18 +1468,13 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             Corresponding augmented segmentation maps.
 
         """
-        heatmaps_with_nonempty = [segmap.to_heatmaps(only_nonempty=True, not_none_if_no_nonempty=True) for segmap in segmaps]
-        heatmaps = [heatmaps_i for heatmaps_i, nonempty_class_indices_i in heatmaps_with_nonempty]
-        nonempty_class_indices = [nonempty_class_indices_i for heatmaps_i, nonempty_class_indices_i in heatmaps_with_nonempty]
-        heatmaps_aug = self.augment_heatmaps(heatmaps)
-        segmaps_aug = []
-        for segmap, heatmaps_aug_i, nonempty_class_indices_i in zip(segmaps, heatmaps_aug, nonempty_class_indices):
-            segmap_aug = ia.SegmentationMapOnImage.from_heatmaps(heatmaps_aug_i, class_indices=nonempty_class_indices_i, nb_classes=segmap.nb_classes)
-            segmap_aug.input_was = segmap.input_was
-            segmaps_aug.append(segmap_aug)
-        return segmaps_aug
+        heatmaps, nonempty_class_indices = _segmaps_to_heatmaps(segmaps)
+        # the heatmaps were just created from the segmaps, so there is no
+        # need to copy them again
+        heatmaps_aug = self.augment_heatmaps(heatmaps, copy=False)
+        return _heatmaps_to_segmaps(heatmaps_aug, segmaps, nonempty_class_indices)
 
-    def augment_keypoints(self, keypoints_on_images, parents=None, hooks=None):
+    def augment_keypoints(self, keypoints_on_images, parents=None, hooks=None, copy=True):
         """
         Augment image keypoints.
 
@@ -729,6 +1516,10 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             HooksKeypoints object to dynamically interfere with the
             augmentation process.
 
+        copy : bool, optional(default=True)
+            Whether to deep-copy the keypoints before augmenting them.
+            See `augment_images()` for details.
+
         Returns
         -------
         keypoints_on_images_result : list of ia.KeypointsOnImage
@@ -736,7 +1527,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
 
         """
         if self.deterministic:
-            state_orig = self.random_state.get_state()
+            state_orig = ia.get_rng_state(self.random_state)
 
         if parents is None:
             parents = []
@@ -747,7 +1538,10 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         ia.do_assert(ia.is_iterable(keypoints_on_images))
         ia.do_assert(all([isinstance(keypoints_on_image, ia.KeypointsOnImage) for keypoints_on_image in keypoints_on_images]))
 
-        keypoints_on_images_copy = [keypoints_on_image.deepcopy() for keypoints_on_image in keypoints_on_images]
+        if copy:
+            keypoints_on_images_copy = [keypoints_on_image.deepcopy() for keypoints_on_image in keypoints_on_images]
+        else:
+            keypoints_on_images_copy = list(keypoints_on_images)
 
         keypoints_on_images_copy = hooks.preprocess(keypoints_on_images_copy, augmenter=self, parents=parents)
 
@@ -777,7 +1571,7 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         keypoints_on_images_result = hooks.postprocess(keypoints_on_images_result, augmenter=self, parents=parents)
 
         if self.deterministic:
-            self.random_state.set_state(state_orig)
+            ia.set_rng_state(self.random_state, state_orig)
 
         return keypoints_on_images_result
 
@@ -818,6 +1612,61 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         """
         raise NotImplementedError()
 
+    def _get_homography_settings(self):
+        """
+        Get the warp settings of this augmenter if its transformation of each
+        image can be expressed as a single 3x3 homography.
+
+        This is used by `Sequential.compile()` to find consecutive geometric
+        augmenters that can be fused into a single warp per image.
+        Augmenters that return something other than None here must also
+        implement `_draw_homographies()`.
+
+        Returns
+        -------
+        settings : None or tuple
+            None if the augmenter cannot be expressed as a homography.
+            Otherwise a tuple `(interpolation, cval)`. `interpolation` is the
+            cv2 interpolation flag that the augmenter uses for images or None
+            if it does not interpolate. It must be one of `cv2.INTER_NEAREST`,
+            `cv2.INTER_LINEAR` or `cv2.INTER_CUBIC`, as only these can be
+            reproduced by `cv2.warpPerspective()`. Augmenters that resample
+            images with other or several different interpolations must return
+            None. `cval` is the constant value used to fill new pixels or None
+            if the augmenter never creates new pixels.
+
+        """
+        return None
+
+    def _draw_homographies(self, shapes, random_state):
+        """
+        Sample one homography matrix per image.
+
+        The samples must be drawn in the same way as in `_augment_images()`
+        and `_augment_keypoints()`, so that a fused warp leads to the same
+        transformations as the non-fused augmenter.
+
+        Parameters
+        ----------
+        shapes : list of tuple
+            Shapes of the images (or of the images on which keypoints are
+            placed).
+
+        random_state : np.random.RandomState
+            The random state to use for all sampling tasks.
+
+        Returns
+        -------
+        matrices : list of (3,3) ndarray
+            One matrix per image, mapping input pixel coordinates to output
+            pixel coordinates.
+
+        shapes_out : list of tuple
+            Shapes of the images after the transformation.
+
+        """
+        raise NotImplementedError()
+
     def augment_bounding_boxes(self, bounding_boxes_on_images, hooks=None):
         """
         Augment image bounding boxes.
@@ -860,39 +1709,9 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
             Augmented bounding boxes.
 
         """
-        kps_ois = []
-        for bbs_oi in bounding_boxes_on_images:
-            kps = []
-            for bb in bbs_oi.bounding_boxes:
-                kps.extend(bb.to_keypoints())
-            kps_ois.append(ia.KeypointsOnImage(kps, shape=bbs_oi.shape))
-
-        kps_ois_aug = self.augment_keypoints(kps_ois, hooks=hooks)
-
-        result = []
-        for img_idx, kps_oi_aug in enumerate(kps_ois_aug):
-            bbs_aug = []
-            for i in sm.xrange(len(kps_oi_aug.keypoints) // 4):
-                bb_kps = kps_oi_aug.keypoints[i*4:i*4+4]
-                x1 = min([kp.x for kp in bb_kps])
-                x2 = max([kp.x for kp in bb_kps])
-                y1 = min([kp.y for kp in bb_kps])
-                y2 = max([kp.y for kp in bb_kps])
-                bbs_aug.append(
-                    bounding_boxes_on_images[img_idx].bounding_boxes[i].copy(
-                        x1=x1,
-                        y1=y1,
-                        x2=x2,
-                        y2=y2
-                    )
-                )
-            result.append(
-                ia.BoundingBoxesOnImage(
-                    bbs_aug,
-                    shape=kps_oi_aug.shape
-                )
-            )
-        return result
+        kps_ois = _bounding_boxes_to_keypoints(bounding_boxes_on_images)
+        kps_ois_aug = self.augment_keypoints(kps_ois, hooks=hooks, copy=False)
+        return _keypoints_to_bounding_boxes(kps_ois_aug, bounding_boxes_on_images)
 
     # TODO most of the code of this function could be replaced with ia.draw_grid()
     # TODO add parameter for handling multiple images ((a) next to each other
@@ -1088,6 +1907,63 @@ class Augmenter(object): # pylint: disable=locally-disabled, unused-variable, li
         aug.deterministic = True
         return aug
 
+    def snapshot_random_states(self):
+        """
+        Save the random states of this augmenter and all of its children.
+
+        This is a cheap alternative to `to_deterministic()` for augmenting
+        several inputs (e.g. images and their keypoints) in the same way:
+        Create a snapshot, augment the first input, restore the snapshot via
+        `restore_random_states()` and augment the second input.
+        Unlike `to_deterministic()`, this neither copies augmenters nor creates
+        new random states, it only saves the current state of each distinct
+        random state in the tree (the global random state only once).
+
+        Returns
+        -------
+        snapshot : list of tuple
+            List of `(random_state, state)` tuples.
+            Use `restore_random_states()` to restore the states.
+
+        Examples
+        --------
+        >>> seq = iaa.Sequential([iaa.Fliplr(0.5), iaa.Affine(rotate=(-45, 45))])
+        >>> snapshot = seq.snapshot_random_states()
+        >>> images_aug = seq.augment_images(images)
+        >>> seq.restore_random_states(snapshot)
+        >>> keypoints_aug = seq.augment_keypoints(keypoints)
+
+        augments images and keypoints in the same way, without creating a
+        deterministic copy of `seq`.
+
+        """
+        snapshot = []
+        seen = set()
+        for aug in [self] + self.get_all_children(flat=True):
+            if id(aug.random_state) not in seen:
+                seen.add(id(aug.random_state))
+                snapshot.append((aug.random_state, ia.get_rng_state(aug.random_state)))
+        return snapshot
+
+    def restore_random_states(self, snapshot):
+        """
+        Restore random states previously saved via `snapshot_random_states()`.
+
+        Parameters
+        ----------
+        snapshot : list of tuple
+            Result of `snapshot_random_states()`.
+
+        Returns
+        -------
+        self : Augmenter
+            Returns itself (with restored random states).
+
+        """
+        for random_state, state in snapshot:
+            ia.set_rng_state(random_state, state)
+        return self
+
     def reseed(self, random_state=None, deterministic_too=False):
         """
         Reseed this augmenter and all of its children (if it has any).
@@ -1717,17 +2593,37 @@ class Sequential(Augmenter, list):
                     images = self[index].augment_images(
                         images=images,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
             else:
                 for augmenter in self:
                     images = augmenter.augment_images(
                         images=images,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
         return images
 
+    def _augment_batch(self, batch, random_state, parents, hooks):
+        if hooks.is_propagating(batch.images, augmenter=self, parents=parents, default=True):
+            if self.random_order:
+                for index in random_state.permutation(len(self)):
+                    batch = self[index].augment_batch_(
+                        batch,
+                        parents=parents + [self],
+                        hooks=hooks
+                    )
+            else:
+                for augmenter in self:
+                    batch = augmenter.augment_batch_(
+                        batch,
+                        parents=parents + [self],
+                        hooks=hooks
+                    )
+        return batch
+
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
         if hooks.is_propagating(heatmaps, augmenter=self, parents=parents, default=True):
             if self.random_order:
@@ -1735,14 +2631,16 @@ class Sequential(Augmenter, list):
                     heatmaps = self[index].augment_heatmaps(
                         heatmaps=heatmaps,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
             else:
                 for augmenter in self:
                     heatmaps = augmenter.augment_heatmaps(
                         heatmaps=heatmaps,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
         return heatmaps
 
@@ -1753,14 +2651,16 @@ class Sequential(Augmenter, list):
                     keypoints_on_images = self[index].augment_keypoints(
                         keypoints_on_images=keypoints_on_images,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
             else:
                 for augmenter in self:
                     keypoints_on_images = augmenter.augment_keypoints(
                         keypoints_on_images=keypoints_on_images,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
         return keypoints_on_images
 
@@ -1772,6 +2672,96 @@ class Sequential(Augmenter, list):
         seq.deterministic = True
         return seq
 
+    def compile(self):
+        """
+        Fuse runs of consecutive geometric children into single warps.
+
+        Children such as `Fliplr`, `Flipud`, `Affine`, `PerspectiveTransform`,
+        `Crop`/`Pad` and `Scale` transform each image by a matrix. If two or
+        more of them follow each other, their matrices are multiplied to one
+        homography per image and the image is warped only once (via
+        `HomographyChain`). This saves repeated resampling of the images and
+        the associated loss of quality. Keypoints and heatmaps are
+        transformed with the same composed matrix.
+
+        A run is only fused if its children use the same interpolation and
+        the same fill value for new pixels and if their interpolation/mode
+        settings are deterministic. Children that do not interpolate (e.g.
+        flips or crops without resizing) can be fused with any other child.
+        Children that resample with an interpolation not supported by
+        `cv2.warpPerspective()` (e.g. `Scale` with area interpolation or
+        `Crop`/`Pad` and `PerspectiveTransform` with `keep_size=True`) are
+        never fused. Child sequences are compiled recursively. Sequences with
+        random order are not fused themselves. Hooks are not called for the
+        fused children.
+
+        Returns
+        -------
+        seq : Sequential
+            Shallow copy of this sequence with fused children. The children
+            themselves are not copied, i.e. they share their random states
+            with the original sequence.
+
+        Examples
+        --------
+        >>> seq = iaa.Sequential([
+        >>>     iaa.Fliplr(0.5),
+        >>>     iaa.Affine(rotate=(-20, 20)),
+        >>>     iaa.Crop(px=(0, 16), keep_size=False),
+        >>>     iaa.Scale({"height": 128, "width": 128}, interpolation="linear")
+        >>> ]).compile()
+
+        Warps each image only once instead of four times.
+
+        """
+        # local import, as geometric.py imports this module
+        from .geometric import HomographyChain
+
+        children = []
+        for child in self:
+            if isinstance(child, Sequential):
+                child = child.compile()
+            children.append(child)
+
+        if not self.random_order:
+            children_fused = []
+
+            def fuse(run):
+                if len(run) < 2:
+                    return run
+                return [HomographyChain(run, name="%s-fused%d" % (self.name, len(children_fused)))]
+
+            run = []
+            run_interpolation = None
+            run_cval = None
+            for child in children:
+                settings = child._get_homography_settings()
+                interpolation, cval = settings if settings is not None else (None, None)
+                interpolation_conflict = (
+                    interpolation is not None
+                    and run_interpolation is not None
+                    and interpolation != run_interpolation
+                )
+                cval_conflict = cval is not None and run_cval is not None and cval != run_cval
+                if settings is None or interpolation_conflict or cval_conflict:
+                    children_fused.extend(fuse(run))
+                    run = []
+                    run_interpolation = None
+                    run_cval = None
+
+                if settings is None:
+                    children_fused.append(child)
+                else:
+                    run.append(child)
+                    run_interpolation = interpolation if interpolation is not None else run_interpolation
+                    run_cval = cval if cval is not None else run_cval
+            children_fused.extend(fuse(run))
+            children = children_fused
+
+        seq = self.copy()
+        seq[:] = children
+        return seq
+
     def get_parameters(self):
         return [self.random_order]
 
@@ -1949,8 +2939,6 @@ class SomeOf(Augmenter, list):
 
     def _augment_images(self, images, random_state, parents, hooks):
         if hooks.is_propagating(images, augmenter=self, parents=parents, default=True):
-            input_is_array = ia.is_np_array(images)
-
             # This must happen before creating the augmenter_active array,
             # otherwise in case of determinism the number of augmented images
             # would change the random_state's state, resulting in the order
@@ -1974,19 +2962,18 @@ class SomeOf(Augmenter, list):
                 if len(active) > 0:
                     # pick images to augment, i.e. images for which
                     # augmenter at current index is active
-                    if input_is_array:
-                        images_to_aug = images[active]
-                    else:
-                        images_to_aug = [images[idx] for idx in active]
+                    # for arrays and contiguous indices (e.g. if the augmenter
+                    # is active for all images) this is a view, which the
+                    # child can augment in-place
+                    images_to_aug = subselect_rows(images, active)
 
                     # augment the images
                     images_to_aug = self[augmenter_index].augment_images(
                         images=images_to_aug,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
-                    output_is_array = ia.is_np_array(images_to_aug)
-                    output_all_same_shape = len(set([img.shape for img in images_to_aug])) == 1
 
                     # Map them back to their position in the images array/list
                     # But it can happen that the augmented images have different shape(s) from
@@ -1994,21 +2981,7 @@ class SomeOf(Augmenter, list):
                     # This is usually the case if a child augmenter has to change shapes, e.g.
                     # due to cropping (without resize afterwards). So accomodate here for that
                     # possibility.
-                    if input_is_array:
-                        if not output_is_array and output_all_same_shape:
-                            images_to_aug = np.array(images_to_aug, dtype=images.dtype)
-                            output_is_array = True
-
-                        if output_is_array and images_to_aug.shape[1:] == images.shape[1:]:
-                            images[active] = images_to_aug
-                        else:
-                            images = list(images)
-                            for aug_idx, original_idx in enumerate(active):
-                                images[original_idx] = images_to_aug[aug_idx]
-                            input_is_array = False
-                    else:
-                        for aug_idx, original_idx in enumerate(active):
-                            images[original_idx] = images_to_aug[aug_idx]
+                    images = invert_subselect_rows_(images, active, images_to_aug)
 
         return images
 
@@ -2043,7 +3016,8 @@ class SomeOf(Augmenter, list):
                     heatmaps_aug = self[augmenter_index].augment_heatmaps(
                         heatmaps_to_aug,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
 
                     # Map them back to their position in the images array/list
@@ -2083,7 +3057,8 @@ class SomeOf(Augmenter, list):
                     koi_to_aug = self[augmenter_index].augment_keypoints(
                         keypoints_on_images=koi_to_aug,
                         parents=parents + [self],
-                        hooks=hooks
+                        hooks=hooks,
+                        copy=False
                     )
 
                     # map them back to their position in the images array/list
@@ -2092,6 +3067,25 @@ class SomeOf(Augmenter, list):
 
         return keypoints_on_images
 
+    def _augment_batch(self, batch, random_state, parents, hooks):
+        if hooks.is_propagating(batch.images, augmenter=self, parents=parents, default=True):
+            # see _augment_images() for the order of these calls
+            augmenter_order = self._get_augmenter_order(random_state)
+            augmenter_active = self._get_augmenter_active(batch.nb_rows, random_state)
+
+            for augmenter_index in augmenter_order:
+                active = augmenter_active[:, augmenter_index].nonzero()[0]
+                if len(active) > 0:
+                    batch_to_aug = batch.subselect_rows_by_indices(active)
+                    batch_to_aug = self[augmenter_index].augment_batch_(
+                        batch_to_aug,
+                        parents=parents + [self],
+                        hooks=hooks
+                    )
+                    batch.invert_subselect_rows_by_indices_(active, batch_to_aug)
+
+        return batch
+
     def _to_deterministic(self):
         augs = [aug.to_deterministic() for aug in self]
         seq = self.copy()
@@ -2244,46 +3238,68 @@ class Sometimes(Augmenter):
             samples = self.p.draw_samples((nb_images,), random_state=random_state)
 
             # create lists/arrays of images for if and else lists (one for each)
+            # for arrays and contiguous indices these are views, which the
+            # children can augment in-place
             indices_then_list = np.where(samples == 1)[0] # np.where returns tuple(array([0, 5, 9, ...])) or tuple(array([]))
             indices_else_list = np.where(samples == 0)[0]
-            if isinstance(images, list):
-                images_then_list = [images[i] for i in indices_then_list]
-                images_else_list = [images[i] for i in indices_else_list]
-            else:
-                images_then_list = images[indices_then_list]
-                images_else_list = images[indices_else_list]
+            images_then_list = subselect_rows(images, indices_then_list)
+            images_else_list = subselect_rows(images, indices_else_list)
 
             # augment according to if and else list
             result_then_list = self.then_list.augment_images(
                 images=images_then_list,
                 parents=parents + [self],
-                hooks=hooks
+                hooks=hooks,
+                copy=False
             )
             result_else_list = self.else_list.augment_images(
                 images=images_else_list,
                 parents=parents + [self],
-                hooks=hooks
+                hooks=hooks,
+                copy=False
             )
 
             # map results of if/else lists back to their initial positions (in "images" variable)
-            result = [None] * len(images)
-            for idx_result_then_list, idx_images in enumerate(indices_then_list):
-                result[idx_images] = result_then_list[idx_result_then_list]
-            for idx_result_else_list, idx_images in enumerate(indices_else_list):
-                result[idx_images] = result_else_list[idx_result_else_list]
+            result = invert_subselect_rows_(images, indices_then_list, result_then_list)
+            result = invert_subselect_rows_(result, indices_else_list, result_else_list)
 
             # If input was a list, keep the output as a list too,
             # otherwise it was a numpy array, so make the output a numpy array too.
             # Note here though that shapes can differ between images, e.g. when using Crop
             # without resizing. In these cases, the output has to be a list.
-            all_same_shape = len(set([image.shape for image in result])) == 1
-            if input_is_np_array and all_same_shape:
+            if input_is_np_array and not ia.is_np_array(result) and len(set([image.shape for image in result])) == 1:
                 result = np.array(result, dtype=input_dtype)
         else:
             result = images
 
         return result
 
+    def _augment_batch(self, batch, random_state, parents, hooks):
+        if hooks.is_propagating(batch.images, augmenter=self, parents=parents, default=True):
+            samples = self.p.draw_samples((batch.nb_rows,), random_state=random_state)
+
+            # split the batch into the rows for the if and else lists
+            indices_then_list = np.where(samples == 1)[0]
+            indices_else_list = np.where(samples == 0)[0]
+            batch_then_list = batch.subselect_rows_by_indices(indices_then_list)
+            batch_else_list = batch.subselect_rows_by_indices(indices_else_list)
+
+            batch_then_list = self.then_list.augment_batch_(
+                batch_then_list,
+                parents=parents + [self],
+                hooks=hooks
+            )
+            batch_else_list = self.else_list.augment_batch_(
+                batch_else_list,
+                parents=parents + [self],
+                hooks=hooks
+            )
+
+            batch.invert_subselect_rows_by_indices_(indices_then_list, batch_then_list)
+            batch.invert_subselect_rows_by_indices_(indices_else_list, batch_else_list)
+
+        return batch
+
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
         if hooks.is_propagating(heatmaps, augmenter=self, parents=parents, default=True):
             nb_heatmaps = len(heatmaps)
@@ -2299,12 +3315,14 @@ class Sometimes(Augmenter):
             result_then_list = self.then_list.augment_heatmaps(
                 heatmaps_then_list,
                 parents=parents + [self],
-                hooks=hooks
+                hooks=hooks,
+                copy=False
             )
             result_else_list = self.else_list.augment_heatmaps(
                 heatmaps_else_list,
                 parents=parents + [self],
-                hooks=hooks
+                hooks=hooks,
+                copy=False
             )
 
             # map results of if/else lists back to their initial positions (in "heatmaps" variable)
@@ -2335,12 +3353,14 @@ class Sometimes(Augmenter):
             result_then_list = self.then_list.augment_keypoints(
                 keypoints_on_images=images_then_list,
                 parents=parents + [self],
-                hooks=hooks
+                hooks=hooks,
+                copy=False
             )
             result_else_list = self.else_list.augment_keypoints(
                 keypoints_on_images=images_else_list,
                 parents=parents + [self],
-                hooks=hooks
+                hooks=hooks,
+                copy=False
             )
 
             # map results of if/else lists back to their initial positions (in "images" variable)
@@ -2431,7 +3451,8 @@ class WithChannels(Augmenter):
                 result = self.children.augment_images(
                     images=images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=False
                 )
             elif len(self.channels) == 0:
                 pass
@@ -2444,7 +3465,8 @@ class WithChannels(Augmenter):
                 result_then_list = self.children.augment_images(
                     images=images_then_list,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=False
                 )
 
                 ia.do_assert(
@@ -2481,10 +3503,11 @@ class WithChannels(Augmenter):
                 heatmaps_aug = self.children.augment_heatmaps(
                     heatmaps_to_aug,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=False
                 )
 
-                for idx_orig, heatmaps_i_aug in zip(indices, heatmaps_to_aug):
+                for idx_orig, heatmaps_i_aug in zip(indices, heatmaps_aug):
                     result[idx_orig] = heatmaps_i_aug
 
         return result
@@ -2500,7 +3523,8 @@ class WithChannels(Augmenter):
                 result = self.children.augment_keypoints(
                     keypoints_on_images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=False
                 )
 
         return result
@@ -176,10 +176,13 @@ class Alpha(Augmenter): # pylint: disable=locally-disabled, unused-variable, lin
             if self.first is None:
                 images_first = images
             else:
+                # both branches start from the same images, so the first
+                # one must not change them in-place
                 images_first = self.first.augment_images(
                     images=images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=True
                 )
 
             if self.second is None:
@@ -188,7 +191,8 @@ class Alpha(Augmenter): # pylint: disable=locally-disabled, unused-variable, lin
                 images_second = self.second.augment_images(
                     images=images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=self.first is None
                 )
         else:
             images_first = images
@@ -245,7 +249,8 @@ class Alpha(Augmenter): # pylint: disable=locally-disabled, unused-variable, lin
                 heatmaps_first = self.first.augment_heatmaps(
                     heatmaps,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=True
                 )
 
             if self.second is None:
@@ -254,7 +259,8 @@ class Alpha(Augmenter): # pylint: disable=locally-disabled, unused-variable, lin
                 heatmaps_second = self.second.augment_heatmaps(
                     heatmaps,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=self.first is None
                 )
         else:
             heatmaps_first = heatmaps
@@ -294,7 +300,8 @@ class Alpha(Augmenter): # pylint: disable=locally-disabled, unused-variable, lin
                 kps_ois_first = self.first.augment_keypoints(
                     keypoints_on_images=keypoints_on_images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=True
                 )
 
             if self.second is None:
@@ -303,7 +310,8 @@ class Alpha(Augmenter): # pylint: disable=locally-disabled, unused-variable, lin
                 kps_ois_second = self.second.augment_keypoints(
                     keypoints_on_images=keypoints_on_images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=self.first is None
                 )
         else:
             kps_ois_first = keypoints_on_images
@@ -475,10 +483,13 @@ class AlphaElementwise(Alpha): # pylint: disable=locally-disabled, unused-variab
             if self.first is None:
                 images_first = images
             else:
+                # both branches start from the same images, so the first
+                # one must not change them in-place
                 images_first = self.first.augment_images(
                     images=images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=True
                 )
 
             if self.second is None:
@@ -487,7 +498,8 @@ class AlphaElementwise(Alpha): # pylint: disable=locally-disabled, unused-variab
                 images_second = self.second.augment_images(
                     images=images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=self.first is None
                 )
         else:
             images_first = images
@@ -542,7 +554,8 @@ class AlphaElementwise(Alpha): # pylint: disable=locally-disabled, unused-variab
                 heatmaps_first = self.first.augment_heatmaps(
                     heatmaps,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=True
                 )
 
             if self.second is None:
@@ -551,7 +564,8 @@ class AlphaElementwise(Alpha): # pylint: disable=locally-disabled, unused-variab
                 heatmaps_second = self.second.augment_heatmaps(
                     heatmaps,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=self.first is None
                 )
         else:
             heatmaps_first = heatmaps
@@ -601,7 +615,8 @@ class AlphaElementwise(Alpha): # pylint: disable=locally-disabled, unused-variab
                 kps_ois_first = self.first.augment_keypoints(
                     keypoints_on_images=keypoints_on_images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=True
                 )
 
             if self.second is None:
@@ -610,7 +625,8 @@ class AlphaElementwise(Alpha): # pylint: disable=locally-disabled, unused-variab
                 kps_ois_second = self.second.augment_keypoints(
                     keypoints_on_images=keypoints_on_images,
                     parents=parents + [self],
-                    hooks=hooks
+                    hooks=hooks,
+                    copy=self.first is None
                 )
         else:
             kps_ois_first = keypoints_on_images
@@ -25,7 +25,7 @@ import numpy as np
 from skimage import segmentation, measure
 import six.moves as sm
 
-from .meta import Augmenter
+from .meta import Augmenter, map_per_image
 
 # TODO tests
 class Superpixels(Augmenter):
@@ -134,7 +134,8 @@ class Superpixels(Augmenter):
         #p_replace_samples = self.p_replace.draw_samples((nb_images,), random_state=random_state)
         n_segments_samples = self.n_segments.draw_samples((nb_images,), random_state=random_state)
         seeds = random_state.randint(0, 10**6, size=(nb_images,))
-        for i in sm.xrange(nb_images):
+
+        def _augment_image(i):
             #replace_samples = ia.new_random_state(seeds[i]).binomial(1, p_replace_samples[i], size=(n_segments_samples[i],))
             # TODO this results in an error when n_segments is 0
             replace_samples = self.p_replace.draw_samples((n_segments_samples[i],), random_state=ia.new_random_state(seeds[i]))
@@ -185,6 +186,8 @@ class Superpixels(Augmenter):
                     image_sp = ia.imresize_single_image(image_sp, orig_shape[0:2], interpolation=self.interpolation)
 
                 images[i] = image_sp
+
+        map_per_image(_augment_image, nb_images)
         return images
 
     def _augment_heatmaps(self, heatmaps, random_state, parents, hooks):
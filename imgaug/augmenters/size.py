@@ -27,6 +27,7 @@ from .. import imgaug as ia
 from ..parameters import StochasticParameter, Deterministic, Choice, DiscreteUniform, Uniform
 from .. import parameters as iap
 import numpy as np
+import cv2
 import six.moves as sm
 
 from . import meta
@@ -311,6 +312,33 @@ class Scale(Augmenter):
 
         return h, w
 
+    def _get_homography_settings(self):
+        if not isinstance(self.interpolation, Deterministic):
+            return None
+        interpolation = self.interpolation.value
+        interpolation = {
+            "nearest": cv2.INTER_NEAREST,
+            "linear": cv2.INTER_LINEAR,
+            "area": cv2.INTER_AREA,
+            "cubic": cv2.INTER_CUBIC
+        }.get(interpolation, interpolation)
+        # area interpolation is not supported by cv2.warpPerspective()
+        if interpolation not in [cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC]:
+            return None
+        return interpolation, None
+
+    def _draw_homographies(self, shapes, random_state):
+        matrices = []
+        shapes_out = []
+        nb_images = len(shapes)
+        samples_h, samples_w, _samples_ip = self._draw_samples(nb_images, random_state, do_sample_ip=False)
+        for i in sm.xrange(nb_images):
+            h, w = self._compute_height_width(shapes[i], samples_h[i], samples_w[i])
+            shape_out = (int(h), int(w)) + tuple(shapes[i][2:])
+            matrices.append(meta.compute_resize_homography(shapes[i], shape_out))
+            shapes_out.append(shape_out)
+        return matrices, shapes_out
+
     def get_parameters(self):
         return [self.size, self.interpolation]
 
@@ -823,6 +851,43 @@ class CropAndPad(Augmenter):
 
         return crop_top, crop_right, crop_bottom, crop_left
 
+    def _get_homography_settings(self):
+        if not isinstance(self.pad_mode, Deterministic) or not isinstance(self.pad_cval, Deterministic):
+            return None
+        if self.pad_mode.value != "constant":
+            return None
+        # with keep_size, images are resized with area or linear
+        # interpolation depending on whether they were cropped or padded,
+        # which a single warp cannot reproduce
+        if self.keep_size:
+            return None
+        return None, self.pad_cval.value
+
+    def _draw_homographies(self, shapes, random_state):
+        matrices = []
+        shapes_out = []
+        nb_images = len(shapes)
+        seeds = random_state.randint(0, 10**6, (nb_images,))
+        for i in sm.xrange(nb_images):
+            height, width = shapes[i][0:2]
+            crop_top, crop_right, crop_bottom, crop_left, pad_top, pad_right, pad_bottom, pad_left, _pad_mode, _pad_cval = self._draw_samples_image(seeds[i], height, width)
+            matrix = np.float64([
+                [1, 0, pad_left - crop_left],
+                [0, 1, pad_top - crop_top],
+                [0, 0, 1]
+            ])
+            shape_cropped = (
+                int(height - crop_top - crop_bottom + pad_top + pad_bottom),
+                int(width - crop_left - crop_right + pad_left + pad_right)
+            ) + tuple(shapes[i][2:])
+            if self.keep_size:
+                matrix = np.dot(meta.compute_resize_homography(shape_cropped, shapes[i]), matrix)
+                shapes_out.append(tuple(shapes[i]))
+            else:
+                shapes_out.append(shape_cropped)
+            matrices.append(matrix)
+        return matrices, shapes_out
+
     def get_parameters(self):
         return [self.all_sides, self.top, self.right, self.bottom, self.left, self.pad_mode, self.pad_cval]
 
@@ -7,6 +7,7 @@ import cv2
 import math
 from scipy import misc, ndimage
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import threading
 import traceback
 import sys
@@ -17,6 +18,9 @@ import skimage.draw
 import skimage.measure
 import collections
 import time
+import json
+import bisect
+import struct
 
 if sys.version_info[0] == 2:
     import cPickle as pickle
@@ -26,6 +30,27 @@ elif sys.version_info[0] == 3:
     from queue import Empty as QueueEmpty, Full as QueueFull
     xrange = range
 
+# shared memory blocks for SharedMemoryTransport were added in python 3.8
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# optional, used to limit the threads of already loaded BLAS libraries in
+# background workers, see configure_worker_threads()
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None
+
+# clocks used by HooksProfiler
+if hasattr(time, "perf_counter"):
+    _wall_clock = time.perf_counter
+    _cpu_clock = time.process_time
+else:
+    _wall_clock = time.time
+    _cpu_clock = time.clock
+
 ALL = "ALL"
 
 # filepath to the quokka image
@@ -45,6 +70,12 @@ DEFAULT_FONT_FP = os.path.join(
 # here (and in all augmenters) instead of np.random.
 CURRENT_RANDOM_STATE = np.random.RandomState(42)
 
+# Backend used to create new random states, see set_rng_backend().
+# Counter-based bit generators were added in numpy 1.17.
+RNG_BACKENDS = ["mt19937", "philox"]
+RNG_BACKEND = "mt19937"
+NUMPY_HAS_BIT_GENERATORS = hasattr(np.random, "Philox")
+
 def is_np_array(val):
     """
     Checks whether a variable is a numpy array.
@@ -243,7 +274,75 @@ def seed(seedval):
         The seed to
         use.
     """
-    CURRENT_RANDOM_STATE.seed(seedval)
+    # RandomState.seed() only works for MT19937, so the state of a freshly
+    # seeded random state is copied instead
+    set_rng_state(CURRENT_RANDOM_STATE, get_rng_state(_create_random_state(seedval)))
+
+def set_rng_backend(backend):
+    """
+    Set the backend used to create all new random states.
+
+    The returned random states always provide the np.random.RandomState
+    interface. Only their underlying bit generator changes.
+
+    * "mt19937": numpy's default MT19937 generator. Creating a random
+      state from a seed has to initialize 624 words of state, which
+      dominates the runtime of augmenters that create many random states
+      on small images. This is the default and the only backend that
+      reproduces results of previous versions.
+    * "philox": The counter-based Philox 4x64 generator (numpy 1.17+).
+      A seed is used directly as the generator's key, so creating random
+      states and deriving new ones from seeds is O(1). Copying them is
+      cheap too, as their state is only a few words.
+
+    The global random state is switched in-place to the new backend and
+    seeded with 42, so existing references to it (e.g. of augmenters
+    without their own random state) stay valid. Random states created
+    before calling this function keep their backend, so this should be
+    called before creating any augmenters.
+
+    Parameters
+    ----------
+    backend : {"mt19937", "philox"}
+        Name of the backend.
+
+    Examples
+    --------
+    >>> import imgaug as ia
+    >>> ia.set_rng_backend("philox")
+    >>> ia.seed(1)
+    >>> seq = iaa.Sequential([iaa.Fliplr(0.5), iaa.Affine(rotate=(-10, 10))])
+
+    """
+    global RNG_BACKEND
+
+    do_assert(backend in RNG_BACKENDS, "Expected backend to be one of %s, got '%s'." % (", ".join(RNG_BACKENDS), backend))
+    if backend == "philox" and not NUMPY_HAS_BIT_GENERATORS:
+        raise Exception("RNG backend 'philox' requires numpy 1.17 or newer, got numpy %s." % (np.__version__,))
+
+    RNG_BACKEND = backend
+    # re-initializing the random state replaces its bit generator
+    CURRENT_RANDOM_STATE.__init__(np.random.Philox(key=42) if backend == "philox" else 42)
+
+def get_rng_backend():
+    """
+    Get the name of the backend used to create new random states.
+
+    Returns
+    -------
+    backend : str
+        Name of the backend, see set_rng_backend().
+
+    """
+    return RNG_BACKEND
+
+def _create_random_state(seed):
+    if RNG_BACKEND == "philox":
+        if is_single_integer(seed):
+            # use the seed directly as the key, this avoids hashing it
+            return np.random.RandomState(np.random.Philox(key=int(seed)))
+        return np.random.RandomState(np.random.Philox(seed))
+    return np.random.RandomState(seed)
 
 def current_random_state():
     """
@@ -284,7 +383,59 @@ def new_random_state(seed=None, fully_random=False):
             # because the latter one
             # is way slower.
             seed = CURRENT_RANDOM_STATE.randint(0, 10**6, 1)[0]
-    return np.random.RandomState(seed)
+    return _create_random_state(seed)
+
+def new_random_state_for_index(seed, index):
+    """
+    Returns the random state of the index-th stream derived from a seed.
+
+    Streams of different indices are independent of each other and none of
+    the previous streams have to be created to get one of them. This allows
+    e.g. to jump directly to the random state of batch k when resuming a
+    training.
+
+    Parameters
+    ----------
+    seed : int
+        Seed from which to derive the stream. Must be in the interval
+        ``[0, 2**32)``.
+
+    index : int or tuple of int
+        Index of the stream, e.g. the batch index. Must be in the interval
+        ``[0, 2**32)``. A tuple of two such values can be used for nested
+        indices, e.g. ``(epoch, sample_id)``.
+
+    Returns
+    -------
+    out : np.random.RandomState
+        The random state of the stream.
+
+    Examples
+    --------
+    >>> for batch_idx in sm.xrange(start_batch_idx, nb_batches):
+    >>>     seq.reseed(ia.new_random_state_for_index(1234, batch_idx))
+    >>>     images_aug = seq.augment_images(load_batch(batch_idx))
+
+    Continues a training at batch ``start_batch_idx`` with the same
+    augmentations as if the training had not been interrupted.
+
+    """
+    indices = list(index) if isinstance(index, tuple) else [index]
+    do_assert(0 <= seed < 2**32, "Expected seed to be in the interval [0, 2**32), got %d." % (seed,))
+    do_assert(len(indices) in [1, 2], "Expected index to be an int or a tuple of two ints, got %s." % (index,))
+    for index_i in indices:
+        do_assert(0 <= index_i < 2**32, "Expected index to be in the interval [0, 2**32), got %d." % (index_i,))
+    if RNG_BACKEND == "philox":
+        # the key has two 64 bit words, the second index goes into the
+        # upper half of the first word and nested indices are marked in the
+        # upper half of the second word, so that e.g. k and (k, 0) differ
+        key_word0 = int(seed)
+        key_word1 = int(indices[0])
+        if len(indices) == 2:
+            key_word0 += int(indices[1]) << 32
+            key_word1 += 1 << 32
+        return np.random.RandomState(np.random.Philox(key=[key_word0, key_word1]))
+    return np.random.RandomState([seed] + indices)
 
 def dummy_random_state():
     """
@@ -298,6 +449,44 @@ def dummy_random_state():
     """
     return np.random.RandomState(1)
 
+def get_rng_state(random_state):
+    """
+    Get the internal state of a random state.
+
+    Unlike ``random_state.get_state()`` this also works without warnings for
+    random states that are not based on MT19937 (e.g. of the "philox" backend).
+
+    Parameters
+    ----------
+    random_state : np.random.RandomState
+        The random state.
+
+    Returns
+    -------
+    state : tuple or dict
+        The internal state, which can be restored via set_rng_state().
+
+    """
+    if NUMPY_HAS_BIT_GENERATORS:
+        return random_state.get_state(legacy=False)
+    return random_state.get_state()
+
+def set_rng_state(random_state, state):
+    """
+    Set the internal state of a random state to one returned by get_rng_state().
+
+    Parameters
+    ----------
+    random_state : np.random.RandomState
+        The random state to change. It must use the same bit generator as
+        the one from which `state` was acquired.
+
+    state : tuple or dict
+        The internal state.
+
+    """
+    random_state.set_state(state)
+
 def copy_random_state(random_state, force_copy=False):
     """
     Creates a copy of a random state.
@@ -322,9 +511,12 @@ def copy_random_state(random_state, force_copy=False):
     if random_state == np.random and not force_copy:
         return random_state
     else:
-        rs_copy = dummy_random_state()
-        orig_state = random_state.get_state()
-        rs_copy.set_state(orig_state)
+        orig_state = get_rng_state(random_state)
+        if isinstance(orig_state, dict) and orig_state["bit_generator"] != "MT19937":
+            rs_copy = np.random.RandomState(getattr(np.random, orig_state["bit_generator"])(0))
+        else:
+            rs_copy = dummy_random_state()
+        set_rng_state(rs_copy, orig_state)
         return rs_copy
 
 def derive_random_state(random_state):
@@ -1207,6 +1399,218 @@ class HooksKeypoints(HooksImages):
     """
     pass
 
+class HooksProfiler(HooksImages):
+    """
+    Hooks that measure the time spent in each augmenter.
+
+    For each augmenter node, the profiler records the number of calls,
+    the number of augmented images, wall time, CPU time and the size in
+    bytes of the augmented outputs. Nodes are identified by their path of
+    augmenter names along the `parents` chain, so time spent in children
+    of `Sequential`, `SomeOf`, `Sometimes` etc. is attributed to the
+    respective child. Give augmenters unique names to tell apart siblings
+    of the same type.
+
+    The measured times include the time spent in all children. The exports
+    additionally provide the self time of each node, i.e. the time not
+    spent in any of its children.
+
+    The overhead is roughly 10 microseconds per augmenter call, so the
+    profiler can stay enabled for a sample of batches in production.
+
+    The same instance can be used for images, heatmaps, keypoints and
+    augment_batch() calls. It can be shared between threads.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional(default=False)
+        Whether to additionally measure the net growth of allocated memory
+        per node using `tracemalloc` (python 3 only). Tracing is started if
+        it is not already running. This slows down the augmentation
+        considerably.
+
+    activator, propagator, preprocessor, postprocessor : None or callable, optional(default=None)
+        See HooksImages.
+
+    Examples
+    --------
+    >>> profiler = ia.HooksProfiler()
+    >>> for batch_idx, images in enumerate(batches):
+    >>>     hooks = profiler if batch_idx % 100 == 0 else None
+    >>>     images_aug = seq.augment_images(images, hooks=hooks)
+    >>> with open("profile.folded", "w") as f:
+    >>>     f.write(profiler.to_collapsed_stacks())
+    >>> with open("profile.json", "w") as f:
+    >>>     f.write(profiler.to_json())
+
+    Profiles every 100th batch and saves the results in collapsed stack
+    format (e.g. for flamegraph.pl or speedscope) and as JSON.
+
+    """
+
+    STAT_KEYS = ["calls", "images", "wall_time", "cpu_time", "bytes_out", "bytes_allocated"]
+
+    def __init__(self, trace_memory=False, activator=None, propagator=None, preprocessor=None, postprocessor=None):
+        super(HooksProfiler, self).__init__(activator=activator, propagator=propagator,
+                                            preprocessor=preprocessor, postprocessor=postprocessor)
+        self.trace_memory = trace_memory
+        self.stats = dict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._get_traced_memory = lambda: tracemalloc.get_traced_memory()[0]
+        else:
+            self._get_traced_memory = lambda: 0
+
+    def reset(self):
+        """
+        Remove all recorded measurements.
+        """
+        with self._lock:
+            self.stats = dict()
+
+    def preprocess(self, images, augmenter, parents):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = []
+            self._local.stack = stack
+        stack.append((id(augmenter), len(parents), self._get_traced_memory(), _cpu_clock(), _wall_clock()))
+        return super(HooksProfiler, self).preprocess(images, augmenter, parents)
+
+    def postprocess(self, images, augmenter, parents):
+        images = super(HooksProfiler, self).postprocess(images, augmenter, parents)
+        wall_time = _wall_clock()
+        cpu_time = _cpu_clock()
+        memory = self._get_traced_memory()
+        # entries of calls that were interrupted by exceptions are skipped
+        stack = self._local.stack
+        while True:
+            augmenter_id, nb_parents, memory_start, cpu_time_start, wall_time_start = stack.pop()
+            if augmenter_id == id(augmenter) and nb_parents == len(parents):
+                break
+
+        path = tuple([parent.name for parent in parents] + [augmenter.name])
+        bytes_out = _estimate_nbytes(images)
+        with self._lock:
+            stats = self.stats.get(path)
+            if stats is None:
+                stats = dict([(key, 0) for key in self.STAT_KEYS])
+                self.stats[path] = stats
+            stats["calls"] += 1
+            stats["images"] += len(images)
+            stats["wall_time"] += wall_time - wall_time_start
+            stats["cpu_time"] += cpu_time - cpu_time_start
+            stats["bytes_out"] += bytes_out
+            stats["bytes_allocated"] += max(memory - memory_start, 0)
+        return images
+
+    def _get_stats_with_self_times(self):
+        with self._lock:
+            stats = dict([(path, dict(stats_path)) for path, stats_path in self.stats.items()])
+
+        for path, stats_path in stats.items():
+            stats_path["self_wall_time"] = stats_path["wall_time"]
+            stats_path["self_cpu_time"] = stats_path["cpu_time"]
+        for path, stats_path in stats.items():
+            parent_stats = stats.get(path[:-1])
+            if len(path) > 1 and parent_stats is not None:
+                parent_stats["self_wall_time"] -= stats_path["wall_time"]
+                parent_stats["self_cpu_time"] -= stats_path["cpu_time"]
+        for stats_path in stats.values():
+            # clock resolution can lead to slightly negative values
+            stats_path["self_wall_time"] = max(stats_path["self_wall_time"], 0.0)
+            stats_path["self_cpu_time"] = max(stats_path["self_cpu_time"], 0.0)
+        return stats
+
+    def to_dict(self):
+        """
+        Get the measurements as a tree of nested dictionaries.
+
+        Returns
+        -------
+        tree : list of dict
+            One dictionary per root augmenter. Each dictionary contains the
+            keys "name", "calls", "images", "wall_time", "cpu_time",
+            "self_wall_time", "self_cpu_time" (all times in seconds),
+            "bytes_out", "bytes_allocated" and "children", with the latter
+            being a list of dictionaries with the same structure.
+
+        """
+        stats = self._get_stats_with_self_times()
+        nodes = dict()
+        roots = []
+        for path in sorted(stats.keys(), key=len):
+            node = dict(stats[path])
+            node["name"] = path[-1]
+            node["children"] = []
+            nodes[path] = node
+            parent_node = nodes.get(path[:-1])
+            if parent_node is None:
+                roots.append(node)
+            else:
+                parent_node["children"].append(node)
+        return roots
+
+    def to_json(self, **kwargs):
+        """
+        Get the measurements as a JSON string.
+
+        Parameters
+        ----------
+        **kwargs
+            Additional arguments for `json.dumps()`, e.g. `indent`.
+
+        Returns
+        -------
+        json_str : str
+            The tree returned by to_dict() as JSON.
+
+        """
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_collapsed_stacks(self, metric="wall_time"):
+        """
+        Get the measurements in collapsed stack format.
+
+        This is the input format of flame graph tools such as `flamegraph.pl`
+        or speedscope. Each line contains the augmenter names along a path,
+        separated by semicolons, followed by the node's self time in
+        microseconds.
+
+        Parameters
+        ----------
+        metric : {"wall_time", "cpu_time"}, optional(default="wall_time")
+            Which time to export.
+
+        Returns
+        -------
+        lines : str
+            One line per augmenter node.
+
+        """
+        do_assert(metric in ["wall_time", "cpu_time"], "Expected metric to be 'wall_time' or 'cpu_time', got '%s'." % (metric,))
+        stats = self._get_stats_with_self_times()
+        lines = []
+        for path in sorted(stats.keys()):
+            names = [name.replace(";", "_").replace(" ", "_") for name in path]
+            lines.append("%s %d" % (";".join(names), int(round(stats[path]["self_" + metric] * 10**6))))
+        return "\n".join(lines) + ("\n" if len(lines) > 0 else "")
+
+def _estimate_nbytes(rows):
+    if is_np_array(rows):
+        return rows.nbytes
+    nbytes = 0
+    for row in rows:
+        if is_np_array(row):
+            nbytes += row.nbytes
+        elif isinstance(row, HeatmapsOnImage):
+            nbytes += row.arr_0to1.nbytes
+    return nbytes
+
 
 class Keypoint(object):
     """
@@ -3574,6 +3978,9 @@ class Batch(object):
     """
     Class encapsulating a batch before and after augmentation.
 
+    Batches only have the attributes listed below, custom attributes cannot
+    be set. Use `data` to attach other information to a batch.
+
     Parameters
     ----------
     images : None or (N,H,W,C) ndarray or (N,H,W) ndarray or list of (H,W,C) ndarray or list of (H,W) ndarray
@@ -3591,9 +3998,67 @@ class Batch(object):
         augmentation with multiple processes, the augmented Batch objects might
         not be returned in the original order, making this information useful.
 
+    heatmaps : None or list of HeatmapsOnImage
+        The heatmaps to
+        augment.
+
+    segmentation_maps : None or list of SegmentationMapOnImage
+        The segmentation maps to
+        augment.
+
+    bounding_boxes : None or list of BoundingBoxesOnImage
+        The bounding boxes to
+        augment.
+
+    sample_ids : None or list of int
+        Unique id of each image in the dataset, e.g. its index. Used to derive
+        one random state per image when augmenting with a seed, see
+        `Augmenter.augment_batch()`.
+
+    epoch : None or int
+        Index of the epoch, used together with `sample_ids` so that the
+        images are augmented differently in each epoch. None is treated
+        as 0.
+
+    images_encoded : None or list of bytes
+        Encoded images (e.g. the contents of JPEG or PNG files) that are
+        decoded to `images` via `decode_images_()`. Background workers
+        (BackgroundAugmenter, AugmentationPool) decode them before the
+        augmentation, so that only the encoded images are sent to them.
+
+    images_filepath : None or string
+        Path of a .npy file containing an (N,H,W,C) or (N,H,W) array of
+        images. If set, the images of the batch are the rows `sample_ids` of
+        that array, which are read via `load_images_()` (memory-mapped) in
+        the background workers. Only the path and the indices are then sent
+        to the workers.
+
+    images_aug_filepath : None or string
+        Path of a .npy file (e.g. created via `np.lib.format.open_memmap()`)
+        with one row per sample id. If set, the augmented images are written
+        to the rows `sample_ids` of that array via `store_images_aug_()` in
+        the background workers, instead of being sent back. The augmented
+        images must have the shape and dtype of the rows.
+
     """
-    def __init__(self, images=None, images_gt=None, mask_gt=None, keypoints=None, data=None):
+    # batches are created and sent in large numbers, slots avoid the
+    # overhead of a __dict__ per batch (and prevent setting other attributes)
+    __slots__ = ["images", "images_aug", "images_gt", "images_gt_aug", "mask_gt", "mask_gt_aug",
+                 "keypoints", "keypoints_aug", "heatmaps", "heatmaps_aug", "segmentation_maps",
+                 "segmentation_maps_aug", "bounding_boxes", "bounding_boxes_aug", "sample_ids", "epoch", "data",
+                 "images_encoded", "images_filepath", "images_aug_filepath"]
+
+    def __init__(self, images=None, images_gt=None, mask_gt=None, keypoints=None, data=None,
+                 heatmaps=None, segmentation_maps=None, bounding_boxes=None, sample_ids=None, epoch=None,
+                 images_encoded=None, images_filepath=None, images_aug_filepath=None):
+        do_assert(sum([value is not None for value in [images, images_encoded, images_filepath]]) <= 1,
+                  "Expected at most one of images, images_encoded and images_filepath to be set.")
+        do_assert((images_filepath is None and images_aug_filepath is None) or sample_ids is not None,
+                  "Expected sample_ids to be set if images_filepath or images_aug_filepath is set.")
         self.images = images
+        self.images_encoded = images_encoded
+        self.images_filepath = images_filepath
+        self.images_aug_filepath = images_aug_filepath
         self.images_aug = None
         self.images_gt = images_gt
         self.images_gt_aug = None
@@ -3601,182 +4066,1368 @@ class Batch(object):
         self.mask_gt_aug = None
         self.keypoints = keypoints
         self.keypoints_aug = None
+        self.heatmaps = heatmaps
+        self.heatmaps_aug = None
+        self.segmentation_maps = segmentation_maps
+        self.segmentation_maps_aug = None
+        self.bounding_boxes = bounding_boxes
+        self.bounding_boxes_aug = None
+        self.sample_ids = sample_ids
+        self.epoch = epoch
         self.data = data
 
-class BatchLoader(object):
-    """
-    Class to load batches in the background.
+    def get_attributes(self):
+        """
+        Get all attributes of the batch.
 
-    Loaded batches can be accesses using `BatchLoader.queue`.
+        Returns
+        -------
+        attributes : list of tuple
+            List of `(attribute name, value)` tuples, including attributes
+            that are None.
 
-    Parameters
-    ----------
-    load_batch_func : callable
-        Function that yields Batch objects (i.e. expected to be a generator).
-        Background loading automatically stops when the last batch was yielded.
+        """
+        return [(name, getattr(self, name)) for name in Batch.__slots__]
 
-    queue_size : int, optional(default=50)
-        Maximum number of batches to store in the queue. May be set higher
-        for small images and/or small batches.
+    # columns that contain one entry per image
+    ROW_COLUMNS = ["images", "images_gt", "mask_gt", "keypoints", "heatmaps", "segmentation_maps", "bounding_boxes"]
 
-    nb_workers : int, optional(default=1)
-        Number of workers to run in the background.
+    @classmethod
+    def _get_split_columns(cls):
+        return cls.ROW_COLUMNS + [column + "_aug" for column in cls.ROW_COLUMNS] + ["sample_ids", "images_encoded"]
 
-    threaded : bool, optional(default=True)
-        Whether to run the background processes using threads (true) or
-        full processes (false).
+    @property
+    def nb_rows(self):
+        """
+        Get the number of images (or other entries per image) in the batch.
 
-    """
+        Returns
+        -------
+        nb_rows : int
+            Number of rows, 0 if the batch contains no data.
 
-    def __init__(self, load_batch_func, queue_size=50, nb_workers=1, threaded=True):
-        do_assert(queue_size > 0)
-        do_assert(nb_workers >= 1)
-        self.queue = multiprocessing.Queue(queue_size)
-        self.join_signal = multiprocessing.Event()
-        self.finished_signals = []
-        self.workers = []
-        self.threaded = threaded
-        seeds = current_random_state().randint(0, 10**6, size=(nb_workers,))
-        for i in range(nb_workers):
-            finished_signal = multiprocessing.Event()
-            self.finished_signals.append(finished_signal)
-            if threaded:
-                worker = threading.Thread(target=self._load_batches, args=(load_batch_func, self.queue, finished_signal, self.join_signal, None))
-            else:
-                worker = multiprocessing.Process(target=self._load_batches, args=(load_batch_func, self.queue, finished_signal, self.join_signal, seeds[i]))
-            worker.daemon = True
-            worker.start()
-            self.workers.append(worker)
+        """
+        for column in self.ROW_COLUMNS + ["images_encoded"]:
+            value = getattr(self, column)
+            if value is not None:
+                return len(value)
+        if self.images_filepath is not None:
+            return len(self.sample_ids)
+        return 0
 
-    def all_finished(self):
+    def load_images_(self):
         """
-        Determine whether the workers have finished the loading process.
+        Load the images of the batch that are not contained in it, in-place.
+
+        This decodes `images_encoded` (see `decode_images_()`) and reads the
+        rows `sample_ids` of the array in `images_filepath`. Memory-mapped
+        files are opened once per process and reopened if they were replaced
+        or changed.
 
         Returns
         -------
-        out : bool
-            True if all workers have finished. Else False.
+        self : Batch
+            This batch.
 
         """
-        return all([event.is_set() for event in self.finished_signals])
+        self.decode_images_()
+        if self.images_filepath is not None and self.images is None:
+            arr = _open_npy_memmap(self.images_filepath, "r")
+            self.images = np.asarray(arr[np.array(self.sample_ids, dtype=np.int64)])
+        return self
 
-    def _load_batches(self, load_batch_func, queue, finished_signal, join_signal, seedval):
-        if seedval is not None:
-            random.seed(seedval)
-            np.random.seed(seedval)
-            seed(seedval)
+    def store_images_aug_(self):
+        """
+        Write the augmented images to the rows `sample_ids` of the array in
+        `images_aug_filepath`, in-place.
 
-        try:
-            for batch in load_batch_func():
-                do_assert(isinstance(batch, Batch), "Expected batch returned by lambda function to be of class imgaug.Batch, got %s." % (type(batch),))
-                batch_pickled = pickle.dumps(batch, protocol=-1)
-                while not join_signal.is_set():
-                    try:
-                        queue.put(batch_pickled, timeout=0.001)
-                        break
-                    except QueueFull:
-                        pass
-                if join_signal.is_set():
-                    break
-        except Exception as exc:
-            traceback.print_exc()
-        finally:
-            finished_signal.set()
+        Afterwards, `images_aug` is set to None. `images` is also set to None
+        if it was read from `images_filepath`, so that the batch contains
+        no image data anymore. Does nothing if `images_aug_filepath` is None.
 
-    def terminate(self):
+        Returns
+        -------
+        self : Batch
+            This batch.
+
+        """
+        if self.images_aug_filepath is None or self.images_aug is None:
+            return self
+        arr = _open_npy_memmap(self.images_aug_filepath, "r+")
+        images_aug = self.images_aug
+        if not is_np_array(images_aug):
+            do_assert(all([image_aug.shape == arr.shape[1:] for image_aug in images_aug]),
+                      "Expected augmented images to have shape %s to write them to %s." % (
+                          arr.shape[1:], self.images_aug_filepath))
+            images_aug = np.array(images_aug)
+        do_assert(images_aug.shape[1:] == arr.shape[1:] and images_aug.dtype == arr.dtype,
+                  "Expected augmented images to have shape %s and dtype %s to write them to %s, got %s and %s." % (
+                      arr.shape[1:], arr.dtype, self.images_aug_filepath, images_aug.shape[1:], images_aug.dtype))
+        arr[np.array(self.sample_ids, dtype=np.int64)] = images_aug
+        self.images_aug = None
+        if self.images_filepath is not None:
+            self.images = None
+        return self
+
+    def decode_images_(self):
         """
-        Stop all workers.
+        Decode `images_encoded` to RGB images, in-place.
+
+        `images` is set to an (N,H,W,3) array if all images have the same
+        shape and to a list of (H,W,3) arrays otherwise. `images_encoded` is
+        set to None. Does nothing if `images_encoded` is None.
+
+        Returns
+        -------
+        self : Batch
+            This batch.
 
         """
-        self.join_signal.set()
-        # give minimal time to put generated batches in queue and gracefully shut down
-        time.sleep(0.002)
+        if self.images_encoded is None:
+            return self
+        images = [_decode_image_bytes(encoded, False, "%d of the batch" % (i,))
+                  for i, encoded in enumerate(self.images_encoded)]
+        if len(images) > 0 and len(set([image.shape for image in images])) == 1:
+            images = np.array(images)
+        self.images = images
+        self.images_encoded = None
+        return self
 
-        # clean the queue, this reportedly prevents hanging threads
-        while True:
-            try:
-                self.queue.get(timeout=0.005)
-            except QueueEmpty:
-                break
+    def split(self, chunk_size):
+        """
+        Split the batch into batches of at most `chunk_size` rows.
 
-        if self.threaded:
-            for worker in self.workers:
-                worker.join()
-            # we don't have to set the finished_signals here, because threads always finish
-            # gracefully
-        else:
-            for worker in self.workers:
-                worker.terminate()
-                worker.join()
+        Arrays in the chunks are views of the arrays in this batch.
+        `data` is only contained in the first chunk, `epoch` in all chunks.
 
-            # wait here a tiny bit to really make sure that everything is killed before setting
-            # the finished_signals. calling set() and is_set() (via a subprocess) on them at the
-            # same time apparently results in a deadlock (at least in python 2).
-            #time.sleep(0.02)
-            for finished_signal in self.finished_signals:
-                finished_signal.set()
+        Parameters
+        ----------
+        chunk_size : int
+            Maximum number of rows per chunk.
 
-        self.queue.close()
+        Returns
+        -------
+        chunks : list of Batch
+            The chunks, in order. Contains at least one chunk.
 
-class BackgroundAugmenter(object):
-    """
-    Class to augment batches in the background (while training on the GPU).
+        """
+        do_assert(chunk_size >= 1, "Expected chunk_size to be at least 1, got %s." % (chunk_size,))
+        chunks = []
+        for start in sm.xrange(0, max(self.nb_rows, 1), chunk_size):
+            chunk = Batch(data=self.data if start == 0 else None, epoch=self.epoch)
+            chunk.images_filepath = self.images_filepath
+            chunk.images_aug_filepath = self.images_aug_filepath
+            for column in self._get_split_columns():
+                value = getattr(self, column)
+                if value is not None:
+                    setattr(chunk, column, value[start:start+chunk_size])
+            chunks.append(chunk)
+        return chunks
 
-    This is a wrapper around the multiprocessing module.
+    @classmethod
+    def merge(cls, chunks):
+        """
+        Merge batches created by `split()` into one batch.
 
-    Parameters
-    ----------
-    batch_loader : BatchLoader
-        BatchLoader object to load data in the
-        background.
+        Arrays are concatenated if all chunks contain arrays of the same
+        shape and dtype (except for the number of rows), otherwise the
+        column becomes a list.
 
-    augseq : Augmenter
-        An augmenter to apply to all loaded images.
-        This may be e.g. a Sequential to apply multiple augmenters.
+        Parameters
+        ----------
+        chunks : list of Batch
+            The chunks, in order.
 
-    queue_size : int
-        Size of the queue that is used to temporarily save the augmentation
-        results. Larger values offer the background processes more room
-        to save results when the main process doesn't load much, i.e. they
-        can lead to smoother and faster training. For large images, high
-        values can block a lot of RAM though.
+        Returns
+        -------
+        batch : Batch
+            The merged batch.
+
+        """
+        do_assert(len(chunks) > 0, "Expected at least one chunk.")
+        batch = Batch(data=chunks[0].data, epoch=chunks[0].epoch)
+        batch.images_filepath = chunks[0].images_filepath
+        batch.images_aug_filepath = chunks[0].images_aug_filepath
+        for column in cls._get_split_columns():
+            values = [getattr(chunk, column) for chunk in chunks]
+            if all([value is None for value in values]):
+                continue
+            do_assert(all([value is not None for value in values]),
+                      "Expected column %s to be set in all chunks or in none." % (column,))
+            if all([is_np_array(value) for value in values]) \
+                    and len(set([(value.shape[1:], value.dtype) for value in values])) == 1:
+                merged = np.concatenate(values, axis=0)
+            else:
+                merged = [row for value in values for row in value]
+            setattr(batch, column, merged)
+        return batch
 
-    nb_workers : "auto" or int
-        Number of background workers to spawn. If auto, it will be set
-        to C-1, where C is the number of CPU cores.
+# alignment of the out-of-band buffers within framed messages and shared
+# memory slots in bytes
+_BUFFER_ALIGNMENT = 64
 
-    """
-    def __init__(self, batch_loader, augseq, augseq_X=None, augseq_gt=None, queue_size=50, nb_workers="auto"):
-        do_assert(queue_size > 0)
-        self.augseq = augseq
-        self.augseq_X = augseq_X
-        self.augseq_gt = augseq_gt
-        self.source_finished_signals = batch_loader.finished_signals
-        self.queue_source = batch_loader.queue
-        self.queue_result = multiprocessing.Queue(queue_size)
 
-        if nb_workers == "auto":
+def _aligned(nbytes):
+    return (nbytes + _BUFFER_ALIGNMENT - 1) // _BUFFER_ALIGNMENT * _BUFFER_ALIGNMENT
+
+
+def _pickle_out_of_band(obj):
+    """
+    Pickle an object with protocol 5, keeping the data of contiguous arrays
+    out-of-band (python 3.8+).
+
+    Returns the pickled bytes without the array data and a list of flat
+    memoryviews of the data of the arrays (not copies).
+
+    """
+    buffers = []
+    header = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return header, [buffer.raw() for buffer in buffers]
+
+
+def _dumps_framed(obj):
+    """
+    Serialize an object into one bytearray, in which the data of contiguous
+    arrays follows the pickled object in raw, aligned form.
+
+    In contrast to `pickle.dumps(obj, protocol=-1)`, the message can be
+    loaded via `_loads_framed(message, copy=False)` without copying the
+    arrays. On python versions before 3.8, this is `pickle.dumps()`.
+
+    """
+    if not hasattr(pickle, "PickleBuffer"):
+        return pickle.dumps(obj, protocol=-1)
+    header, raws = _pickle_out_of_band(obj)
+    # frame: number of parts, size of each part, then the header and the
+    # buffers, each starting at an aligned offset
+    sizes = [len(header)] + [raw.nbytes for raw in raws]
+    parts = [struct.pack("<%dQ" % (1 + len(sizes),), len(sizes), *sizes)]
+    nbytes = len(parts[0])
+    for part, size in zip([header] + raws, sizes):
+        padding = _aligned(nbytes) - nbytes
+        parts.extend([bytes(padding), part])
+        nbytes += padding + size
+    # copies each part exactly once
+    return bytearray().join(parts)
+
+
+def _loads_framed(message, copy=True):
+    """
+    Load an object serialized by `_dumps_framed()`.
+
+    If `copy` is False, arrays are views of the message.
+
+    """
+    if not hasattr(pickle, "PickleBuffer"):
+        return pickle.loads(message)
+    view = memoryview(message)
+    nb_parts = struct.unpack_from("<Q", view, 0)[0]
+    sizes = struct.unpack_from("<%dQ" % (nb_parts,), view, 8)
+    parts = []
+    offset = _aligned(8 * (1 + nb_parts))
+    for size in sizes:
+        parts.append(view[offset:offset+size])
+        offset += _aligned(size)
+    buffers = parts[1:]
+    if copy:
+        buffers = [bytearray(buffer) for buffer in buffers]
+    return pickle.loads(parts[0], buffers=buffers)
+
+
+class PickleTransport(object):
+    """
+    Transport that sends batches between processes as pickled bytes.
+
+    This is the default transport of BatchLoader and BackgroundAugmenter.
+    Each batch is pickled into one message, which is then sent through the
+    pipe of a queue. In python 3.8+, pickle protocol 5 is used and the data
+    of the arrays is placed in raw form after the remaining pickled data,
+    so that decoding with `copy=False` creates views of the message instead
+    of copying the arrays again.
+
+    """
+    def encode(self, batch):
+        """
+        Convert a batch to a message that can be put into a queue.
+
+        Parameters
+        ----------
+        batch : None or Batch
+            The batch to send. None is used as a signal between workers.
+
+        Returns
+        -------
+        message : object
+            Picklable message, to be converted back via decode().
+
+        """
+        return _dumps_framed(batch)
+
+    def decode(self, message, copy=True):
+        """
+        Convert a message created by encode() back to a batch.
+
+        Parameters
+        ----------
+        message : object
+            The message received from a queue.
+
+        copy : bool, optional(default=True)
+            Whether to copy arrays that are backed by the message or by other
+            resources of the transport. If False, the arrays may be views and
+            release() has to be called on the message once they are no
+            longer used.
+
+        Returns
+        -------
+        batch : None or Batch
+            The sent batch.
+
+        """
+        return _loads_framed(message, copy=copy)
+
+    def release(self, message):
+        """
+        Free the resources of a message that was decoded with `copy=False`
+        or that will never be decoded.
+
+        Parameters
+        ----------
+        message : object
+            The message created by encode().
+
+        """
+        pass
+
+    def close(self):
+        """
+        Free all resources of the transport.
+
+        """
+        pass
+
+class SharedMemoryTransport(PickleTransport):
+    """
+    Transport that sends the arrays of batches through shared memory.
+
+    The transport preallocates `nb_slots` shared memory blocks ("slots") of
+    `slot_size` bytes each. To send a batch, it is pickled with protocol 5
+    and the data of all of its contiguous arrays (e.g. `images`,
+    `images_aug`, lists of images or the arrays of heatmaps and
+    segmentation maps) is written directly into a free slot. Only the small
+    remainder of the pickled batch is put into the queue. The receiver
+    reads the arrays from the slot and then marks the slot as free again.
+    Batches that don't fit into a slot or that are sent while all slots are
+    in use are sent completely through the queue, as in PickleTransport.
+
+    The transport has to be created in the main process. It requires
+    python 3.8 or newer.
+
+    Parameters
+    ----------
+    slot_size : int
+        Size of each slot in bytes. This should be at least the summed size
+        of all arrays in a batch. Note that batches returned by
+        BackgroundAugmenter contain both the input and the augmented images.
+
+    nb_slots : int, optional(default=16)
+        Number of slots. A value of roughly the queue size plus the number of
+        workers avoids falling back to pickling.
+
+    Examples
+    --------
+    >>> nbytes = 64 * 256 * 256 * 3
+    >>> batch_loader = ia.BatchLoader(load_batches, transport=ia.SharedMemoryTransport(nbytes))
+    >>> bg_augmenter = ia.BackgroundAugmenter(batch_loader, augseq, transport=ia.SharedMemoryTransport(2 * nbytes))
+
+    Sends batches of 64 images of size 256x256x3 via shared memory.
+
+    """
+
+    def __init__(self, slot_size, nb_slots=16):
+        if shared_memory is None:
+            raise Exception("SharedMemoryTransport requires python 3.8 or newer.")
+        do_assert(slot_size > 0, "Expected slot_size to be above 0, got %s." % (slot_size,))
+        do_assert(nb_slots >= 1, "Expected nb_slots to be at least 1, got %s." % (nb_slots,))
+        self.slot_size = int(slot_size)
+        self.nb_slots = nb_slots
+        self._owner_pid = os.getpid()
+        self._blocks = [shared_memory.SharedMemory(create=True, size=self.slot_size) for _ in sm.xrange(nb_slots)]
+        # 1 for each slot that is in use, guarded by the array's lock
+        self._slots_used = multiprocessing.Array("b", nb_slots)
+
+    def __getstate__(self):
+        # shared memory blocks are pickled by name when workers are spawned
+        state = self.__dict__.copy()
+        state["_blocks"] = [block.name for block in self._blocks]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._blocks = [shared_memory.SharedMemory(name=name) for name in state["_blocks"]]
+
+    def encode(self, batch):
+        header, raws = _pickle_out_of_band(batch)
+        buffer_offsets = []
+        nbytes = 0
+        for raw in raws:
+            buffer_offsets.append(nbytes)
+            nbytes += _aligned(raw.nbytes)
+        if len(raws) == 0 or nbytes > self.slot_size:
+            return None, super(SharedMemoryTransport, self).encode(batch)
+        slot = self._acquire_slot()
+        if slot is None:
+            return None, super(SharedMemoryTransport, self).encode(batch)
+
+        buf = self._blocks[slot].buf
+        for offset, raw in zip(buffer_offsets, raws):
+            buf[offset:offset+raw.nbytes] = raw
+        return slot, (header, [(offset, raw.nbytes) for offset, raw in zip(buffer_offsets, raws)])
+
+    def decode(self, message, copy=True):
+        slot, payload = message
+        if slot is None:
+            return super(SharedMemoryTransport, self).decode(payload, copy=copy)
+        header, buffer_locations = payload
+        buf = self._blocks[slot].buf
+        buffers = [buf[offset:offset+nbytes] for offset, nbytes in buffer_locations]
+        if copy:
+            buffers = [bytearray(buffer) for buffer in buffers]
+        batch = pickle.loads(header, buffers=buffers)
+        if copy:
+            self.release(message)
+        return batch
+
+    def _acquire_slot(self):
+        with self._slots_used.get_lock():
+            for slot in sm.xrange(self.nb_slots):
+                if self._slots_used[slot] == 0:
+                    self._slots_used[slot] = 1
+                    return slot
+        return None
+
+    def release(self, message):
+        slot = message[0]
+        if slot is not None:
+            with self._slots_used.get_lock():
+                self._slots_used[slot] = 0
+
+    def close(self):
+        for block in self._blocks:
+            try:
+                block.close()
+            except BufferError:
+                # views of the block are still in use, it is freed once they are
+                # garbage collected
+                pass
+            if os.getpid() == self._owner_pid:
+                try:
+                    block.unlink()
+                except OSError:
+                    pass
+        self._blocks = []
+
+# environment variables that control the thread pools of OpenMP and the
+# BLAS libraries numpy may be linked against
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+def get_available_cpu_cores():
+    """
+    Get the ids of the CPU cores that the current process may run on.
+
+    Returns
+    -------
+    cores : list of int
+        Ids of the available cores. If the affinity of the process can not
+        be queried, this is `0` to `C-1`, where C is the number of CPU cores.
+
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        nb_cores = multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        nb_cores = 1
+    return list(sm.xrange(nb_cores))
+
+
+def configure_worker_threads(nb_threads=1, cpu_affinity=None):
+    """
+    Limit the threads used by OpenCV, OpenMP, BLAS and imgaug's own thread
+    pool (see `imgaug.augmenters.set_n_jobs()`) in the current process and
+    optionally pin it to CPU cores.
+
+    This is called in the background processes of BackgroundAugmenter and
+    AugmentationPool, so that N workers don't each start one thread per core
+    (e.g. 15 workers with 16 OpenCV threads each on 16 cores).
+
+    Environment variables only affect libraries that are loaded afterwards.
+    BLAS libraries that are already loaded are limited via the package
+    `threadpoolctl` if it is installed.
+
+    Parameters
+    ----------
+    nb_threads : None or int, optional(default=1)
+        Number of threads that each library may use. If None, the
+        thread counts are not changed.
+
+    cpu_affinity : None or iterable of int, optional(default=None)
+        Ids of the CPU cores to run on. If None, the affinity is not changed.
+        Ignored on systems that don't support setting the affinity
+        (e.g. macOS and Windows).
+
+    """
+    if nb_threads is not None:
+        do_assert(nb_threads >= 1, "Expected nb_threads to be None or at least 1, got %s." % (nb_threads,))
+        for env_var in THREAD_ENV_VARS:
+            os.environ[env_var] = str(nb_threads)
+        cv2.setNumThreads(nb_threads)
+        if threadpoolctl is not None:
+            threadpoolctl.threadpool_limits(limits=nb_threads)
+        # imported here, as the augmenters import this module
+        from .augmenters import meta
+        meta.set_n_jobs(nb_threads)
+    if cpu_affinity is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cpu_affinity))
+
+
+def _compute_worker_thread_configs(nb_workers, threads_per_worker, pin_workers):
+    """
+    Compute the arguments of configure_worker_threads() for each worker.
+
+    If `threads_per_worker` is "auto", the available cores are split evenly
+    between the workers. Pinned workers receive consecutive blocks of
+    `threads_per_worker` cores, wrapping around if there are more threads
+    than cores.
+
+    """
+    cores = get_available_cpu_cores()
+    if threads_per_worker == "auto":
+        threads_per_worker = max(1, len(cores) // nb_workers)
+    else:
+        do_assert(threads_per_worker is None or threads_per_worker >= 1,
+                  "Expected threads_per_worker to be 'auto', None or at least 1, got %s." % (threads_per_worker,))
+
+    configs = []
+    for i in sm.xrange(nb_workers):
+        cpu_affinity = None
+        if pin_workers:
+            nb_cores_worker = threads_per_worker if threads_per_worker is not None else 1
+            cpu_affinity = [cores[(i * nb_cores_worker + j) % len(cores)] for j in sm.xrange(nb_cores_worker)]
+        configs.append((threads_per_worker, cpu_affinity))
+    return configs
+
+
+class _SharedCounters(object):
+    """
+    Counters of background workers, stored in shared memory.
+
+    Each worker only writes to its own counters, so no locks are needed.
+    Reads from other processes may be slightly outdated.
+
+    """
+    def __init__(self, names, nb_workers):
+        self.names = list(names)
+        self.nb_workers = nb_workers
+        self._indices = dict([(name, i) for i, name in enumerate(self.names)])
+        self._values = multiprocessing.Array("d", nb_workers * len(self.names), lock=False)
+
+    def add(self, worker_idx, name, value):
+        self._values[worker_idx * len(self.names) + self._indices[name]] += value
+
+    def get_per_worker(self):
+        values = self._values[:]
+        nb_names = len(self.names)
+        return [dict([(name, values[i * nb_names + j]) for j, name in enumerate(self.names)])
+                for i in sm.xrange(self.nb_workers)]
+
+    def get_totals(self):
+        per_worker = self.get_per_worker()
+        return dict([(name, sum([values[name] for values in per_worker])) for name in self.names])
+
+
+class _Histogram(object):
+    """
+    Histogram with fixed bucket upper bounds, in the style of Prometheus.
+
+    """
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        cumulative_counts = np.cumsum(self.counts).tolist()
+        return {
+            "buckets": list(zip(self.buckets + [float("inf")], cumulative_counts)),
+            "sum": self.sum,
+            "count": self.count
+        }
+
+
+# buckets of the histograms of wait times (in seconds) and queue occupancies
+STATS_WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+STATS_OCCUPANCY_BUCKETS = [0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 1.0]
+
+
+def _get_queue_occupancy(queue, queue_size):
+    try:
+        return queue.qsize() / queue_size
+    except NotImplementedError:
+        # qsize() is not available on macOS
+        return 1.0 if queue.full() else 0.0
+
+
+def _format_prometheus_metric(name, metric_type, description, samples):
+    """
+    Format a metric in the Prometheus text format.
+
+    `samples` is a list of `(labels, value)` tuples, where `labels` is a dict.
+    For histograms, `value` is a dict as returned by `_Histogram.to_dict()`.
+
+    """
+    def _format_labels(labels):
+        if len(labels) == 0:
+            return ""
+        return "{%s}" % (",".join(['%s="%s"' % (key, labels[key]) for key in sorted(labels.keys())]),)
+
+    lines = ["# HELP %s %s" % (name, description), "# TYPE %s %s" % (name, metric_type)]
+    for labels, value in samples:
+        if metric_type == "histogram":
+            for upper_bound, count in value["buckets"]:
+                labels_bucket = dict(labels)
+                labels_bucket["le"] = "+Inf" if upper_bound == float("inf") else repr(float(upper_bound))
+                lines.append("%s_bucket%s %d" % (name, _format_labels(labels_bucket), count))
+            lines.append("%s_sum%s %r" % (name, _format_labels(labels), float(value["sum"])))
+            lines.append("%s_count%s %d" % (name, _format_labels(labels), value["count"]))
+        else:
+            lines.append("%s%s %r" % (name, _format_labels(labels), float(value)))
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(filepath, sources):
+    """
+    Write the statistics of background loaders/augmenters to a file in the
+    Prometheus text format, e.g. for the textfile collector of the node
+    exporter.
+
+    The file is replaced atomically, so that it is never read half-written.
+
+    Parameters
+    ----------
+    filepath : string
+        Path of the file to write.
+
+    sources : iterable of BatchLoader or BackgroundAugmenter
+        Objects whose statistics are written, see their method
+        `get_prometheus_text()`.
+
+    """
+    text = "".join([source.get_prometheus_text() for source in sources])
+    filepath_tmp = "%s.%d.tmp" % (filepath, os.getpid())
+    with open(filepath_tmp, "w") as f:
+        f.write(text)
+    if hasattr(os, "replace"):
+        os.replace(filepath_tmp, filepath)
+    else:
+        # python 2, not atomic on windows
+        if os.path.exists(filepath) and sys.platform.startswith("win"):
+            os.remove(filepath)
+        os.rename(filepath_tmp, filepath)
+
+
+class BatchLoader(object):
+    """
+    Class to load batches in the background.
+
+    Loaded batches can be accesses using `BatchLoader.queue`. Once all workers
+    have finished, a final None is put into the queue (encoded via the
+    transport) to signal the end of the data.
+
+    Parameters
+    ----------
+    load_batch_func : callable
+        Function that yields Batch objects (i.e. expected to be a generator).
+        Background loading automatically stops when the last batch was yielded.
+
+    queue_size : int, optional(default=50)
+        Maximum number of batches to store in the queue. May be set higher
+        for small images and/or small batches.
+
+    nb_workers : int, optional(default=1)
+        Number of workers to run in the background.
+
+    threaded : bool, optional(default=True)
+        Whether to run the background processes using threads (true) or
+        full processes (false).
+
+    transport : None or PickleTransport, optional(default=None)
+        Transport used to send batches through the queue, e.g. a
+        SharedMemoryTransport. If None, batches are pickled.
+        The transport is closed in terminate().
+
+    """
+
+    # counters of each worker, see get_stats()
+    WORKER_COUNTERS = ["batches", "load_seconds", "encode_seconds", "put_wait_seconds"]
+
+    def __init__(self, load_batch_func, queue_size=50, nb_workers=1, threaded=True, transport=None):
+        do_assert(queue_size > 0)
+        do_assert(nb_workers >= 1)
+        self.queue_size = queue_size
+        self.queue = multiprocessing.Queue(queue_size)
+        self.join_signal = multiprocessing.Event()
+        self.finished_signals = []
+        self.workers = []
+        self.threaded = threaded
+        self.transport = transport if transport is not None else PickleTransport()
+        # number of workers that are still loading, the last one puts the
+        # end signal into the queue
+        nb_workers_running = multiprocessing.Value("i", nb_workers)
+        self.stats = _SharedCounters(self.WORKER_COUNTERS, nb_workers)
+        self._time_start = time.time()
+        seeds = current_random_state().randint(0, 10**6, size=(nb_workers,)).tolist()
+        for i in range(nb_workers):
+            finished_signal = multiprocessing.Event()
+            self.finished_signals.append(finished_signal)
+            args = (load_batch_func, self.queue, self.transport, finished_signal, self.join_signal, nb_workers_running,
+                    self.stats, i)
+            if threaded:
+                worker = threading.Thread(target=self._load_batches, args=args + (None,))
+            else:
+                worker = multiprocessing.Process(target=self._load_batches, args=args + (seeds[i],))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def all_finished(self):
+        """
+        Determine whether the workers have finished the loading process.
+
+        Returns
+        -------
+        out : bool
+            True if all workers have finished. Else False.
+
+        """
+        return all([event.is_set() for event in self.finished_signals])
+
+    def get_stats(self):
+        """
+        Get statistics about the loading process.
+
+        The statistics are always collected. They can be polled at any
+        time, also while the workers are running.
+
+        Returns
+        -------
+        stats : dict
+            Dictionary with the following entries:
+
+                * `uptime_seconds`: Seconds since the loader was created.
+                * `batches`: Number of batches put into the queue.
+                * `batches_per_second`: `batches` divided by `uptime_seconds`.
+                * `load_seconds`: Time spent in `load_batch_func`.
+                * `encode_seconds`: Time spent encoding batches via the
+                  transport (e.g. pickling).
+                * `put_wait_seconds`: Time spent waiting for free space in
+                  the queue, i.e. the consumer is slower than the loader.
+                * `queue_occupancy`: Current fraction of the queue that is
+                  filled.
+                * `workers`: List with a dict per worker, containing the
+                  counters above for only that worker.
+
+        """
+        stats = self.stats.get_totals()
+        stats["uptime_seconds"] = time.time() - self._time_start
+        stats["batches_per_second"] = stats["batches"] / max(stats["uptime_seconds"], 1e-8)
+        stats["queue_occupancy"] = _get_queue_occupancy(self.queue, self.queue_size)
+        stats["workers"] = self.stats.get_per_worker()
+        return stats
+
+    def get_prometheus_text(self, prefix="imgaug_batch_loader"):
+        """
+        Get the statistics in the Prometheus text format.
+
+        Parameters
+        ----------
+        prefix : string, optional(default="imgaug_batch_loader")
+            Prefix of the metric names.
+
+        Returns
+        -------
+        text : string
+            The metrics, see get_stats().
+
+        """
+        stats = self.get_stats()
+        descriptions = {
+            "batches": "Number of batches put into the queue.",
+            "load_seconds": "Seconds spent in the batch loading function.",
+            "encode_seconds": "Seconds spent encoding batches for the queue.",
+            "put_wait_seconds": "Seconds spent waiting for free space in the queue."
+        }
+        texts = []
+        for name in self.WORKER_COUNTERS:
+            samples = [({"worker": i}, values[name]) for i, values in enumerate(stats["workers"])]
+            texts.append(_format_prometheus_metric("%s_%s_total" % (prefix, name), "counter", descriptions[name], samples))
+        texts.append(_format_prometheus_metric("%s_queue_occupancy" % (prefix,), "gauge",
+                                               "Fraction of the queue that is filled.",
+                                               [({}, stats["queue_occupancy"])]))
+        return "".join(texts)
+
+    def _load_batches(self, load_batch_func, queue, transport, finished_signal, join_signal, nb_workers_running, stats, worker_idx, seedval):
+        if seedval is not None:
+            random.seed(seedval)
+            np.random.seed(seedval)
+            seed(seedval)
+
+        try:
+            time_start = time.time()
+            for batch in load_batch_func():
+                do_assert(isinstance(batch, Batch), "Expected batch returned by lambda function to be of class imgaug.Batch, got %s." % (type(batch),))
+                time_loaded = time.time()
+                message = transport.encode(batch)
+                time_encoded = time.time()
+                # blocks while the queue is full, terminate() empties the queue
+                # to wake up blocked workers
+                queue.put(message)
+                time_put = time.time()
+                stats.add(worker_idx, "batches", 1)
+                stats.add(worker_idx, "load_seconds", time_loaded - time_start)
+                stats.add(worker_idx, "encode_seconds", time_encoded - time_loaded)
+                stats.add(worker_idx, "put_wait_seconds", time_put - time_encoded)
+                time_start = time_put
+                if join_signal.is_set():
+                    break
+        except Exception as exc:
+            traceback.print_exc()
+        finally:
+            with nb_workers_running.get_lock():
+                nb_workers_running.value -= 1
+                is_last_worker = (nb_workers_running.value == 0)
+            if is_last_worker and not join_signal.is_set():
+                queue.put(transport.encode(None))
+            finished_signal.set()
+
+    def terminate(self):
+        """
+        Stop all workers.
+
+        """
+        self.join_signal.set()
+
+        # clean the queue, this reportedly prevents hanging threads
+        self._clean_queue()
+
+        if self.threaded:
+            # workers might be blocked in put() on a full queue, which we
+            # empty until they have stopped
+            for worker in self.workers:
+                worker.join(timeout=0.01)
+                while worker.is_alive():
+                    self._clean_queue()
+                    worker.join(timeout=0.01)
+            # we don't have to set the finished_signals here, because threads always finish
+            # gracefully
+        else:
+            for worker in self.workers:
+                worker.terminate()
+                worker.join()
+
+            # wait here a tiny bit to really make sure that everything is killed before setting
+            # the finished_signals. calling set() and is_set() (via a subprocess) on them at the
+            # same time apparently results in a deadlock (at least in python 2).
+            #time.sleep(0.02)
+            for finished_signal in self.finished_signals:
+                finished_signal.set()
+
+        self.queue.close()
+        self.transport.close()
+
+    def _clean_queue(self):
+        while True:
+            try:
+                self.transport.release(self.queue.get(timeout=0.005))
+            except QueueEmpty:
+                break
+
+class FileBatchLoader(BatchLoader):
+    """
+    Class to load batches of images from files or encoded bytes.
+
+    The images are read and decoded on a pool of threads (reading files and
+    `cv2.imdecode()` release the GIL), while one background thread assembles
+    them into batches. The batches are put into the queue like in
+    BatchLoader, i.e. this loader can be used with BackgroundAugmenter.
+
+    Each batch's `sample_ids` contains the index of each image in `sources`,
+    its `data` contains the file path of each image (None for bytes).
+
+    Parameters
+    ----------
+    sources : iterable of string or iterable of bytes
+        File paths of the images or the encoded images (e.g. the content of
+        JPEG or PNG files). In python 2, encoded images must be provided as
+        bytearray, as bytes are treated as file paths.
+
+    batch_size : int
+        Number of images per batch. The last batch (of each shape, see
+        `bucket_by_shape`) may contain fewer images.
+
+    nb_threads : "auto" or int, optional(default="auto")
+        Number of threads that decode images. If "auto", it will be set to
+        the number of CPU cores.
+
+    prefetch : None or int, optional(default=None)
+        Maximum number of images that are being decoded or wait to be
+        added to a batch (not counting images in incomplete shape buckets).
+        If None, it will be set to twice the batch size.
+
+    bucket_by_shape : bool, optional(default=False)
+        Whether to only combine images with the same shape into a batch.
+        Then all batches contain (N,H,W[,C]) arrays. Otherwise images are
+        combined in the order of `sources` and batches with differently
+        sized images contain lists of images.
+
+    grayscale : bool, optional(default=False)
+        Whether to decode the images as grayscale (H,W) arrays instead of
+        RGB (H,W,3) arrays.
+
+    decode : bool, optional(default=True)
+        Whether to decode the images in this loader. If False, the files are
+        only read and the batches contain the encoded images in
+        `images_encoded`, which are decoded by the workers of
+        BackgroundAugmenter or AugmentationPool. That reduces the data sent
+        between processes by about an order of magnitude for JPEG images and
+        decodes in parallel in all workers. Can not be combined with
+        `bucket_by_shape` or `grayscale`.
+
+    epoch : None or int, optional(default=None)
+        Epoch that is set in each batch, see Batch.
+
+    queue_size : int, optional(default=50)
+        Maximum number of batches to store in the queue.
+
+    transport : None or PickleTransport, optional(default=None)
+        Transport used to send batches through the queue, see BatchLoader.
+
+    Examples
+    --------
+    >>> batch_loader = ia.FileBatchLoader(glob.glob("images/*.jpg"), batch_size=32, bucket_by_shape=True)
+    >>> bg_augmenter = ia.BackgroundAugmenter(batch_loader, augseq)
+
+    Decodes the images with one thread per core and augments them in
+    background processes.
+
+    """
+
+    def __init__(self, sources, batch_size, nb_threads="auto", prefetch=None, bucket_by_shape=False,
+                 grayscale=False, decode=True, epoch=None, queue_size=50, transport=None):
+        do_assert(batch_size >= 1, "Expected batch_size to be at least 1, got %s." % (batch_size,))
+        do_assert(decode or not (bucket_by_shape or grayscale),
+                  "Expected bucket_by_shape and grayscale to be False if images are not decoded.")
+        if nb_threads == "auto":
+            try:
+                nb_threads = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                nb_threads = 1
+        do_assert(nb_threads >= 1, "Expected nb_threads to be 'auto' or at least 1, got %s." % (nb_threads,))
+        if prefetch is None:
+            prefetch = 2 * batch_size
+        do_assert(prefetch >= 1, "Expected prefetch to be None or at least 1, got %s." % (prefetch,))
+
+        self.sources = sources
+        self.batch_size = batch_size
+        self.nb_threads = nb_threads
+        self.prefetch = prefetch
+        self.bucket_by_shape = bucket_by_shape
+        self.grayscale = grayscale
+        self.decode = decode
+        self.epoch = epoch
+        super(FileBatchLoader, self).__init__(self._load_files, queue_size=queue_size, nb_workers=1, threaded=True,
+                                              transport=transport)
+
+    def _load_files(self):
+        pool = ThreadPool(self.nb_threads)
+        try:
+            # decoded images are collected per shape (or in one bucket if
+            # bucket_by_shape is False) until a bucket contains a full batch
+            buckets = collections.OrderedDict()
+            pending = collections.deque()
+            for sample_id, source in enumerate(self.sources):
+                if self.decode:
+                    result = pool.apply_async(_decode_image, (source, self.grayscale))
+                else:
+                    result = pool.apply_async(_read_image_bytes, (source,))
+                pending.append((sample_id, source, result))
+                if len(pending) >= self.prefetch:
+                    for batch in self._add_to_buckets(buckets, *pending.popleft()):
+                        yield batch
+            while len(pending) > 0:
+                for batch in self._add_to_buckets(buckets, *pending.popleft()):
+                    yield batch
+            for rows in buckets.values():
+                yield self._create_batch(rows)
+        finally:
+            pool.terminate()
+
+    def _add_to_buckets(self, buckets, sample_id, source, result):
+        image = result.get()
+        key = image.shape if self.bucket_by_shape else None
+        rows = buckets.setdefault(key, [])
+        rows.append((sample_id, source, image))
+        if len(rows) >= self.batch_size:
+            del buckets[key]
+            yield self._create_batch(rows)
+
+    def _create_batch(self, rows):
+        sample_ids = [sample_id for sample_id, _, _ in rows]
+        filepaths = [source if is_string(source) else None for _, source, _ in rows]
+        images = [image for _, _, image in rows]
+        if not self.decode:
+            return Batch(images_encoded=images, sample_ids=sample_ids, epoch=self.epoch, data=filepaths)
+        if len(set([image.shape for image in images])) == 1:
+            images = np.array(images)
+        return Batch(images=images, sample_ids=sample_ids, epoch=self.epoch, data=filepaths)
+
+
+def _read_image_bytes(source):
+    if is_string(source):
+        with open(source, "rb") as f:
+            return f.read()
+    return source
+
+
+def _decode_image(source, grayscale):
+    description = "file %s" % (source,) if is_string(source) else "of %d bytes" % (len(source),)
+    return _decode_image_bytes(_read_image_bytes(source), grayscale, description)
+
+
+def _decode_image_bytes(encoded, grayscale, description):
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    image = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), flags)
+    if image is None:
+        raise Exception("Could not decode image %s." % (description,))
+    if not grayscale:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image
+
+
+# memory-mapped .npy files opened by the current process, see
+# _open_npy_memmap()
+_NPY_MEMMAPS = dict()
+
+
+def _open_npy_memmap(filepath, mode):
+    # files may be recreated (e.g. with a different shape for the next epoch)
+    # while long-lived workers use them, so a cached memmap is only reused as
+    # long as the file's inode, size and modification time are unchanged
+    filepath = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+    identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime)
+    key = (filepath, mode, os.getpid())
+    if key not in _NPY_MEMMAPS or _NPY_MEMMAPS[key][0] != identity:
+        _NPY_MEMMAPS[key] = (identity, np.load(filepath, mmap_mode=mode))
+    return _NPY_MEMMAPS[key][1]
+
+
+class MemmapBatchLoader(BatchLoader):
+    """
+    Class to create batches of images from a memory-mapped .npy file.
+
+    The batches only contain the file path and the indices of their images
+    (as `sample_ids`), the images are read by the workers of
+    BackgroundAugmenter or AugmentationPool, see `Batch.images_filepath`.
+    Creating and sending the batches is therefore almost free.
+
+    Parameters
+    ----------
+    filepath : string
+        Path of a .npy file containing an (N,H,W,C) or (N,H,W) array.
+
+    batch_size : int
+        Number of images per batch.
+
+    sample_ids : None or iterable of int, optional(default=None)
+        Indices of the images to load, in order (e.g. shuffled for each
+        epoch). If None, all images are loaded in the order of the file.
+
+    images_aug_filepath : None or string, optional(default=None)
+        If set, the workers write the augmented images into this .npy file
+        instead of sending them back, see `Batch.images_aug_filepath`.
+
+    epoch : None or int, optional(default=None)
+        Epoch that is set in each batch, see Batch.
+
+    queue_size : int, optional(default=50)
+        Maximum number of batches to store in the queue.
+
+    Examples
+    --------
+    >>> images_aug = np.lib.format.open_memmap("images_aug.npy", mode="w+", shape=(N, 224, 224, 3), dtype=np.uint8)
+    >>> batch_loader = ia.MemmapBatchLoader("images.npy", 32, images_aug_filepath="images_aug.npy")
+    >>> bg_augmenter = ia.BackgroundAugmenter(batch_loader, augseq)
+
+    Augments the images of `images.npy` and writes the results into
+    `images_aug.npy`. Neither the images nor the augmented images are sent
+    between the processes.
+
+    """
+
+    def __init__(self, filepath, batch_size, sample_ids=None, images_aug_filepath=None, epoch=None, queue_size=50):
+        do_assert(batch_size >= 1, "Expected batch_size to be at least 1, got %s." % (batch_size,))
+        if sample_ids is None:
+            sample_ids = sm.xrange(len(_open_npy_memmap(filepath, "r")))
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self.sample_ids = [int(sample_id) for sample_id in sample_ids]
+        self.images_aug_filepath = images_aug_filepath
+        self.epoch = epoch
+        super(MemmapBatchLoader, self).__init__(self._create_batches, queue_size=queue_size, nb_workers=1,
+                                                threaded=True)
+
+    def _create_batches(self):
+        for start in sm.xrange(0, len(self.sample_ids), self.batch_size):
+            yield Batch(images_filepath=self.filepath, images_aug_filepath=self.images_aug_filepath,
+                        sample_ids=self.sample_ids[start:start+self.batch_size], epoch=self.epoch)
+
+
+class BackgroundAugmenter(object):
+    """
+    Class to augment batches in the background (while training on the GPU).
+
+    This is a wrapper around the multiprocessing module.
+
+    Parameters
+    ----------
+    batch_loader : BatchLoader
+        BatchLoader object to load data in the
+        background.
+
+    augseq : Augmenter
+        An augmenter to apply to all loaded batches.
+        This may be e.g. a Sequential to apply multiple augmenters.
+        All modalities of the batches (images, heatmaps, segmentation maps,
+        keypoints, bounding boxes, ground truth images and masks) are
+        augmented with the same sampled values via
+        `Augmenter.augment_batch()`, unless `augseq_X` or `augseq_gt` are
+        used.
+
+    queue_size : int
+        Size of the queue that is used to temporarily save the augmentation
+        results. Larger values offer the background processes more room
+        to save results when the main process doesn't load much, i.e. they
+        can lead to smoother and faster training. For large images, high
+        values can block a lot of RAM though.
+
+    nb_workers : "auto" or int or tuple of int
+        Number of background workers to spawn. If auto, it will be set
+        to C-1, where C is the number of CPU cores.
+        If a tuple `(min, max)`, the number of active workers is adapted
+        while augmenting, see `autoscale_interval`.
+
+    transport : None or PickleTransport, optional(default=None)
+        Transport used to send augmented batches to the main process, e.g. a
+        SharedMemoryTransport. If None, batches are pickled.
+        The transport is closed in terminate().
+
+    ordered : bool, optional(default=False)
+        Whether get_batch() returns the batches in the order in which they
+        were put into the BatchLoader's queue. For a BatchLoader with one
+        worker, that is the order of `load_batch_func`. If False, batches are
+        returned in the order in which the workers finish them.
+
+    reorder_window : None or int, optional(default=None)
+        Only used if `ordered` is True. Maximum number of batches that are
+        being augmented or are waiting in the main process for an earlier
+        batch. Workers that are ahead by this many batches wait until the
+        earlier batches were returned by get_batch(). If None, it will be
+        set to twice the number of workers.
+
+    autoscale_interval : number, optional(default=1.0)
+        Only used if `nb_workers` is a tuple `(min, max)`. All `max` workers
+        are started, but only some of them are active, the others wait
+        without using CPU time. Every `autoscale_interval` seconds,
+        get_batch() adds one active worker if it spent more than
+        5 percent of the time waiting for batches while the BatchLoader's
+        queue contained batches (i.e. augmentation is the bottleneck).
+        It removes one active worker if it waited less than 1 percent of the
+        time while the queue of augmented batches was at least half full
+        (i.e. the consumer is the bottleneck). Starts with `max` active
+        workers.
+
+    seed : None or int, optional(default=None)
+        If set, each image is augmented with its own random state derived
+        from the seed, `batch.epoch` and its entry in `batch.sample_ids`,
+        see `Augmenter.augment_batch()`. The results are then identical for
+        any number of workers and any composition of batches. All batches
+        must have `sample_ids` and `augseq_X` and `augseq_gt` can not be used.
+
+    threads_per_worker : None or "auto" or int, optional(default=None)
+        Number of threads that OpenCV, OpenMP, BLAS and imgaug may use in
+        each worker, see configure_worker_threads(). If None, the libraries'
+        defaults are kept, which usually leads to one thread per core in
+        every worker. "auto" splits the available CPU cores evenly between
+        the workers, which avoids oversubscribing the cores when there are
+        many workers.
+
+    pin_workers : bool, optional(default=False)
+        Whether to pin each worker to its own block of `threads_per_worker`
+        CPU cores.
+
+    chunk_size : None or int, optional(default=None)
+        If set, batches with more than `chunk_size` images are split into
+        chunks of at most `chunk_size` images. The chunks are augmented by
+        whichever workers are idle and reassembled in get_batch(), so that
+        one batch with expensive images doesn't keep the other workers
+        waiting. Requires `seed`, so that each image is augmented in the
+        same way no matter which worker augments its chunk, i.e. the
+        results are the same as without chunking.
+
+    stats_filepath : None or string, optional(default=None)
+        If set, the statistics of this augmenter and of the BatchLoader are
+        written to this file in the Prometheus text format at most every
+        `stats_interval` seconds during get_batch(), see get_stats() and
+        write_prometheus_textfile().
+
+    stats_interval : number, optional(default=10.0)
+        Minimum number of seconds between two writes of `stats_filepath`.
+
+    Examples
+    --------
+    >>> batch_loader = ia.BatchLoader(load_batches)
+    >>> bg_augmenter = ia.BackgroundAugmenter(batch_loader, augseq, nb_workers=(2, 15))
+
+    Augments with between 2 and 15 workers, depending on whether the
+    augmentation or the consumer of the batches is slower.
+
+    """
+
+    # thresholds of the fraction of time spent waiting in get_batch(),
+    # see autoscale_interval
+    AUTOSCALE_UP_WAIT_FRACTION = 0.05
+    AUTOSCALE_DOWN_WAIT_FRACTION = 0.01
+    AUTOSCALE_DOWN_QUEUE_OCCUPANCY = 0.5
+
+    # seconds that workers wait for a new batch before looking for chunks
+    # of other batches again, see chunk_size
+    CHUNK_POLL_INTERVAL = 0.01
+
+    # counters of each worker, see get_stats()
+    WORKER_COUNTERS = ["batches", "busy_seconds", "idle_seconds", "decode_seconds", "encode_seconds",
+                       "put_wait_seconds"]
+
+    def __init__(self, batch_loader, augseq, augseq_X=None, augseq_gt=None, queue_size=50, nb_workers="auto",
+                 transport=None, ordered=False, reorder_window=None, autoscale_interval=1.0, seed=None,
+                 threads_per_worker=None, pin_workers=False, chunk_size=None, stats_filepath=None,
+                 stats_interval=10.0):
+        do_assert(queue_size > 0)
+        do_assert(chunk_size is None or chunk_size >= 1,
+                  "Expected chunk_size to be None or at least 1, got %s." % (chunk_size,))
+        do_assert(seed is None or (augseq_X is None and augseq_gt is None),
+                  "Expected augseq_X and augseq_gt to be None if a seed is provided.")
+        do_assert(chunk_size is None or seed is not None,
+                  "Expected a seed to be provided if chunk_size is set, as the results would otherwise depend on "
+                  "which worker augments each chunk.")
+        self.queue_size = queue_size
+        self.seed = seed
+        self.augseq = augseq
+        self.augseq_X = augseq_X
+        self.augseq_gt = augseq_gt
+        self.batch_loader = batch_loader
+        self.source_finished_signals = batch_loader.finished_signals
+        self.queue_source = batch_loader.queue
+        self.transport_source = batch_loader.transport
+        self.queue_result = multiprocessing.Queue(queue_size)
+        self.transport = transport if transport is not None else PickleTransport()
+
+        if nb_workers == "auto":
             try:
                 nb_workers = multiprocessing.cpu_count()
             except (ImportError, NotImplementedError):
                 nb_workers = 1
             # try to reserve at least one core for the main process
             nb_workers = max(1, nb_workers - 1)
+        elif isinstance(nb_workers, tuple):
+            do_assert(len(nb_workers) == 2 and 1 <= nb_workers[0] <= nb_workers[1],
+                      "Expected nb_workers tuple to be (min, max) with 1 <= min <= max, got %s." % (nb_workers,))
         else:
             do_assert(nb_workers >= 1)
         #print("Starting %d background processes" % (nb_workers,))
 
+        # in autoscale mode, all workers are started and those with an index
+        # above the number of active workers wait on the condition
+        if isinstance(nb_workers, tuple):
+            self.nb_workers_min, nb_workers = nb_workers
+            self.autoscale_interval = autoscale_interval
+            self._scaling_state = (multiprocessing.Condition(), multiprocessing.Value("i", nb_workers, lock=False))
+            self._autoscale_time_start = time.time()
+            self._autoscale_wait_time = 0.0
+        else:
+            self.nb_workers_min = nb_workers
+            self.autoscale_interval = None
+            self._scaling_state = None
+
         self.nb_workers = nb_workers
         self.workers = []
         self.nb_workers_finished = 0
 
+        # in ordered mode, workers number the batches in the order in which
+        # they take them from the source queue and the main process buffers
+        # batches that arrive too early
+        self.ordered = ordered
+        if ordered:
+            if reorder_window is None:
+                reorder_window = 2 * nb_workers
+            do_assert(reorder_window >= 1, "Expected reorder_window to be at least 1, got %s." % (reorder_window,))
+            self.reorder_window = reorder_window
+            self._order_state = (multiprocessing.Lock(), multiprocessing.Value("l", 0, lock=False),
+                                 multiprocessing.Semaphore(reorder_window))
+            self._reorder_buffer = dict()
+            self._next_seq_idx = 0
+        else:
+            self.reorder_window = None
+            self._order_state = None
+
+        # chunks of split batches are shared by all workers, the semaphore
+        # counts the chunks that were put into the queue and not yet taken
+        self.chunk_size = chunk_size
+        if chunk_size is not None:
+            self._chunk_state = (multiprocessing.Queue(), multiprocessing.Semaphore(0))
+        else:
+            self._chunk_state = None
+        self._chunk_buffer = dict()
+
         self.augment_images = True
         self.augment_images_gt = True
         self.augment_keypoints = True
 
-        seeds = current_random_state().randint(0, 10**6, size=(nb_workers,))
+        # the workers' counters are shared, the statistics of get_batch()
+        # are only collected in the main process
+        self.stats = _SharedCounters(self.WORKER_COUNTERS, nb_workers)
+        self.stats_filepath = stats_filepath
+        self.stats_interval = stats_interval
+        self._stats_time_start = time.time()
+        self._stats_time_written = None
+        self._stats_nb_batches = 0
+        self._stats_decode_seconds = 0.0
+        self._stats_wait_histogram = _Histogram(STATS_WAIT_BUCKETS)
+        self._stats_occupancy_histogram = _Histogram(STATS_OCCUPANCY_BUCKETS)
+        self._stats_source_occupancy_histogram = _Histogram(STATS_OCCUPANCY_BUCKETS)
+
+        seeds = current_random_state().randint(0, 10**6, size=(nb_workers,)).tolist()
+        thread_configs = _compute_worker_thread_configs(nb_workers, threads_per_worker, pin_workers)
         for i in range(nb_workers):
-            worker = multiprocessing.Process(target=self._augment_images_worker, args=(augseq, augseq_X, augseq_gt, self.queue_source, self.queue_result, self.source_finished_signals, seeds[i]))
+            worker = multiprocessing.Process(target=self._augment_images_worker, args=(augseq, augseq_X, augseq_gt, self.queue_source, self.transport_source, self.queue_result, self.transport, self._order_state, self._scaling_state, self._chunk_state, chunk_size, seed, self.stats, thread_configs[i], i, seeds[i]))
             worker.daemon = True
             worker.start()
             self.workers.append(worker)
@@ -3786,7 +5437,8 @@ class BackgroundAugmenter(object):
         Returns a batch from the queue of augmented batches.
 
         If workers are still running and there are no batches in the queue,
-        it will automatically wait for the next batch.
+        it will automatically wait for the next batch. In ordered mode, it
+        waits for the next batch in order.
 
         Returns
         -------
@@ -3794,24 +5446,122 @@ class BackgroundAugmenter(object):
             One batch or None if all workers have finished.
 
         """
-        batch_str = self.queue_result.get()
-        batch = pickle.loads(batch_str)
+        time_start = time.time()
+        self._stats_occupancy_histogram.observe(_get_queue_occupancy(self.queue_result, self.queue_size))
+        self._stats_source_occupancy_histogram.observe(
+            _get_queue_occupancy(self.queue_source, self.batch_loader.queue_size))
+        batch = self._get_batch()
         if batch is not None:
+            self._stats_wait_histogram.observe(time.time() - time_start)
+            self._stats_nb_batches += 1
+
+        if self.stats_filepath is not None \
+                and (self._stats_time_written is None
+                     or time.time() - self._stats_time_written >= self.stats_interval
+                     or batch is None):
+            write_prometheus_textfile(self.stats_filepath, [self.batch_loader, self])
+            self._stats_time_written = time.time()
+        return batch
+
+    def _get_batch(self):
+        if self._scaling_state is not None:
+            self._autoscale()
+
+        if not self.ordered:
+            _seq_idx, batch = self._get_next_finished_batch()
             return batch
-        else:
+
+        while self._next_seq_idx not in self._reorder_buffer:
+            seq_idx, batch = self._get_next_finished_batch()
+            if batch is None:
+                return None
+            self._reorder_buffer[seq_idx] = batch
+        batch = self._reorder_buffer.pop(self._next_seq_idx)
+        self._next_seq_idx += 1
+        # let the workers start on another batch
+        self._order_state[2].release()
+        return batch
+
+    def _get_next_finished_batch(self):
+        while True:
+            time_start = time.time()
+            seq_idx, chunk_info, message = self.queue_result.get()
+            if self._scaling_state is not None:
+                self._autoscale_wait_time += time.time() - time_start
+            time_decode_start = time.time()
+            batch = self.transport.decode(message)
+            self._stats_decode_seconds += time.time() - time_decode_start
+            if chunk_info is not None:
+                # wait until all chunks of the batch have arrived
+                batch_key, chunk_idx, nb_chunks = chunk_info
+                chunks = self._chunk_buffer.setdefault(batch_key, [None] * nb_chunks)
+                chunks[chunk_idx] = batch
+                if any([chunk is None for chunk in chunks]):
+                    continue
+                del self._chunk_buffer[batch_key]
+                return seq_idx, Batch.merge(chunks)
+            if batch is not None:
+                return seq_idx, batch
+            if self._scaling_state is not None:
+                # the loader has finished, waiting workers have to be woken
+                # up to receive its end signal
+                self._set_nb_workers_active(self.nb_workers)
             self.nb_workers_finished += 1
             if self.nb_workers_finished == self.nb_workers:
-                return None
-            else:
-                return self.get_batch()
+                return None, None
 
-    def _augment_images_worker(self, augseq, augseq_X, augseq_gt, queue_source, queue_result, source_finished_signals, seedval):
+    @property
+    def nb_workers_active(self):
         """
-        Worker function that endlessly queries the source queue (input
-        batches), augments batches in it and sends the result to the output
-        queue.
+        Get the number of workers that are currently allowed to augment
+        batches.
+
+        Returns
+        -------
+        nb_workers_active : int
+            Number of active workers. Equal to `nb_workers` if autoscaling
+            is not used.
+
+        """
+        if self._scaling_state is None:
+            return self.nb_workers
+        condition, nb_workers_active = self._scaling_state
+        with condition:
+            return nb_workers_active.value
+
+    def _set_nb_workers_active(self, nb_workers_active):
+        condition, nb_workers_active_shared = self._scaling_state
+        with condition:
+            nb_workers_active_shared.value = nb_workers_active
+            condition.notify_all()
+
+    def _autoscale(self):
+        time_elapsed = time.time() - self._autoscale_time_start
+        if time_elapsed < self.autoscale_interval:
+            return
+
+        wait_fraction = self._autoscale_wait_time / max(time_elapsed, 1e-8)
+        occupancy = _get_queue_occupancy(self.queue_result, self.queue_size)
+
+        nb_workers_active = self.nb_workers_active
+        if wait_fraction > self.AUTOSCALE_UP_WAIT_FRACTION and not self.queue_source.empty():
+            nb_workers_active = min(nb_workers_active + 1, self.nb_workers)
+        elif wait_fraction < self.AUTOSCALE_DOWN_WAIT_FRACTION and occupancy >= self.AUTOSCALE_DOWN_QUEUE_OCCUPANCY:
+            nb_workers_active = max(nb_workers_active - 1, self.nb_workers_min)
+        if nb_workers_active != self.nb_workers_active:
+            self._set_nb_workers_active(nb_workers_active)
+
+        self._autoscale_time_start = time.time()
+        self._autoscale_wait_time = 0.0
 
+    def _augment_images_worker(self, augseq, augseq_X, augseq_gt, queue_source, transport_source, queue_result, transport_result, order_state, scaling_state, chunk_state, chunk_size, sample_seed, stats, thread_config, worker_idx, seedval):
         """
+        Worker function that waits for batches in the source queue (input
+        batches), augments them and sends the result to the output queue.
+        It stops when it receives the end signal of the BatchLoader.
+
+        """
+        configure_worker_threads(*thread_config)
         np.random.seed(seedval)
         random.seed(seedval)
         augseq.reseed(seedval)
@@ -3821,46 +5571,263 @@ class BackgroundAugmenter(object):
             augseq_gt.reseed(seedval)
         seed(seedval)
 
+        # without chunking, workers block until the next batch arrives,
+        # otherwise they regularly look for chunks split by other workers
+        timeout = self.CHUNK_POLL_INTERVAL if chunk_state is not None else None
+        nb_batches_split = 0
+        time_idle_start = time.time()
         while True:
+            if scaling_state is not None:
+                # wait while this worker is not needed, see _autoscale()
+                condition, nb_workers_active = scaling_state
+                with condition:
+                    while worker_idx >= nb_workers_active.value:
+                        condition.wait()
+
+            # chunks of batches that are already in progress are preferred
+            # over new batches
+            if chunk_state is not None:
+                queue_chunks, chunks_available = chunk_state
+                if chunks_available.acquire(False):
+                    seq_idx, chunk_info, chunk_pickled = queue_chunks.get()
+                    time_start = time.time()
+                    stats.add(worker_idx, "idle_seconds", time_start - time_idle_start)
+                    # chunks are only read during the augmentation
+                    chunk = _loads_framed(chunk_pickled, copy=False)
+                    time_decoded = time.time()
+                    chunk = self._augment_batch(augseq, augseq_X, augseq_gt, chunk, sample_seed)
+                    time_idle_start = self._send_result(queue_result, seq_idx, chunk_info, chunk, transport_result,
+                                                        stats, worker_idx, time_start, time_decoded)
+                    continue
+
             # wait for a new batch in the source queue and load it
+            seq_idx = None
             try:
-                batch_str = queue_source.get(timeout=0.1)
-                batch = pickle.loads(batch_str)
-                # augment the batch
-                batch_augment_images = batch.images is not None and self.augment_images
-                batch_augment_images_gt = batch.images_gt is not None and self.augment_images_gt
-                batch_augment_keypoints = batch.keypoints is not None and self.augment_keypoints
-
-                if batch_augment_images and batch_augment_keypoints:
-                    augseq_det = augseq.to_deterministic() if not augseq.deterministic else augseq
-                    batch.images_aug = augseq_det.augment_images(batch.images)
-                    batch.keypoints_aug = augseq_det.augment_keypoints(batch.keypoints)
-                elif batch_augment_images and batch_augment_images_gt:
-                    augseq_det = augseq.to_deterministic() if not augseq.deterministic else augseq
-                    batch.images_aug = augseq_det.augment_images(batch.images)
-                    batch.images_gt_aug = augseq_det.augment_images(batch.images_gt)
-                    batch.mask_gt_aug = augseq_det.augment_images(batch.mask_gt)
-
-                    if augseq_X:
-                        batch.images_aug = augseq_X.augment_images(batch.images_aug)
-
-                    if augseq_gt:
-                        augseq_gt_det = augseq_gt.to_deterministic() if not augseq_gt.deterministic else augseq_gt
-                        batch.images_gt_aug = augseq_gt_det.augment_images(batch.images_gt_aug)
-                        batch.mask_gt_aug = augseq_gt_det.augment_images(batch.mask_gt_aug)
-
-                elif batch_augment_images:
-                    batch.images_aug = augseq.augment_images(batch.images)
-                elif batch_augment_keypoints:
-                    batch.keypoints_aug = augseq.augment_keypoints(batch.keypoints)
-
-                # send augmented batch to output queue
-                batch_str = pickle.dumps(batch, protocol=-1)
-                queue_result.put(batch_str)
+                if order_state is None:
+                    message = queue_source.get(timeout=timeout)
+                else:
+                    seq_lock, seq_counter, window = order_state
+                    # wait until the batch is within the reorder window
+                    if not window.acquire(timeout=timeout):
+                        continue
+                    with seq_lock:
+                        try:
+                            message = queue_source.get(timeout=timeout)
+                        except QueueEmpty:
+                            window.release()
+                            raise
+                        seq_idx = seq_counter.value
+                        seq_counter.value += 1
             except QueueEmpty:
-                if all([signal.is_set() for signal in source_finished_signals]):
-                    queue_result.put(pickle.dumps(None, protocol=-1))
-                    return
+                continue
+            time_start = time.time()
+            stats.add(worker_idx, "idle_seconds", time_start - time_idle_start)
+            # the input arrays may be views of the transport's buffers,
+            # they are only read during the augmentation
+            batch = transport_source.decode(message, copy=False)
+            time_decoded = time.time()
+            if batch is None:
+                # the loader has finished, pass the signal on to the other
+                # workers and notify the main process
+                if order_state is not None:
+                    window.release()
+                queue_source.put(message)
+                queue_result.put((None, None, transport_result.encode(None)))
+                return
+
+            if chunk_state is not None and batch.nb_rows > chunk_size:
+                # the chunks are augmented by this worker and any idle ones,
+                # the main process reassembles them
+                chunks = batch.split(chunk_size)
+                batch_key = (worker_idx, nb_batches_split)
+                nb_batches_split += 1
+                for chunk_idx, chunk in enumerate(chunks):
+                    queue_chunks.put((seq_idx, (batch_key, chunk_idx, len(chunks)), _dumps_framed(chunk)))
+                    chunks_available.release()
+                transport_source.release(message)
+                time_idle_start = time.time()
+                stats.add(worker_idx, "decode_seconds", time_decoded - time_start)
+                stats.add(worker_idx, "busy_seconds", time_idle_start - time_start)
+                continue
+
+            # send augmented batch to output queue
+            batch = self._augment_batch(augseq, augseq_X, augseq_gt, batch, sample_seed)
+            time_idle_start = self._send_result(queue_result, seq_idx, None, batch, transport_result,
+                                                stats, worker_idx, time_start, time_decoded,
+                                                transport_source=transport_source, message_source=message)
+
+    @staticmethod
+    def _send_result(queue_result, seq_idx, chunk_info, batch, transport_result, stats, worker_idx, time_start,
+                     time_decoded, transport_source=None, message_source=None):
+        time_augmented = time.time()
+        message_result = transport_result.encode(batch)
+        if transport_source is not None:
+            transport_source.release(message_source)
+        time_encoded = time.time()
+        queue_result.put((seq_idx, chunk_info, message_result))
+        time_end = time.time()
+        stats.add(worker_idx, "batches", 1)
+        stats.add(worker_idx, "decode_seconds", time_decoded - time_start)
+        stats.add(worker_idx, "encode_seconds", time_encoded - time_augmented)
+        stats.add(worker_idx, "busy_seconds", time_encoded - time_start)
+        stats.add(worker_idx, "put_wait_seconds", time_end - time_encoded)
+        return time_end
+
+    def _augment_batch(self, augseq, augseq_X, augseq_gt, batch, sample_seed):
+        # images that are not contained in the batch (encoded or in a file)
+        # are loaded here and the results may be written to a file
+        batch.load_images_()
+        batch = self._augment_loaded_batch(augseq, augseq_X, augseq_gt, batch, sample_seed)
+        return batch.store_images_aug_()
+
+    def _augment_loaded_batch(self, augseq, augseq_X, augseq_gt, batch, sample_seed):
+        if sample_seed is not None:
+            return augseq.augment_batch(batch, seed=sample_seed)
+        if augseq_X is None and augseq_gt is None \
+                and self.augment_images and self.augment_images_gt and self.augment_keypoints:
+            # all modalities (images, heatmaps, segmentation maps, keypoints,
+            # bounding boxes) are augmented with the same sampled values
+            return augseq.augment_batch(batch)
+
+        batch_augment_images = batch.images is not None and self.augment_images
+        batch_augment_images_gt = batch.images_gt is not None and self.augment_images_gt
+        batch_augment_keypoints = batch.keypoints is not None and self.augment_keypoints
+
+        # images and their keypoints/ground truth are augmented in
+        # the same way by restoring the random states in between
+        if batch_augment_images and batch_augment_keypoints:
+            snapshot = augseq.snapshot_random_states()
+            batch.images_aug = augseq.augment_images(batch.images)
+            augseq.restore_random_states(snapshot)
+            batch.keypoints_aug = augseq.augment_keypoints(batch.keypoints)
+        elif batch_augment_images and batch_augment_images_gt:
+            snapshot = augseq.snapshot_random_states()
+            batch.images_aug = augseq.augment_images(batch.images)
+            augseq.restore_random_states(snapshot)
+            batch.images_gt_aug = augseq.augment_images(batch.images_gt)
+            augseq.restore_random_states(snapshot)
+            batch.mask_gt_aug = augseq.augment_images(batch.mask_gt)
+
+            if augseq_X:
+                batch.images_aug = augseq_X.augment_images(batch.images_aug, copy=False)
+
+            if augseq_gt:
+                snapshot = augseq_gt.snapshot_random_states()
+                batch.images_gt_aug = augseq_gt.augment_images(batch.images_gt_aug, copy=False)
+                augseq_gt.restore_random_states(snapshot)
+                batch.mask_gt_aug = augseq_gt.augment_images(batch.mask_gt_aug, copy=False)
+
+        elif batch_augment_images:
+            batch.images_aug = augseq.augment_images(batch.images)
+        elif batch_augment_keypoints:
+            batch.keypoints_aug = augseq.augment_keypoints(batch.keypoints)
+        return batch
+
+    def get_stats(self):
+        """
+        Get statistics about the augmentation process.
+
+        The statistics are always collected. They can be polled at any
+        time, also while the workers are running. The worker counters are
+        updated after each batch (or chunk, see `chunk_size`), the other
+        entries in each call of get_batch().
+
+        Returns
+        -------
+        stats : dict
+            Dictionary with the following entries:
+
+                * `uptime_seconds`: Seconds since the augmenter was created.
+                * `batches`: Number of batches returned by get_batch().
+                * `batches_per_second`: `batches` divided by `uptime_seconds`.
+                * `get_batch_wait_seconds`: Histogram of the time spent in
+                  get_batch(), i.e. the time the consumer waited.
+                * `decode_seconds`: Time spent decoding augmented batches in
+                  get_batch() (e.g. unpickling).
+                * `queue_occupancy`: Current fraction of the queue of
+                  augmented batches that is filled.
+                * `queue_occupancy_histogram`: Histogram of that fraction,
+                  sampled in each call of get_batch(). Mostly empty queues
+                  mean that the augmentation is the bottleneck.
+                * `source_queue_occupancy_histogram`: Same for the queue of
+                  the BatchLoader. Mostly empty queues mean that the loading
+                  is the bottleneck.
+                * `worker_<counter>`: The sum of each counter in
+                  `WORKER_COUNTERS` over all workers. `busy_seconds` is the
+                  time spent decoding, augmenting and encoding (e.g.
+                  pickling), `idle_seconds` the time spent waiting for
+                  batches and `put_wait_seconds` the time spent waiting for
+                  free space in the queue of augmented batches.
+                * `workers`: List with a dict per worker, containing its
+                  counters.
+
+            Histograms are dicts with the entries `buckets` (list of
+            `(upper bound, cumulative count)`), `sum` and `count`.
+
+        """
+        stats = dict()
+        stats["uptime_seconds"] = time.time() - self._stats_time_start
+        stats["batches"] = self._stats_nb_batches
+        stats["batches_per_second"] = self._stats_nb_batches / max(stats["uptime_seconds"], 1e-8)
+        stats["get_batch_wait_seconds"] = self._stats_wait_histogram.to_dict()
+        stats["decode_seconds"] = self._stats_decode_seconds
+        stats["queue_occupancy"] = _get_queue_occupancy(self.queue_result, self.queue_size)
+        stats["queue_occupancy_histogram"] = self._stats_occupancy_histogram.to_dict()
+        stats["source_queue_occupancy_histogram"] = self._stats_source_occupancy_histogram.to_dict()
+        for name, value in self.stats.get_totals().items():
+            stats["worker_%s" % (name,)] = value
+        stats["workers"] = self.stats.get_per_worker()
+        return stats
+
+    def get_prometheus_text(self, prefix="imgaug_background_augmenter"):
+        """
+        Get the statistics in the Prometheus text format.
+
+        Parameters
+        ----------
+        prefix : string, optional(default="imgaug_background_augmenter")
+            Prefix of the metric names.
+
+        Returns
+        -------
+        text : string
+            The metrics, see get_stats().
+
+        """
+        stats = self.get_stats()
+        descriptions = {
+            "batches": "Number of batches or chunks augmented by the worker.",
+            "busy_seconds": "Seconds the worker spent decoding, augmenting and encoding batches.",
+            "idle_seconds": "Seconds the worker spent waiting for batches.",
+            "decode_seconds": "Seconds the worker spent decoding loaded batches.",
+            "encode_seconds": "Seconds the worker spent encoding augmented batches.",
+            "put_wait_seconds": "Seconds the worker spent waiting for free space in the queue."
+        }
+        texts = [
+            _format_prometheus_metric("%s_batches_total" % (prefix,), "counter",
+                                      "Number of batches returned by get_batch().",
+                                      [({}, stats["batches"])]),
+            _format_prometheus_metric("%s_get_batch_wait_seconds" % (prefix,), "histogram",
+                                      "Seconds spent waiting in get_batch().",
+                                      [({}, stats["get_batch_wait_seconds"])]),
+            _format_prometheus_metric("%s_decode_seconds_total" % (prefix,), "counter",
+                                      "Seconds spent decoding augmented batches in get_batch().",
+                                      [({}, stats["decode_seconds"])]),
+            _format_prometheus_metric("%s_queue_occupancy" % (prefix,), "gauge",
+                                      "Fraction of the queue of augmented batches that is filled.",
+                                      [({}, stats["queue_occupancy"])]),
+            _format_prometheus_metric("%s_queue_occupancy_sampled" % (prefix,), "histogram",
+                                      "Fraction of the queue of augmented batches that is filled, sampled in get_batch().",
+                                      [({}, stats["queue_occupancy_histogram"])]),
+            _format_prometheus_metric("%s_source_queue_occupancy_sampled" % (prefix,), "histogram",
+                                      "Fraction of the queue of loaded batches that is filled, sampled in get_batch().",
+                                      [({}, stats["source_queue_occupancy_histogram"])])
+        ]
+        for name in self.WORKER_COUNTERS:
+            samples = [({"worker": i}, values[name]) for i, values in enumerate(stats["workers"])]
+            texts.append(_format_prometheus_metric("%s_worker_%s_total" % (prefix, name), "counter",
+                                                   descriptions[name], samples))
+        return "".join(texts)
 
     def terminate(self):
         """
@@ -3872,3 +5839,332 @@ class BackgroundAugmenter(object):
             worker.terminate()
 
         self.queue_result.close()
+        if self._chunk_state is not None:
+            self._chunk_state[0].close()
+        self.transport.close()
+
+class AugmentationPool(object):
+    """
+    Pool of background processes that augment batches and are reused for
+    several streams of batches (e.g. epochs).
+
+    In contrast to BackgroundAugmenter, the processes are only started once.
+    The augmenter is sent to each process once and only sent again if it
+    changes. The batches are augmented via `Augmenter.augment_batch()`, i.e.
+    all modalities of ia.Batch are supported.
+
+    Parameters
+    ----------
+    augseq : None or Augmenter
+        The augmenter to apply. May also be set later via set_augmenter()
+        or map_batches().
+
+    nb_workers : "auto" or int, optional(default="auto")
+        Number of background processes. If auto, it will be set to C-1,
+        where C is the number of CPU cores.
+
+    queue_size : int, optional(default=50)
+        Maximum number of batches in the queue of batches to augment and in
+        the queue of augmented batches.
+
+    transport : None or PickleTransport, optional(default=None)
+        Transport used to send augmented batches to the main process.
+        If None, batches are pickled. The transport is closed in close().
+
+    seed : None or int, optional(default=None)
+        If set, each image is augmented with a random state derived from the
+        seed and its sample id, see `Augmenter.augment_batch()`.
+
+    threads_per_worker : None or "auto" or int, optional(default=None)
+        Number of threads that OpenCV, OpenMP, BLAS and imgaug may use in
+        each worker, see configure_worker_threads(). If None, the libraries'
+        defaults are kept, which usually leads to one thread per core in
+        every worker. "auto" splits the available CPU cores evenly between
+        the workers, which avoids oversubscribing the cores when there are
+        many workers.
+
+    pin_workers : bool, optional(default=False)
+        Whether to pin each worker to its own block of `threads_per_worker`
+        CPU cores.
+
+    reorder_window : None or int, optional(default=None)
+        Maximum number of batches of a stream that are being augmented or
+        are waiting in the main process for an earlier batch (in ordered
+        mode) or to be yielded. No further batches are sent to the
+        background processes until the earliest one was yielded. If None,
+        it will be set to twice the number of workers.
+
+    Examples
+    --------
+    >>> with ia.AugmentationPool(seq, nb_workers=8) as pool:
+    >>>     for epoch in sm.xrange(100):
+    >>>         for batch_aug in pool.map_batches(load_batches(epoch)):
+    >>>             train(batch_aug.images_aug)
+
+    Augments the batches of all epochs with the same eight processes.
+
+    """
+    # seconds between checks whether the workers are still alive while
+    # waiting for augmented batches
+    WORKER_POLL_INTERVAL = 1.0
+
+    def __init__(self, augseq=None, nb_workers="auto", queue_size=50, transport=None, seed=None,
+                 threads_per_worker=None, pin_workers=False, reorder_window=None):
+        do_assert(queue_size > 0)
+        if nb_workers == "auto":
+            try:
+                nb_workers = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                nb_workers = 1
+            # try to reserve at least one core for the main process
+            nb_workers = max(1, nb_workers - 1)
+        else:
+            do_assert(nb_workers >= 1)
+
+        if reorder_window is None:
+            reorder_window = 2 * nb_workers
+        do_assert(reorder_window >= 1, "Expected reorder_window to be at least 1, got %s." % (reorder_window,))
+
+        self.nb_workers = nb_workers
+        self.queue_size = queue_size
+        self.reorder_window = reorder_window
+        self.transport = transport if transport is not None else PickleTransport()
+        self.seed = seed
+        self.queue_tasks = multiprocessing.Queue(queue_size)
+        self.queue_results = multiprocessing.Queue(queue_size)
+        # each worker has its own queue for new augmenters, so that every
+        # worker receives each augmenter exactly once
+        self.queues_augmenters = [multiprocessing.Queue() for _ in sm.xrange(nb_workers)]
+        self.augmenter_version = -1
+        self._augseq_pickled = None
+        self._stream_idx = 0
+        self._streaming = False
+        self.closed = False
+
+        seeds = current_random_state().randint(0, 10**6, size=(nb_workers,)).tolist()
+        thread_configs = _compute_worker_thread_configs(nb_workers, threads_per_worker, pin_workers)
+        self.workers = []
+        for i in sm.xrange(nb_workers):
+            worker = multiprocessing.Process(target=_augmentation_pool_worker,
+                                             args=(self.queue_tasks, self.queue_results, self.queues_augmenters[i],
+                                                   self.transport, seed, thread_configs[i], seeds[i]))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        if augseq is not None:
+            self.set_augmenter(augseq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def set_augmenter(self, augseq):
+        """
+        Set the augmenter that is applied to all following batches.
+
+        The augmenter is only sent to the background processes if it differs
+        from the previous one, i.e. if its pickled representation changed.
+        Each process reseeds its copy of the augmenter.
+
+        Parameters
+        ----------
+        augseq : Augmenter
+            The augmenter to apply.
+
+        """
+        do_assert(not self.closed, "Cannot use a closed AugmentationPool.")
+        augseq_pickled = pickle.dumps(augseq, protocol=-1)
+        if augseq_pickled == self._augseq_pickled:
+            return
+        self._augseq_pickled = augseq_pickled
+        self.augmenter_version += 1
+        for queue in self.queues_augmenters:
+            queue.put((self.augmenter_version, augseq_pickled))
+
+    def map_batches(self, batches, augseq=None, ordered=True):
+        """
+        Augment a stream of batches in the background processes.
+
+        Only one stream can be augmented at a time. If the returned generator
+        is not exhausted, the remaining batches are skipped in the next call.
+
+        Parameters
+        ----------
+        batches : iterable of Batch
+            The batches to augment. They are read in a background thread.
+
+        augseq : None or Augmenter, optional(default=None)
+            If set, the augmenter is changed via set_augmenter() before
+            augmenting the batches.
+
+        ordered : bool, optional(default=True)
+            Whether to yield the augmented batches in the order of `batches`.
+            Otherwise they are yielded as soon as they are finished.
+
+        Yields
+        ------
+        batch_aug : Batch
+            The augmented batches.
+
+        """
+        do_assert(not self.closed, "Cannot use a closed AugmentationPool.")
+        do_assert(not self._streaming, "Expected the previous call of map_batches() to be finished.")
+        if augseq is not None:
+            self.set_augmenter(augseq)
+        do_assert(self.augmenter_version >= 0, "Expected an augmenter to be set before augmenting batches.")
+
+        self._streaming = True
+        self._stream_idx += 1
+        stream_idx = self._stream_idx
+        # number of batches sent by the feeder thread, set when it is finished
+        nb_batches_sent = [None]
+        stop_signal = threading.Event()
+        # acquired by the feeder thread for each batch and released once the
+        # batch was yielded, which bounds the reorder buffer
+        window = threading.Semaphore(self.reorder_window)
+        feeder = threading.Thread(target=self._feed_batches,
+                                  args=(batches, stream_idx, self.augmenter_version, nb_batches_sent, stop_signal,
+                                        window))
+        feeder.daemon = True
+        feeder.start()
+
+        try:
+            nb_received = 0
+            next_seq_idx = 0
+            reorder_buffer = dict()
+            while nb_batches_sent[0] is None or nb_received < nb_batches_sent[0]:
+                message_stream_idx, seq_idx, message, error = self._get_result()
+                if message_stream_idx == -1:
+                    # the feeder thread stopped, possibly without any batch
+                    if nb_batches_sent[0] is not None and nb_received >= nb_batches_sent[0]:
+                        break
+                    continue
+                if message_stream_idx != stream_idx:
+                    # leftover of a stream that was not exhausted
+                    if message is not None:
+                        self.transport.release(message)
+                    continue
+                nb_received += 1
+                if error is not None:
+                    raise Exception("Augmentation of batch %d failed in background process:\n%s" % (seq_idx, error))
+                batch = self.transport.decode(message)
+                if not ordered:
+                    yield batch
+                    window.release()
+                else:
+                    reorder_buffer[seq_idx] = batch
+                    while next_seq_idx in reorder_buffer:
+                        yield reorder_buffer.pop(next_seq_idx)
+                        window.release()
+                        next_seq_idx += 1
+        finally:
+            stop_signal.set()
+            # wake up the feeder thread if it waits for the window
+            for _ in sm.xrange(self.reorder_window):
+                window.release()
+            self._streaming = False
+
+    def _get_result(self):
+        while True:
+            try:
+                return self.queue_results.get(timeout=self.WORKER_POLL_INTERVAL)
+            except QueueEmpty:
+                # batches of workers that died (e.g. killed due to lack of
+                # memory) would never arrive
+                dead = [i for i, worker in enumerate(self.workers) if not worker.is_alive()]
+                if len(dead) > 0:
+                    exitcodes = [self.workers[i].exitcode for i in dead]
+                    self.close()
+                    raise Exception("Background processes %s of AugmentationPool died unexpectedly "
+                                    "(exit codes %s)." % (dead, exitcodes))
+
+    def _feed_batches(self, batches, stream_idx, augmenter_version, nb_batches_sent, stop_signal, window):
+        nb_sent = 0
+        try:
+            for batch in batches:
+                window.acquire()
+                if stop_signal.is_set() or self.closed:
+                    break
+                do_assert(isinstance(batch, Batch), "Expected batches to contain imgaug.Batch objects, got %s." % (type(batch),))
+                self.queue_tasks.put((stream_idx, nb_sent, augmenter_version, _dumps_framed(batch)))
+                nb_sent += 1
+        except Exception:
+            # the queues are closed if the pool was closed in the meantime
+            if not self.closed:
+                traceback.print_exc()
+        finally:
+            nb_batches_sent[0] = nb_sent
+            # wakes up map_batches() if all batches were already received
+            if not self.closed:
+                self.queue_results.put((-1, None, None, None))
+
+    def close(self):
+        """
+        Stop all background processes.
+
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.workers:
+            try:
+                self.queue_tasks.put_nowait(None)
+            except QueueFull:
+                break
+
+        # workers may be blocked on a full result queue if the last stream
+        # was not exhausted, so the queue is emptied while waiting for them
+        time_end = time.time() + 1.0
+        for worker in self.workers:
+            while worker.is_alive() and time.time() < time_end:
+                self._clean_results()
+                worker.join(timeout=0.01)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._clean_results()
+        for queue in [self.queue_tasks, self.queue_results] + self.queues_augmenters:
+            queue.close()
+        self.transport.close()
+
+    def _clean_results(self):
+        while True:
+            try:
+                _stream_idx, _seq_idx, message, _error = self.queue_results.get_nowait()
+            except QueueEmpty:
+                break
+            if message is not None:
+                self.transport.release(message)
+
+def _augmentation_pool_worker(queue_tasks, queue_results, queue_augmenters, transport, sample_seed, thread_config,
+                              seedval):
+    configure_worker_threads(*thread_config)
+    random.seed(seedval)
+    np.random.seed(seedval)
+    seed(seedval)
+
+    augseq = None
+    augmenter_version = -1
+    while True:
+        task = queue_tasks.get()
+        if task is None:
+            return
+        stream_idx, seq_idx, task_augmenter_version, batch_pickled = task
+
+        # fetch the augmenter that was set when the batch was sent
+        while augmenter_version < task_augmenter_version:
+            augmenter_version, augseq_pickled = queue_augmenters.get()
+            augseq = pickle.loads(augseq_pickled)
+            augseq.reseed(seedval + augmenter_version)
+
+        try:
+            # augment_batch() does not change the input arrays, so they
+            # don't have to be copied
+            batch = _loads_framed(batch_pickled, copy=False).load_images_()
+            batch = augseq.augment_batch(batch, seed=sample_seed).store_images_aug_()
+            queue_results.put((stream_idx, seq_idx, transport.encode(batch), None))
+        except Exception:
+            queue_results.put((stream_idx, seq_idx, None, traceback.format_exc()))
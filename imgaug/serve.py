@@ -0,0 +1,529 @@
+"""
+Augmentation server that shares one pool of worker processes between several
+clients (e.g. the trainer processes of a node).
+
+Start the server via::
+
+    IMGAUG_SERVE_AUTHKEY=mysecret python -m imgaug.serve --socket /tmp/imgaug.sock \
+        --pipeline train=mypackage.augmentation:create_train_augmenter
+
+and augment batches in the clients via::
+
+    client = AugmentationClient("/tmp/imgaug.sock", b"mysecret")
+    for batch_aug in client.augment_batches(batches, "train"):
+        ...
+
+Batches are sent as pickled data in both directions, and unpickling data
+can execute arbitrary code. The server and its clients therefore have to
+trust each other. They authenticate each other via a shared authkey, which
+is required for all sockets. Keep it secret.
+
+This module is not imported by default.
+
+"""
+from __future__ import print_function, division, absolute_import
+
+import argparse
+import collections
+import functools
+import importlib
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+
+import numpy as np
+
+from . import imgaug as ia
+from .augmenters import meta
+
+if sys.version_info[0] == 2:
+    import cPickle as pickle
+else:
+    import pickle
+
+# environment variable that contains the authkey of the command line server
+AUTHKEY_ENV_VAR = "IMGAUG_SERVE_AUTHKEY"
+
+# pipelines of the current pool worker, set by _init_worker()
+_WORKER_PIPELINES = dict()
+
+
+def _init_worker(pipelines, thread_config):
+    # Ctrl+C in the terminal is handled by the server, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ia.configure_worker_threads(*thread_config)
+    # the workers are forked with the same random states, so each one
+    # reseeds from the OS' entropy source
+    seedval = np.random.RandomState().randint(0, 10**6)
+    ia.seed(seedval)
+    for i, (name, augseq) in enumerate(sorted(pipelines.items())):
+        augseq.reseed(seedval + i)
+        _WORKER_PIPELINES[name] = augseq
+
+
+def _augment(pipeline, seedval, message):
+    try:
+        # augment_batch() does not change the input arrays, so they don't
+        # have to be copied
+        batch = ia._loads_framed(message, copy=False).load_images_()
+        batch = _WORKER_PIPELINES[pipeline].augment_batch(batch, seed=seedval).store_images_aug_()
+        return ia._dumps_framed(batch), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _shutdown_connection(conn):
+    # closing a connection doesn't interrupt a recv() on it in another thread
+    # and so doesn't notify the peer, shutting down the socket does
+    try:
+        sock = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    except (IOError, OSError):
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except (IOError, OSError):
+        pass
+    finally:
+        sock.close()
+
+
+class AugmentationServer(object):
+    """
+    Server that augments the batches of several clients on one pool of
+    worker processes.
+
+    Clients connect via AugmentationClient. The server schedules the batches
+    of all clients round-robin, so that a client that sends many batches
+    doesn't starve the others.
+
+    Parameters
+    ----------
+    pipelines : dict of str to Augmenter
+        The augmenters that clients can use, by name.
+
+    address : string or tuple of (string, int)
+        Path of a Unix domain socket or `(host, port)` of a TCP socket.
+        Port 0 selects a free port, see `address`.
+
+    authkey : bytes
+        Key that clients have to know to connect. Server and clients unpickle
+        the batches that they receive from each other, so only processes that
+        know the key and are trusted may connect.
+
+    nb_workers : "auto" or int, optional(default="auto")
+        Number of worker processes. If "auto", it will be set to the number
+        of CPU cores.
+
+    max_in_flight : None or int, optional(default=None)
+        Maximum number of batches that are passed to the workers at the same
+        time. Further batches wait on the server and are scheduled
+        round-robin between clients. If None, it will be set to twice the
+        number of workers.
+
+    threads_per_worker : None or "auto" or int, optional(default=None)
+        Number of threads that OpenCV, OpenMP, BLAS and imgaug may use in
+        each worker, see `ia.configure_worker_threads()`. If None, the
+        libraries' defaults are kept. "auto" splits the CPU cores evenly
+        between the workers.
+
+    Examples
+    --------
+    >>> server = AugmentationServer({"train": seq}, "/tmp/imgaug.sock", b"mysecret")
+    >>> server.serve_forever()
+
+    """
+
+    def __init__(self, pipelines, address, authkey, nb_workers="auto", max_in_flight=None,
+                 threads_per_worker=None):
+        ia.do_assert(len(pipelines) > 0, "Expected at least one pipeline.")
+        ia.do_assert(all([isinstance(augseq, meta.Augmenter) for augseq in pipelines.values()]),
+                     "Expected all pipelines to be augmenters.")
+        ia.do_assert(isinstance(authkey, bytes) and len(authkey) > 0,
+                     "Expected authkey to be non-empty bytes, got %s." % (type(authkey),))
+        if nb_workers == "auto":
+            try:
+                nb_workers = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                nb_workers = 1
+        ia.do_assert(nb_workers >= 1, "Expected nb_workers to be 'auto' or at least 1, got %s." % (nb_workers,))
+        if max_in_flight is None:
+            max_in_flight = 2 * nb_workers
+        ia.do_assert(max_in_flight >= 1, "Expected max_in_flight to be at least 1, got %s." % (max_in_flight,))
+
+        self.pipelines = dict(pipelines)
+        self.authkey = authkey
+        self.nb_workers = nb_workers
+        self.max_in_flight = max_in_flight
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+
+        thread_config = ia._compute_worker_thread_configs(nb_workers, threads_per_worker, False)[0]
+        self._pool = multiprocessing.Pool(nb_workers, initializer=_init_worker,
+                                          initargs=(self.pipelines, thread_config))
+
+        # clients by index, each with its connection and queue of requests,
+        # the order of the indices is rotated for round-robin scheduling
+        self._condition = threading.Condition()
+        self._clients = dict()
+        self._client_order = []
+        self._next_client_idx = 0
+        self._nb_in_flight = 0
+        self.closed = False
+
+        self._dispatcher = threading.Thread(target=self._dispatch)
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def serve_forever(self):
+        """
+        Accept clients until close() is called.
+
+        Each client is handled in its own thread.
+
+        """
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except multiprocessing.AuthenticationError:
+                continue
+            except (IOError, OSError, EOFError):
+                if self.closed:
+                    break
+                raise
+            if self.closed:
+                conn.close()
+                break
+
+            with self._condition:
+                client_idx = self._next_client_idx
+                self._next_client_idx += 1
+                client = {"conn": conn, "send_lock": threading.Lock(), "requests": collections.deque()}
+                self._clients[client_idx] = client
+                self._client_order.append(client_idx)
+            thread = threading.Thread(target=self._handle_client, args=(client_idx, client))
+            thread.daemon = True
+            thread.start()
+
+    def _handle_client(self, client_idx, client):
+        conn = client["conn"]
+        try:
+            while True:
+                request = conn.recv()
+                if request[0] == "pipelines":
+                    self._send(client, ("pipelines", sorted(self.pipelines.keys())))
+                elif request[0] == "augment":
+                    _, request_id, pipeline, seedval, message = request
+                    if pipeline not in self.pipelines:
+                        self._send(client, ("result", request_id, None,
+                                            "Unknown pipeline '%s', expected one of: %s." % (
+                                                pipeline, ", ".join(sorted(self.pipelines.keys())))))
+                        continue
+                    with self._condition:
+                        client["requests"].append((request_id, pipeline, seedval, message))
+                        self._condition.notify_all()
+        except (IOError, OSError, EOFError):
+            pass
+        finally:
+            # batches of the client that were not yet scheduled are dropped
+            with self._condition:
+                del self._clients[client_idx]
+                self._client_order.remove(client_idx)
+            conn.close()
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self.closed and (self._nb_in_flight >= self.max_in_flight or not self._has_requests()):
+                    self._condition.wait()
+                if self.closed:
+                    return
+                # take the next request of the first client with requests and
+                # move that client to the end of the order
+                for i, client_idx in enumerate(self._client_order):
+                    if len(self._clients[client_idx]["requests"]) > 0:
+                        break
+                self._client_order.append(self._client_order.pop(i))
+                client = self._clients[client_idx]
+                request_id, pipeline, seedval, message = client["requests"].popleft()
+                self._nb_in_flight += 1
+
+                # submitted while holding the lock, as close() terminates the
+                # pool after setting self.closed
+                self._pool.apply_async(_augment, (pipeline, seedval, message),
+                                       callback=functools.partial(self._on_result, client, request_id))
+
+    def _has_requests(self):
+        return any([len(client["requests"]) > 0 for client in self._clients.values()])
+
+    def _on_result(self, client, request_id, result):
+        message, error = result
+        try:
+            self._send(client, ("result", request_id, message, error))
+        except (IOError, OSError, EOFError, ValueError):
+            # the client disconnected
+            pass
+        finally:
+            with self._condition:
+                self._nb_in_flight -= 1
+                self._condition.notify_all()
+
+    @staticmethod
+    def _send(client, response):
+        with client["send_lock"]:
+            client["conn"].send(response)
+
+    def close(self):
+        """
+        Stop accepting clients, disconnect all clients and stop the workers.
+
+        """
+        if self.closed:
+            return
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+            clients = list(self._clients.values())
+
+        # wake up serve_forever(), closing the listener doesn't interrupt
+        # accept() on all platforms
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except (IOError, OSError, EOFError):
+            pass
+        self.listener.close()
+
+        for client in clients:
+            _shutdown_connection(client["conn"])
+            client["conn"].close()
+        self._pool.terminate()
+        self._pool.join()
+
+
+class AugmentationClient(object):
+    """
+    Client of an AugmentationServer.
+
+    A client is not thread-safe. Use one client per thread.
+
+    Parameters
+    ----------
+    address : string or tuple of (string, int)
+        Address of the server, see AugmentationServer.
+
+    authkey : bytes
+        The server's authkey. The client unpickles the augmented batches that
+        it receives, so it should only connect to trusted servers.
+
+    """
+
+    def __init__(self, address, authkey):
+        self._conn = Client(address, authkey=authkey)
+        self._next_request_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_pipelines(self):
+        """
+        Get the names of the pipelines of the server.
+
+        Returns
+        -------
+        pipelines : list of str
+            Names of the pipelines.
+
+        """
+        self._conn.send(("pipelines",))
+        while True:
+            response = self._conn.recv()
+            # results of previous batches that were not consumed are skipped
+            if response[0] == "pipelines":
+                return response[1]
+
+    def augment_batch(self, batch, pipeline, seed=None):
+        """
+        Augment a single batch on the server.
+
+        Parameters
+        ----------
+        batch : ia.Batch
+            The batch to augment.
+
+        pipeline : str
+            Name of the augmenter to use.
+
+        seed : None or int, optional(default=None)
+            See `augment_batches()`.
+
+        Returns
+        -------
+        batch_aug : ia.Batch
+            The augmented batch.
+
+        """
+        return list(self.augment_batches([batch], pipeline, seed=seed))[0]
+
+    def augment_batches(self, batches, pipeline, seed=None, max_in_flight=4):
+        """
+        Augment batches on the server.
+
+        Parameters
+        ----------
+        batches : iterable of ia.Batch
+            The batches to augment. Encoded images and index-only batches
+            (see `ia.Batch.images_encoded` and `ia.Batch.images_filepath`)
+            are loaded by the server's workers.
+
+        pipeline : str
+            Name of the augmenter to use.
+
+        seed : None or int, optional(default=None)
+            If set, each image is augmented with a random state derived from
+            the seed and its sample id, see `Augmenter.augment_batch()`. The
+            batches must then have `sample_ids`.
+            Otherwise the results depend on which worker augments a batch.
+
+        max_in_flight : int, optional(default=4)
+            Maximum number of batches that were sent to the server and not
+            yet yielded.
+
+        Yields
+        ------
+        batch_aug : ia.Batch
+            The augmented batches, in the order of `batches`.
+
+        """
+        ia.do_assert(max_in_flight >= 1, "Expected max_in_flight to be at least 1, got %s." % (max_in_flight,))
+        pending = collections.deque()
+        results = dict()
+        batches = iter(batches)
+        finished = False
+        while not finished or len(pending) > 0:
+            while not finished and len(pending) < max_in_flight:
+                try:
+                    batch = next(batches)
+                except StopIteration:
+                    finished = True
+                    break
+                ia.do_assert(isinstance(batch, ia.Batch), "Expected batches to contain imgaug.Batch objects, got %s." % (type(batch),))
+                request_id = self._next_request_id
+                self._next_request_id += 1
+                self._conn.send(("augment", request_id, pipeline, seed, ia._dumps_framed(batch)))
+                pending.append(request_id)
+
+            if len(pending) == 0:
+                break
+            while pending[0] not in results:
+                response = self._conn.recv()
+                # results of batches of previous calls that were not consumed
+                # are skipped
+                if response[0] == "result" and response[1] in pending:
+                    results[response[1]] = response[2:]
+            message, error = results.pop(pending.popleft())
+            if error is not None:
+                raise Exception("Augmentation failed on the server:\n%s" % (error,))
+            yield ia._loads_framed(message)
+
+    def close(self):
+        """
+        Disconnect from the server.
+
+        """
+        self._conn.close()
+
+
+def _load_pipeline(spec):
+    """
+    Load an augmenter given as `module:attribute` (an augmenter or a
+    function/class that is called without arguments to create one) or as the
+    path of a pickled augmenter.
+
+    """
+    if os.path.isfile(spec):
+        with open(spec, "rb") as f:
+            augseq = pickle.load(f)
+    else:
+        ia.do_assert(":" in spec, "Expected pipeline '%s' to be a file or of the form module:attribute." % (spec,))
+        module_name, attribute = spec.split(":", 1)
+        augseq = importlib.import_module(module_name)
+        for name in attribute.split("."):
+            augseq = getattr(augseq, name)
+        if not isinstance(augseq, meta.Augmenter) and callable(augseq):
+            augseq = augseq()
+    ia.do_assert(isinstance(augseq, meta.Augmenter), "Expected pipeline '%s' to be an augmenter, got %s." % (
+        spec, type(augseq),))
+    return augseq
+
+
+def _parse_threads_per_worker(value):
+    if value in ["auto", "none"]:
+        return None if value == "none" else value
+    return int(value)
+
+
+def main(args=None):
+    """
+    Run an AugmentationServer from the command line, see
+    `python -m imgaug.serve --help`.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m imgaug.serve",
+        description="Serve augmentation pipelines to clients on this or other machines. The authkey, which "
+                    "clients need to connect, is read from the environment variable %s. Server and clients "
+                    "exchange pickled data, so only share it with trusted clients." % (AUTHKEY_ENV_VAR,))
+    parser.add_argument("--socket", help="Path of the Unix domain socket to listen on.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host of the TCP socket, if --socket is not set.")
+    parser.add_argument("--port", type=int, default=6000, help="Port of the TCP socket, if --socket is not set.")
+    parser.add_argument("--pipeline", action="append", required=True, metavar="NAME=SPEC",
+                        help="Augmenter to serve under NAME. SPEC is either module:attribute (an augmenter or a "
+                             "function that creates one) or the path of a pickled augmenter. May be repeated.")
+    parser.add_argument("--workers", default="auto", help="Number of worker processes or 'auto'.")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Maximum number of batches passed to the workers at the same time.")
+    parser.add_argument("--threads-per-worker", type=_parse_threads_per_worker, default=None,
+                        help="Number of threads that OpenCV, OpenMP, BLAS and imgaug may use in each worker, "
+                             "'auto' to split the CPU cores evenly between the workers or 'none' to keep the "
+                             "libraries' defaults.")
+    args = parser.parse_args(args)
+
+    pipelines = dict()
+    for pipeline in args.pipeline:
+        ia.do_assert("=" in pipeline, "Expected --pipeline to be of the form NAME=SPEC, got '%s'." % (pipeline,))
+        name, spec = pipeline.split("=", 1)
+        pipelines[name] = _load_pipeline(spec)
+
+    authkey = os.environ.get(AUTHKEY_ENV_VAR)
+    if not authkey:
+        parser.error("the environment variable %s has to be set to the authkey" % (AUTHKEY_ENV_VAR,))
+    authkey = authkey.encode("utf-8")
+    address = args.socket if args.socket is not None else (args.host, args.port)
+    nb_workers = args.workers if args.workers == "auto" else int(args.workers)
+
+    server = AugmentationServer(pipelines, address, authkey=authkey, nb_workers=nb_workers,
+                                max_in_flight=args.max_in_flight, threads_per_worker=args.threads_per_worker)
+    print("Serving pipelines %s on %s" % (", ".join(sorted(pipelines.keys())), server.address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
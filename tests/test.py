@@ -27,6 +27,13 @@ import skimage
 from skimage import data, color
 import cv2
 import time
+import json
+import sys
+import os
+import multiprocessing
+import threading
+import pickle
+import tempfile
 import scipy
 import copy
 import warnings
@@ -58,6 +65,9 @@ def main():
     test_derive_random_state()
     test_derive_random_states()
     test_forward_random_state()
+    test_new_random_state_for_index()
+    test_get_rng_state()
+    test_set_rng_backend()
     # test_quokka()
     # test_quokka_square()
     # test_angle_between_vectors()
@@ -107,8 +117,24 @@ def main():
     test_SegmentationMapOnImage_from_heatmaps()
     test_SegmentationMapOnImage_copy()
     test_SegmentationMapOnImage_deepcopy()
+    test_HooksProfiler()
     # test_Batch()
+    test_Batch_split_merge()
+    test_Batch_slots()
     test_BatchLoader()
+    test_FileBatchLoader()
+    test_Batch_images_encoded()
+    test_MemmapBatchLoader()
+    test_PickleTransport()
+    test_SharedMemoryTransport()
+    test_BackgroundAugmenter_ordered()
+    test_BackgroundAugmenter_autoscale()
+    test_BackgroundAugmenter_chunks()
+    test_BackgroundAugmenter_stats()
+    test_BackgroundAugmenter_modalities()
+    test_AugmentationPool()
+    test_configure_worker_threads()
+    test_AugmentationServer()
     # test_BackgroundAugmenter.get_batch()
     # test_BackgroundAugmenter._augment_images_worker()
     # test_BackgroundAugmenter.terminate()
@@ -163,6 +189,7 @@ def main():
     test_PiecewiseAffine()
     test_PerspectiveTransform()
     test_ElasticTransformation()
+    test_HomographyChain()
 
     # meta
     test_copy_dtypes_for_restore()
@@ -176,13 +203,22 @@ def main():
     test_clip_augmented_images()
     test_reduce_to_nonempty()
     test_invert_reduce_to_nonempty()
+    test_set_n_jobs()
+    test_subselect_rows()
     test_Augmenter()
     test_Augmenter_augment_segmentation_maps()
+    test_Augmenter_augment_images_copy()
+    test_Augmenter_augment_heatmaps_keypoints_copy()
     test_Augmenter_find()
     test_Augmenter_remove()
     test_Augmenter_hooks()
     test_Augmenter_copy_random_state()
+    test_Augmenter_snapshot_random_states()
     test_Augmenter_augment_batches()
+    test_Augmenter_augment_batches_async()
+    test_Augmenter_augment_batch()
+    test_Augmenter_augment_batch_containers()
+    test_Augmenter_augment_batch_seed()
     test_Sequential()
     test_SomeOf()
     test_OneOf()
@@ -494,6 +530,111 @@ def test_forward_random_state():
     assert rs1.randint(0, 10**6) == rs2.randint(0, 10**6)
 
 
+def test_new_random_state_for_index():
+    rs1 = ia.new_random_state_for_index(1017, 5)
+    rs2 = ia.new_random_state_for_index(1017, 5)
+    rs3 = ia.new_random_state_for_index(1017, 6)
+    rs4 = ia.new_random_state_for_index(1018, 5)
+    samples1 = rs1.randint(0, 10**6, size=(10,))
+    assert np.array_equal(samples1, rs2.randint(0, 10**6, size=(10,)))
+    assert not np.array_equal(samples1, rs3.randint(0, 10**6, size=(10,)))
+    assert not np.array_equal(samples1, rs4.randint(0, 10**6, size=(10,)))
+
+    got_exception = False
+    try:
+        _ = ia.new_random_state_for_index(1017, -1)
+    except Exception:
+        got_exception = True
+    assert got_exception
+
+    # nested indices
+    try:
+        for backend in ["mt19937", "philox"] if ia.NUMPY_HAS_BIT_GENERATORS else ["mt19937"]:
+            ia.set_rng_backend(backend)
+            samples = [ia.new_random_state_for_index(1017, index).randint(0, 10**6, size=(10,))
+                       for index in [(1, 5), (1, 5), (2, 5), (1, 6), 5, (5, 0)]]
+            assert np.array_equal(samples[0], samples[1])
+            assert not np.array_equal(samples[0], samples[2])
+            assert not np.array_equal(samples[0], samples[3])
+            assert not np.array_equal(samples[0], samples[4])
+            assert not np.array_equal(samples[4], samples[5])
+    finally:
+        ia.set_rng_backend("mt19937")
+
+
+def test_get_rng_state():
+    rs = np.random.RandomState(1017)
+    state = ia.get_rng_state(rs)
+    samples1 = rs.randint(0, 10**6, size=(10,))
+    ia.set_rng_state(rs, state)
+    samples2 = rs.randint(0, 10**6, size=(10,))
+    assert np.array_equal(samples1, samples2)
+
+
+def test_set_rng_backend():
+    assert ia.get_rng_backend() == "mt19937"
+    current_random_state = ia.current_random_state()
+    state = ia.get_rng_state(current_random_state)
+
+    got_exception = False
+    try:
+        ia.set_rng_backend("foo")
+    except Exception as exc:
+        assert "Expected backend" in str(exc)
+        got_exception = True
+    assert got_exception
+
+    if not ia.NUMPY_HAS_BIT_GENERATORS:
+        got_exception = False
+        try:
+            ia.set_rng_backend("philox")
+        except Exception as exc:
+            assert "numpy 1.17" in str(exc)
+            got_exception = True
+        assert got_exception
+        assert ia.get_rng_backend() == "mt19937"
+        return
+
+    try:
+        ia.set_rng_backend("philox")
+        assert ia.get_rng_backend() == "philox"
+        # the global random state is changed in-place, so that existing
+        # references to it (e.g. of augmenters) use the new backend too
+        assert ia.current_random_state() is current_random_state
+        assert ia.CURRENT_RANDOM_STATE is current_random_state
+        assert ia.get_rng_state(current_random_state)["bit_generator"] == "Philox"
+
+        # seeding, creating and copying random states
+        ia.seed(1)
+        samples1 = ia.current_random_state().randint(0, 10**6, size=(10,))
+        ia.seed(1)
+        samples2 = ia.current_random_state().randint(0, 10**6, size=(10,))
+        assert np.array_equal(samples1, samples2)
+        rs = ia.new_random_state(1017)
+        assert ia.get_rng_state(rs)["bit_generator"] == "Philox"
+        rs_copy = ia.copy_random_state(rs)
+        assert rs_copy is not rs
+        assert rs.randint(0, 10**6) == rs_copy.randint(0, 10**6)
+        rs_index = ia.new_random_state_for_index(1017, 5)
+        assert ia.new_random_state_for_index(1017, 5).randint(0, 10**6) == rs_index.randint(0, 10**6)
+
+        # augmenters work with the backend
+        image = np.arange(4*4).astype(np.uint8).reshape((4, 4, 1))
+        aug = iaa.Sequential([iaa.Fliplr(0.5), iaa.Affine(rotate=(-10, 10)), iaa.Add((-5, 5))])
+        aug_det = aug.to_deterministic()
+        assert np.array_equal(aug_det.augment_image(image), aug_det.augment_image(image))
+        aug.reseed(ia.new_random_state_for_index(1017, 5))
+        image_aug1 = aug.augment_image(image)
+        aug.reseed(ia.new_random_state_for_index(1017, 5))
+        image_aug2 = aug.augment_image(image)
+        assert np.array_equal(image_aug1, image_aug2)
+    finally:
+        ia.set_rng_backend("mt19937")
+        ia.set_rng_state(current_random_state, state)
+    assert ia.get_rng_backend() == "mt19937"
+    assert ia.get_rng_state(ia.current_random_state())["bit_generator"] == "MT19937"
+
+
 def test_imresize_many_images():
     for c in [1, 3]:
         image1 = np.zeros((16, 16, c), dtype=np.uint8) + 255
@@ -2820,6 +2961,125 @@ def test_SegmentationMapOnImage_deepcopy():
     assert not np.array_equal(observed.get_arr_int(), segmap.get_arr_int())
 
 
+def test_HooksProfiler():
+    reseed()
+
+    seq = iaa.Sequential([
+        iaa.Fliplr(1.0, name="flip"),
+        iaa.Sometimes(1.0, iaa.Add(1, name="add"), name="sometimes"),
+        iaa.Noop(name="noop")
+    ], name="seq")
+    images = np.zeros((4, 8, 8, 3), dtype=np.uint8)
+    profiler = ia.HooksProfiler()
+    images_aug = seq.augment_images(images, hooks=profiler)
+    images_aug = seq.augment_images(images, hooks=profiler)
+    assert np.all(images_aug == 1)
+
+    # raw measurements, attributed along the parents chain
+    stats = profiler.stats
+    assert set(stats.keys()) == set([
+        ("seq",), ("seq", "flip"), ("seq", "sometimes"), ("seq", "sometimes", "sometimes-then"),
+        ("seq", "sometimes", "sometimes-then", "add"), ("seq", "sometimes", "sometimes-else"), ("seq", "noop")
+    ])
+    assert stats[("seq",)]["calls"] == 2
+    assert stats[("seq",)]["images"] == 8
+    assert stats[("seq",)]["bytes_out"] == 2 * images.nbytes
+    assert stats[("seq", "sometimes", "sometimes-else")]["images"] == 0
+    assert stats[("seq",)]["wall_time"] >= stats[("seq", "flip")]["wall_time"] + stats[("seq", "noop")]["wall_time"]
+    assert all([stats_path["wall_time"] >= 0 and stats_path["cpu_time"] >= 0 for stats_path in stats.values()])
+
+    # nested dicts and JSON
+    tree = profiler.to_dict()
+    assert len(tree) == 1
+    assert tree[0]["name"] == "seq"
+    assert [child["name"] for child in tree[0]["children"]] == ["flip", "sometimes", "noop"]
+    assert 0 <= tree[0]["self_wall_time"] <= tree[0]["wall_time"]
+    tree_json = json.loads(profiler.to_json())
+    assert tree_json[0]["children"][1]["children"][0]["children"][0]["name"] == "add"
+
+    # collapsed stacks
+    lines = profiler.to_collapsed_stacks().strip().split("\n")
+    assert len(lines) == 7
+    assert "seq;sometimes;sometimes-then;add" in [line.split(" ")[0] for line in lines]
+    assert all([int(line.split(" ")[1]) >= 0 for line in lines])
+    lines = profiler.to_collapsed_stacks(metric="cpu_time").strip().split("\n")
+    assert len(lines) == 7
+
+    # heatmaps, keypoints and batches
+    profiler.reset()
+    assert profiler.stats == dict()
+    heatmaps = ia.HeatmapsOnImage(np.zeros((8, 8, 1), dtype=np.float32), shape=(8, 8, 3))
+    _ = seq.augment_heatmaps([heatmaps], hooks=profiler)
+    _ = seq.augment_keypoints([ia.KeypointsOnImage([ia.Keypoint(x=1, y=2)], shape=(8, 8, 3))], hooks=profiler)
+    _ = seq.augment_batch(ia.Batch(images=images), hooks=profiler)
+    assert profiler.stats[("seq",)]["calls"] == 3
+    assert profiler.stats[("seq",)]["images"] == 1 + 1 + 4
+
+    # other hooks still work
+    profiler = ia.HooksProfiler(activator=lambda images, augmenter, parents, default: False if augmenter.name == "flip" else default)
+    images_aug = seq.augment_images(images, hooks=profiler)
+    assert np.all(images_aug == 1)
+    assert ("seq", "flip") in profiler.stats
+
+
+def test_Batch_split_merge():
+    images = np.arange(5*2*2*1).reshape((5, 2, 2, 1)).astype(np.uint8)
+    keypoints = [ia.KeypointsOnImage([ia.Keypoint(x=i, y=i)], shape=(2, 2, 1)) for i in sm.xrange(5)]
+    batch = ia.Batch(images=images, keypoints=keypoints, sample_ids=list(sm.xrange(5)), epoch=3, data="foo")
+    assert batch.nb_rows == 5
+    assert ia.Batch().nb_rows == 0
+
+    chunks = batch.split(2)
+    assert [chunk.nb_rows for chunk in chunks] == [2, 2, 1]
+    assert [chunk.data for chunk in chunks] == ["foo", None, None]
+    assert all([chunk.epoch == 3 for chunk in chunks])
+    assert np.array_equal(chunks[1].images, images[2:4])
+    assert chunks[1].keypoints[0] is keypoints[2]
+    assert chunks[2].sample_ids == [4]
+    assert chunks[0].images_aug is None
+
+    # augmented chunks with different image shapes are merged into lists
+    for i, chunk in enumerate(chunks):
+        chunk.images_aug = chunk.images + 1 if i < 2 else [np.zeros((3, 3, 1), dtype=np.uint8)]
+        chunk.keypoints_aug = chunk.keypoints
+    batch_merged = ia.Batch.merge(chunks)
+    assert batch_merged.data == "foo"
+    assert batch_merged.epoch == 3
+    assert ia.is_np_array(batch_merged.images)
+    assert np.array_equal(batch_merged.images, images)
+    assert isinstance(batch_merged.images_aug, list)
+    assert len(batch_merged.images_aug) == 5
+    assert np.array_equal(batch_merged.images_aug[3], images[3] + 1)
+    assert batch_merged.images_aug[4].shape == (3, 3, 1)
+    assert batch_merged.keypoints_aug == keypoints
+    assert batch_merged.sample_ids == list(sm.xrange(5))
+    assert batch_merged.heatmaps is None
+
+    # batches without rows result in one chunk
+    assert len(ia.Batch(data=1).split(2)) == 1
+
+
+def test_Batch_slots():
+    images = np.zeros((2, 4, 4, 3), dtype=np.uint8)
+    batch = ia.Batch(images=images, data="foo", sample_ids=[0, 1])
+
+    # batches have no __dict__, but can still be pickled and copied
+    assert not hasattr(batch, "__dict__")
+    assert ("data", "foo") in batch.get_attributes()
+    for batch_copy in [pickle.loads(pickle.dumps(batch, protocol=-1)), copy.copy(batch), copy.deepcopy(batch)]:
+        assert np.array_equal(batch_copy.images, images)
+        assert batch_copy.data == "foo"
+        assert batch_copy.sample_ids == [0, 1]
+
+    # only the listed attributes can be set
+    got_exception = False
+    try:
+        batch.foo = 1
+    except AttributeError:
+        got_exception = True
+    assert got_exception
+
+
 def test_BatchLoader():
     def _load_func():
         for _ in sm.xrange(20):
@@ -2837,8 +3097,10 @@ def test_BatchLoader():
             counter = 0
             while (not loader.all_finished() or not loader.queue.empty() or len(loaded) < 20*nb_workers) and counter < 1000:
                 try:
-                    batch = loader.queue.get(timeout=0.001)
-                    loaded.append(batch)
+                    batch = loader.transport.decode(loader.queue.get(timeout=0.001))
+                    # skip the end signal
+                    if batch is not None:
+                        loaded.append(batch)
                 except:
                     pass
                 counter += 1
@@ -2856,8 +3118,10 @@ def test_BatchLoader():
             counter = 0
             while (not loader.all_finished() or not loader.queue.empty() or len(loaded) < 20*nb_workers) and counter < 1000:
                 try:
-                    batch = loader.queue.get(timeout=0.001)
-                    loaded.append(batch)
+                    batch = loader.transport.decode(loader.queue.get(timeout=0.001))
+                    # skip the end signal
+                    if batch is not None:
+                        loaded.append(batch)
                 except:
                     pass
                 counter += 1
@@ -2870,6 +3134,862 @@ def test_BatchLoader():
             loader.terminate()
             assert loader.all_finished
 
+        # the end signal is put into the queue once all workers have finished
+        loader = ia.BatchLoader(_load_func, queue_size=2, nb_workers=nb_workers, threaded=True)
+        messages = []
+        while True:
+            message = loader.queue.get(timeout=5.0)
+            if loader.transport.decode(message) is None:
+                break
+            messages.append(message)
+        assert len(messages) == 20*nb_workers
+        assert loader.all_finished()
+        loader.terminate()
+
+
+def test_PickleTransport():
+    reseed()
+
+    images = (np.arange(2*32*32*3) % 200).astype(np.uint8).reshape((2, 32, 32, 3))
+    heatmaps = [ia.HeatmapsOnImage(np.ones((32, 32, 1), dtype=np.float32), shape=(32, 32, 3))]
+    batch = ia.Batch(images=images, heatmaps=heatmaps, data="foo", sample_ids=[0, 1])
+    transport = ia.PickleTransport()
+
+    # messages survive being sent through a queue, decoded arrays are
+    # writable copies by default
+    queue = multiprocessing.Queue()
+    queue.put(transport.encode(batch))
+    message = queue.get(timeout=10)
+    batch_decoded = transport.decode(message)
+    assert np.array_equal(batch_decoded.images, images)
+    assert np.allclose(batch_decoded.heatmaps[0].arr_0to1, 1.0)
+    assert batch_decoded.data == "foo"
+    assert batch_decoded.sample_ids == [0, 1]
+    batch_decoded.images[0, 0, 0, 0] = 255
+    assert transport.decode(message).images[0, 0, 0, 0] == 0
+    queue.close()
+
+    # without copying, arrays are views of the message
+    if sys.version_info >= (3, 8):
+        batch_view = transport.decode(message, copy=False)
+        assert np.array_equal(batch_view.images, images)
+        assert np.allclose(batch_view.heatmaps[0].arr_0to1, 1.0)
+        batch_view.images[0, 0, 0, 0] = 255
+        assert transport.decode(message, copy=False).images[0, 0, 0, 0] == 255
+        transport.release(message)
+
+    # non-contiguous and object arrays are pickled as usual
+    batch = ia.Batch(images=images[:, ::2, ::2, :], data=np.array([1, "a"], dtype=object))
+    batch_decoded = transport.decode(transport.encode(batch))
+    assert np.array_equal(batch_decoded.images, images[:, ::2, ::2, :])
+    assert list(batch_decoded.data) == [1, "a"]
+
+    assert transport.decode(transport.encode(None)) is None
+
+
+def test_SharedMemoryTransport():
+    if sys.version_info < (3, 8):
+        return
+
+    reseed()
+
+    transport = ia.SharedMemoryTransport(slot_size=4096, nb_slots=2)
+    images = np.arange(2*4*4*3).astype(np.uint8).reshape((2, 4, 4, 3))
+    images_list = [np.zeros((2, 2, 3), dtype=np.uint8), np.ones((3, 3), dtype=np.float32)]
+    keypoints = [ia.KeypointsOnImage([ia.Keypoint(x=1, y=2)], shape=(4, 4, 3))]
+    batch = ia.Batch(images=images, images_gt=images_list, keypoints=keypoints, data="foo")
+
+    # arrays are moved through a slot, the input batch is not changed
+    message = transport.encode(batch)
+    assert message[0] is not None
+    assert batch.images is images
+    batch_decoded = transport.decode(message)
+    assert np.array_equal(batch_decoded.images, images)
+    assert batch_decoded.images.dtype.type == np.uint8
+    assert array_equal_lists(batch_decoded.images_gt, images_list)
+    assert batch_decoded.images_gt[1].dtype.type == np.float32
+    assert batch_decoded.keypoints[0].keypoints[0].y == 2
+    assert batch_decoded.data == "foo"
+    assert batch_decoded.images_aug is None
+
+    # arrays within augmentables are written to the slot too
+    heatmaps = ia.HeatmapsOnImage(np.full((4, 4, 1), 0.5, dtype=np.float32), shape=(4, 4, 3))
+    message = transport.encode(ia.Batch(heatmaps=[heatmaps]))
+    assert message[0] is not None
+    assert len(message[1][1]) == 1
+    assert np.allclose(transport.decode(message).heatmaps[0].arr_0to1, 0.5)
+
+    # views are only valid until the message is released
+    message = transport.encode(batch)
+    batch_view = transport.decode(message, copy=False)
+    assert np.array_equal(batch_view.images, images)
+    assert batch_view.images.base is not None
+    del batch_view
+    transport.release(message)
+
+    # batches that are too large or sent while all slots are used are pickled
+    message1 = transport.encode(ia.Batch(images=np.zeros((1, 64, 64, 3), dtype=np.uint8)))
+    assert message1[0] is None
+    assert transport.decode(message1).images.shape == (1, 64, 64, 3)
+    messages = [transport.encode(batch) for _ in sm.xrange(3)]
+    assert messages[2][0] is None
+    assert all([np.array_equal(transport.decode(message).images, images) for message in messages])
+    assert transport.decode(transport.encode(None)) is None
+    transport.close()
+
+    # background augmentation with shared memory in both queues
+    def _load_func():
+        for i in sm.xrange(10):
+            yield ia.Batch(images=np.full((2, 4, 4, 3), i, dtype=np.uint8), data=i)
+
+    aug = iaa.Add(1)
+    loader = ia.BatchLoader(_load_func, transport=ia.SharedMemoryTransport(slot_size=128))
+    bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=2,
+                                          transport=ia.SharedMemoryTransport(slot_size=256, nb_slots=4))
+    batches_aug = []
+    while True:
+        batch_aug = bg_augmenter.get_batch()
+        if batch_aug is None:
+            break
+        batches_aug.append(batch_aug)
+    loader.terminate()
+    bg_augmenter.terminate()
+    assert sorted([batch_aug.data for batch_aug in batches_aug]) == list(sm.xrange(10))
+    for batch_aug in batches_aug:
+        assert np.all(batch_aug.images == batch_aug.data)
+        assert np.all(batch_aug.images_aug == batch_aug.data + 1)
+
+
+def test_FileBatchLoader():
+    reseed()
+
+    # images 0-4 have shape (4, 6, 3), images 5-7 shape (5, 3, 3), the
+    # value of each pixel is 10 times the image index
+    dirpath = tempfile.mkdtemp()
+    images = []
+    sources = []
+    for i in sm.xrange(8):
+        image = np.zeros((4, 6, 3) if i < 5 else (5, 3, 3), dtype=np.uint8)
+        image[...] = 10 * i
+        image[0, 0, 0] = 255
+        images.append(image)
+        filepath = os.path.join(dirpath, "%d.png" % (i,))
+        # cv2 expects BGR, the loader returns RGB
+        cv2.imwrite(filepath, image[..., ::-1])
+        sources.append(filepath)
+    # encoded images can be used instead of file paths
+    sources[7] = bytearray(cv2.imencode(".png", images[7][..., ::-1])[1].tobytes())
+
+    def _load_all(loader):
+        batches = []
+        while True:
+            batch = loader.transport.decode(loader.queue.get(timeout=10))
+            if batch is None:
+                break
+            batches.append(batch)
+        loader.terminate()
+        return batches
+
+    # batches in the order of the sources
+    loader = ia.FileBatchLoader(sources, batch_size=3, nb_threads=2, prefetch=2, epoch=5)
+    batches = _load_all(loader)
+    assert [batch.sample_ids for batch in batches] == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert ia.is_np_array(batches[0].images)
+    assert batches[0].images.shape == (3, 4, 6, 3)
+    assert isinstance(batches[1].images, list)
+    assert batches[0].data == sources[0:3]
+    assert batches[2].data == [sources[6], None]
+    assert all([batch.epoch == 5 for batch in batches])
+    images_loaded = [image for batch in batches for image in batch.images]
+    for image, image_loaded in zip(images, images_loaded):
+        assert np.array_equal(image, image_loaded)
+
+    # bucketing by shape
+    loader = ia.FileBatchLoader(sources, batch_size=2, bucket_by_shape=True)
+    batches = _load_all(loader)
+    assert [batch.sample_ids for batch in batches] == [[0, 1], [2, 3], [5, 6], [4], [7]]
+    assert all([ia.is_np_array(batch.images) for batch in batches])
+    assert batches[2].images.shape == (2, 5, 3, 3)
+
+    # grayscale
+    loader = ia.FileBatchLoader(sources[0:2], batch_size=2, grayscale=True)
+    batches = _load_all(loader)
+    assert batches[0].images.shape == (2, 4, 6)
+
+    # no sources
+    loader = ia.FileBatchLoader([], batch_size=2)
+    assert _load_all(loader) == []
+
+    # usage with BackgroundAugmenter
+    loader = ia.FileBatchLoader(sources, batch_size=4, bucket_by_shape=True)
+    bg_augmenter = ia.BackgroundAugmenter(loader, iaa.Add(1), nb_workers=2, ordered=True)
+    sample_ids = []
+    while True:
+        batch_aug = bg_augmenter.get_batch()
+        if batch_aug is None:
+            break
+        for sample_id, image_aug in zip(batch_aug.sample_ids, batch_aug.images_aug):
+            assert np.array_equal(image_aug, np.clip(images[sample_id].astype(np.int32) + 1, 0, 255))
+        sample_ids.extend(batch_aug.sample_ids)
+    assert sorted(sample_ids) == list(sm.xrange(8))
+    loader.terminate()
+    bg_augmenter.terminate()
+
+
+def test_Batch_images_encoded():
+    reseed()
+
+    images = [np.full((4, 4, 3), 10*i, dtype=np.uint8) for i in sm.xrange(4)]
+    for image in images:
+        image[0, 0, :] = [255, 0, 0]
+    images_encoded = [cv2.imencode(".png", image[..., ::-1])[1].tobytes() for image in images]
+
+    def _create_batch(indices):
+        return ia.Batch(images_encoded=[images_encoded[i] for i in indices], sample_ids=list(indices), data=indices)
+
+    # decoding
+    batch = _create_batch([0, 1])
+    assert batch.nb_rows == 2
+    assert batch.decode_images_() is batch
+    assert batch.images_encoded is None
+    assert ia.is_np_array(batch.images)
+    assert np.array_equal(batch.images, np.array(images[0:2]))
+    assert batch.decode_images_() is batch
+
+    got_exception = False
+    try:
+        _ = ia.Batch(images_encoded=[b"foo"]).decode_images_()
+    except Exception as exc:
+        assert "Could not decode image" in str(exc)
+        got_exception = True
+    assert got_exception
+
+    # chunks contain the encoded images
+    chunks = _create_batch([0, 1, 2]).split(2)
+    assert [len(chunk.images_encoded) for chunk in chunks] == [2, 1]
+    assert chunks[0].images is None
+
+    aug = iaa.Add(1)
+
+    def _assert_augmented(batch_aug):
+        assert batch_aug.images_encoded is None
+        for i, image_aug in zip(batch_aug.data, batch_aug.images_aug):
+            assert np.array_equal(image_aug, np.clip(images[i].astype(np.int32) + 1, 0, 255))
+
+    # BackgroundAugmenter and AugmentationPool decode in their workers
+    def _load_batches():
+        yield _create_batch([0, 1, 2])
+        yield _create_batch([3])
+
+    for chunk_size in [None, 1]:
+        loader = ia.BatchLoader(_load_batches)
+        bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=2, chunk_size=chunk_size, ordered=True, seed=1)
+        batches_aug = [bg_augmenter.get_batch(), bg_augmenter.get_batch()]
+        assert bg_augmenter.get_batch() is None
+        assert [batch_aug.data for batch_aug in batches_aug] == [[0, 1, 2], [3]]
+        for batch_aug in batches_aug:
+            _assert_augmented(batch_aug)
+        loader.terminate()
+        bg_augmenter.terminate()
+
+    with ia.AugmentationPool(aug, nb_workers=1) as pool:
+        for batch_aug in pool.map_batches(_load_batches()):
+            _assert_augmented(batch_aug)
+
+    for background in [False, True]:
+        batches_aug = list(aug.augment_batches([_create_batch([0, 1])], background=background))
+        _assert_augmented(batches_aug[0])
+
+    # FileBatchLoader only reads the files
+    dirpath = tempfile.mkdtemp()
+    filepaths = []
+    for i, encoded in enumerate(images_encoded):
+        filepaths.append(os.path.join(dirpath, "%d.png" % (i,)))
+        with open(filepaths[-1], "wb") as f:
+            f.write(encoded)
+    loader = ia.FileBatchLoader(filepaths, batch_size=3, decode=False)
+    batch = loader.transport.decode(loader.queue.get(timeout=10))
+    assert batch.images is None
+    assert batch.images_encoded == images_encoded[0:3]
+    assert batch.sample_ids == [0, 1, 2]
+    loader.terminate()
+
+    loader = ia.FileBatchLoader(filepaths, batch_size=3, decode=False)
+    bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=2)
+    nb_images = 0
+    while True:
+        batch_aug = bg_augmenter.get_batch()
+        if batch_aug is None:
+            break
+        batch_aug.data = batch_aug.sample_ids
+        _assert_augmented(batch_aug)
+        nb_images += len(batch_aug.images_aug)
+    assert nb_images == 4
+    loader.terminate()
+    bg_augmenter.terminate()
+
+
+def test_MemmapBatchLoader():
+    reseed()
+
+    dirpath = tempfile.mkdtemp()
+    filepath = os.path.join(dirpath, "images.npy")
+    images = np.arange(10).astype(np.uint8)[:, np.newaxis, np.newaxis, np.newaxis] * np.ones((1, 3, 4, 3), dtype=np.uint8)
+    np.save(filepath, images)
+
+    # batches only contain the indices
+    loader = ia.MemmapBatchLoader(filepath, 4, sample_ids=[9, 2, 5, 0, 1], epoch=2)
+    batch = loader.transport.decode(loader.queue.get(timeout=10))
+    assert batch.images is None
+    assert batch.images_filepath == filepath
+    assert batch.sample_ids == [9, 2, 5, 0]
+    assert batch.epoch == 2
+    assert batch.nb_rows == 4
+    assert batch.load_images_() is batch
+    assert np.array_equal(batch.images, images[[9, 2, 5, 0]])
+    loader.terminate()
+
+    got_exception = False
+    try:
+        _ = ia.Batch(images_filepath=filepath)
+    except Exception as exc:
+        assert "sample_ids" in str(exc)
+        got_exception = True
+    assert got_exception
+
+    aug = iaa.Add(1)
+
+    # augmented images are sent back
+    loader = ia.MemmapBatchLoader(filepath, 3)
+    bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=2)
+    sample_ids = []
+    while True:
+        batch_aug = bg_augmenter.get_batch()
+        if batch_aug is None:
+            break
+        assert np.array_equal(batch_aug.images_aug, images[batch_aug.sample_ids] + 1)
+        sample_ids.extend(batch_aug.sample_ids)
+    assert sorted(sample_ids) == list(sm.xrange(10))
+    loader.terminate()
+    bg_augmenter.terminate()
+
+    # augmented images are written to a file
+    filepath_aug = os.path.join(dirpath, "images_aug.npy")
+    for chunk_size in [None, 2]:
+        images_aug = np.lib.format.open_memmap(filepath_aug, mode="w+", shape=images.shape, dtype=images.dtype)
+        loader = ia.MemmapBatchLoader(filepath, 4, sample_ids=sm.xrange(9), images_aug_filepath=filepath_aug)
+        bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=2, chunk_size=chunk_size, seed=1)
+        nb_images = 0
+        while True:
+            batch_aug = bg_augmenter.get_batch()
+            if batch_aug is None:
+                break
+            assert batch_aug.images is None
+            assert batch_aug.images_aug is None
+            nb_images += len(batch_aug.sample_ids)
+        assert nb_images == 9
+        assert np.array_equal(images_aug[0:9], images[0:9] + 1)
+        assert np.all(images_aug[9] == 0)
+        loader.terminate()
+        bg_augmenter.terminate()
+        del images_aug
+
+    # augmented images that don't fit into the file
+    batch = ia.Batch(images_filepath=filepath, images_aug_filepath=filepath_aug, sample_ids=[0]).load_images_()
+    batch.images_aug = np.zeros((1, 2, 2, 3), dtype=np.uint8)
+    got_exception = False
+    try:
+        batch.store_images_aug_()
+    except Exception as exc:
+        assert "Expected augmented images to have shape" in str(exc)
+        got_exception = True
+    assert got_exception
+
+    # AugmentationPool
+    with ia.AugmentationPool(aug, nb_workers=2) as pool:
+        batches = [ia.Batch(images_filepath=filepath, sample_ids=[i, i+1]) for i in sm.xrange(0, 10, 2)]
+        for batch_aug in pool.map_batches(batches):
+            assert np.array_equal(batch_aug.images_aug, images[batch_aug.sample_ids] + 1)
+
+        # files that are recreated with another shape are reopened by the
+        # long-lived workers
+        for shape in [(10, 3, 4, 3), (10, 6, 2, 3)]:
+            images_aug = np.lib.format.open_memmap(filepath_aug, mode="w+", shape=shape, dtype=np.uint8)
+            del images_aug
+            batches = [ia.Batch(images=np.zeros((2,) + shape[1:], dtype=np.uint8), images_aug_filepath=filepath_aug,
+                                sample_ids=[i, i+1]) for i in sm.xrange(0, 10, 2)]
+            assert len(list(pool.map_batches(batches))) == 5
+            images_aug = np.load(filepath_aug)
+            assert images_aug.shape == shape
+            assert np.all(images_aug == 1)
+
+
+def test_BackgroundAugmenter_ordered():
+    reseed()
+
+    def _load_func():
+        for i in sm.xrange(20):
+            yield ia.Batch(images=np.full((1, 4, 4, 3), i, dtype=np.uint8), data=i)
+
+    # batches take random amounts of time, so that workers finish them out of order
+    def _func_images(images, random_state, parents, hooks):
+        time.sleep(random_state.uniform(0, 0.02))
+        return images
+
+    aug = iaa.Lambda(_func_images, None, None)
+    for reorder_window in [None, 1, 3]:
+        loader = ia.BatchLoader(_load_func)
+        bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=3, ordered=True, reorder_window=reorder_window)
+        batches_aug = []
+        while True:
+            batch_aug = bg_augmenter.get_batch()
+            if batch_aug is None:
+                break
+            batches_aug.append(batch_aug)
+            assert len(bg_augmenter._reorder_buffer) < bg_augmenter.reorder_window
+        loader.terminate()
+        bg_augmenter.terminate()
+        assert [batch_aug.data for batch_aug in batches_aug] == list(sm.xrange(20))
+        assert all([np.all(batch_aug.images_aug == batch_aug.data) for batch_aug in batches_aug])
+
+
+def test_BackgroundAugmenter_autoscale():
+    reseed()
+
+    def _load_func():
+        for i in sm.xrange(40):
+            yield ia.Batch(images=np.full((1, 4, 4, 3), i, dtype=np.uint8), data=i)
+
+    def _get_all_batches(bg_augmenter, sleep=0):
+        batches_aug = []
+        nb_workers_active = []
+        while True:
+            batch_aug = bg_augmenter.get_batch()
+            if batch_aug is None:
+                break
+            batches_aug.append(batch_aug)
+            nb_workers_active.append(bg_augmenter.nb_workers_active)
+            time.sleep(sleep)
+        return batches_aug, nb_workers_active
+
+    # slow consumer, workers are removed down to the minimum
+    loader = ia.BatchLoader(_load_func)
+    bg_augmenter = ia.BackgroundAugmenter(loader, iaa.Noop(), queue_size=4, nb_workers=(1, 3), autoscale_interval=0)
+    assert bg_augmenter.nb_workers == 3
+    assert bg_augmenter.nb_workers_active == 3
+    batches_aug, nb_workers_active = _get_all_batches(bg_augmenter, sleep=0.01)
+    loader.terminate()
+    bg_augmenter.terminate()
+    assert sorted([batch_aug.data for batch_aug in batches_aug]) == list(sm.xrange(40))
+    assert min(nb_workers_active[0:20]) == 1
+
+    # slow augmentation, workers are added up to the maximum
+    def _func_images(images, random_state, parents, hooks):
+        time.sleep(0.01)
+        return images
+
+    loader = ia.BatchLoader(_load_func)
+    bg_augmenter = ia.BackgroundAugmenter(loader, iaa.Lambda(_func_images, None, None), queue_size=4,
+                                          nb_workers=(1, 3), autoscale_interval=0)
+    bg_augmenter._set_nb_workers_active(1)
+    batches_aug, nb_workers_active = _get_all_batches(bg_augmenter)
+    loader.terminate()
+    bg_augmenter.terminate()
+    assert sorted([batch_aug.data for batch_aug in batches_aug]) == list(sm.xrange(40))
+    # only the first batches, as all workers are activated at the end of the data
+    assert max(nb_workers_active[0:20]) == 3
+
+    # fixed number of workers
+    loader = ia.BatchLoader(_load_func)
+    bg_augmenter = ia.BackgroundAugmenter(loader, iaa.Noop(), nb_workers=2)
+    assert bg_augmenter.nb_workers_active == 2
+    batches_aug, _ = _get_all_batches(bg_augmenter)
+    loader.terminate()
+    bg_augmenter.terminate()
+    assert len(batches_aug) == 40
+
+
+def test_BackgroundAugmenter_chunks():
+    reseed()
+
+    nb_images = 9
+    images = [np.full((8, 8, 3), i*10, dtype=np.uint8) for i in sm.xrange(nb_images)]
+    aug = iaa.Sequential([iaa.Fliplr(0.5), iaa.Add((-5, 5)), iaa.Affine(translate_px={"x": (-2, 2)})])
+
+    def _load_batches():
+        for i in sm.xrange(0, nb_images, 4):
+            indices = list(sm.xrange(i, min(i+4, nb_images)))
+            yield ia.Batch(images=np.array([images[j] for j in indices]), sample_ids=indices, data=indices)
+
+    def _augment_all(**kwargs):
+        loader = ia.BatchLoader(_load_batches)
+        bg_augmenter = ia.BackgroundAugmenter(loader, aug, seed=1, **kwargs)
+        batches_aug = []
+        while True:
+            batch_aug = bg_augmenter.get_batch()
+            if batch_aug is None:
+                break
+            batches_aug.append(batch_aug)
+        loader.terminate()
+        bg_augmenter.terminate()
+        return batches_aug
+
+    # chunking doesn't change the results, the batches are reassembled
+    batches_aug_expected = _augment_all(nb_workers=1, ordered=True)
+    for kwargs in [dict(nb_workers=3, chunk_size=1, ordered=True),
+                   dict(nb_workers=2, chunk_size=3, ordered=True),
+                   dict(nb_workers=2, chunk_size=2)]:
+        batches_aug = _augment_all(**kwargs)
+        if not kwargs.get("ordered", False):
+            batches_aug = sorted(batches_aug, key=lambda batch_aug: batch_aug.data[0])
+        assert [batch_aug.data for batch_aug in batches_aug] == [[0, 1, 2, 3], [4, 5, 6, 7], [8]]
+        for batch_aug, batch_aug_expected in zip(batches_aug, batches_aug_expected):
+            assert ia.is_np_array(batch_aug.images_aug)
+            assert np.array_equal(batch_aug.images, batch_aug_expected.images)
+            assert np.array_equal(batch_aug.images_aug, batch_aug_expected.images_aug)
+            assert batch_aug.sample_ids == batch_aug_expected.sample_ids
+
+    # idle workers augment the chunks of a batch, each chunk can only be
+    # finished while another worker augments a chunk at the same time
+    barrier = multiprocessing.Barrier(2, timeout=30)
+
+    def _wait_for_other_worker(images, random_state, parents, hooks):
+        barrier.wait()
+        return images
+
+    def _load_one_batch():
+        yield ia.Batch(images=np.zeros((8, 1, 1, 1), dtype=np.uint8), sample_ids=list(sm.xrange(8)))
+
+    loader = ia.BatchLoader(_load_one_batch)
+    bg_augmenter = ia.BackgroundAugmenter(loader, iaa.Lambda(_wait_for_other_worker, None, None), nb_workers=3,
+                                          chunk_size=1, seed=1)
+    batch_aug = bg_augmenter.get_batch()
+    assert len(batch_aug.images_aug) == 8
+    assert bg_augmenter.get_batch() is None
+    nb_chunks_per_worker = [worker["batches"] for worker in bg_augmenter.get_stats()["workers"]]
+    assert sum(nb_chunks_per_worker) == 8
+    assert len([nb_chunks for nb_chunks in nb_chunks_per_worker if nb_chunks > 0]) >= 2
+    loader.terminate()
+    bg_augmenter.terminate()
+
+    # chunking requires a seed
+    loader = ia.BatchLoader(_load_batches)
+    got_exception = False
+    try:
+        _ = ia.BackgroundAugmenter(loader, aug, nb_workers=2, chunk_size=2)
+    except Exception as exc:
+        assert "seed" in str(exc)
+        got_exception = True
+    assert got_exception
+    loader.terminate()
+
+
+def test_BackgroundAugmenter_stats():
+    reseed()
+
+    def _load_batches():
+        for i in sm.xrange(6):
+            yield ia.Batch(images=np.zeros((2, 4, 4, 3), dtype=np.uint8), data=i)
+
+    def _sleep(images, random_state, parents, hooks):
+        time.sleep(0.01)
+        return images
+
+    stats_filepath = os.path.join(tempfile.mkdtemp(), "imgaug.prom")
+    loader = ia.BatchLoader(_load_batches, queue_size=10)
+    bg_augmenter = ia.BackgroundAugmenter(loader, iaa.Lambda(_sleep, None, None), nb_workers=2,
+                                          stats_filepath=stats_filepath, stats_interval=1000)
+    assert bg_augmenter.get_stats()["batches"] == 0
+    nb_batches = 0
+    while True:
+        batch_aug = bg_augmenter.get_batch()
+        if batch_aug is None:
+            break
+        nb_batches += 1
+        assert os.path.isfile(stats_filepath)
+    assert nb_batches == 6
+
+    stats_loader = loader.get_stats()
+    assert stats_loader["batches"] == 6
+    assert sum([stats_worker["batches"] for stats_worker in stats_loader["workers"]]) == 6
+    assert stats_loader["load_seconds"] >= 0
+    assert stats_loader["encode_seconds"] > 0
+    assert stats_loader["batches_per_second"] > 0
+    assert 0 <= stats_loader["queue_occupancy"] <= 1.0
+
+    stats = bg_augmenter.get_stats()
+    assert stats["batches"] == 6
+    assert stats["batches_per_second"] > 0
+    assert stats["worker_batches"] == 6
+    assert len(stats["workers"]) == 2
+    assert stats["worker_busy_seconds"] >= 6 * 0.01
+    assert stats["worker_idle_seconds"] > 0
+    assert stats["worker_encode_seconds"] > 0
+    assert stats["decode_seconds"] > 0
+    assert stats["get_batch_wait_seconds"]["count"] == 6
+    assert stats["get_batch_wait_seconds"]["buckets"][-1] == (float("inf"), 6)
+    assert stats["queue_occupancy"] == 0
+    assert stats["queue_occupancy_histogram"]["count"] == 7
+    assert stats["source_queue_occupancy_histogram"]["count"] == 7
+
+    # the file is written again after the last batch
+    with open(stats_filepath, "r") as f:
+        text = f.read()
+    assert text == loader.get_prometheus_text() + bg_augmenter.get_prometheus_text()
+    assert "# TYPE imgaug_background_augmenter_get_batch_wait_seconds histogram" in text
+    assert 'imgaug_background_augmenter_get_batch_wait_seconds_bucket{le="+Inf"} 6' in text
+    assert "imgaug_background_augmenter_batches_total 6.0" in text
+    assert 'imgaug_background_augmenter_worker_busy_seconds_total{worker="1"}' in text
+    assert "# TYPE imgaug_batch_loader_batches_total counter" in text
+    assert 'imgaug_batch_loader_batches_total{worker="0"} 6.0' in text
+
+    loader.terminate()
+    bg_augmenter.terminate()
+
+
+def test_BackgroundAugmenter_modalities():
+    reseed()
+
+    # each modality marks the column x=1, which is flipped to x=6
+    nb_images = 16
+    image = np.zeros((4, 8, 1), dtype=np.uint8)
+    image[:, 1, :] = 255
+    heatmap_arr = np.zeros((4, 8, 1), dtype=np.float32)
+    heatmap_arr[:, 1, :] = 1.0
+    segmap_arr = np.zeros((4, 8), dtype=np.int32)
+    segmap_arr[:, 1] = 1
+
+    def _create_batch():
+        return ia.Batch(
+            images=np.array([image] * nb_images),
+            heatmaps=[ia.HeatmapsOnImage(heatmap_arr, shape=(4, 8, 1)) for _ in sm.xrange(nb_images)],
+            segmentation_maps=[ia.SegmentationMapOnImage(segmap_arr, shape=(4, 8, 1), nb_classes=2)
+                               for _ in sm.xrange(nb_images)],
+            keypoints=[ia.KeypointsOnImage([ia.Keypoint(x=1, y=2)], shape=(4, 8, 1)) for _ in sm.xrange(nb_images)],
+            bounding_boxes=[ia.BoundingBoxesOnImage([ia.BoundingBox(x1=0, y1=0, x2=2, y2=4)], shape=(4, 8, 1))
+                            for _ in sm.xrange(nb_images)],
+            data="foo"
+        )
+
+    def _assert_aligned(batch_aug):
+        assert batch_aug.data == "foo"
+        cols = []
+        for i in sm.xrange(nb_images):
+            col = int(np.argmax(batch_aug.images_aug[i][0, :, 0]))
+            assert int(np.argmax(batch_aug.heatmaps_aug[i].get_arr()[0, :, 0])) == col
+            assert int(np.argmax(batch_aug.segmentation_maps_aug[i].get_arr_int()[0, :])) == col
+            assert np.isclose(batch_aug.keypoints_aug[i].keypoints[0].x, col)
+            assert np.isclose(batch_aug.bounding_boxes_aug[i].bounding_boxes[0].center_x, col)
+            cols.append(col)
+        assert set(cols) == set([1, 6])
+
+    aug = iaa.Fliplr(0.5)
+
+    def _load_batches():
+        yield _create_batch()
+
+    loader = ia.BatchLoader(_load_batches)
+    bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=1)
+    _assert_aligned(bg_augmenter.get_batch())
+    assert bg_augmenter.get_batch() is None
+    loader.terminate()
+    bg_augmenter.terminate()
+
+    for background in [False, True]:
+        batches_aug = list(aug.augment_batches([_create_batch()], background=background))
+        assert len(batches_aug) == 1
+        _assert_aligned(batches_aug[0])
+
+    # containers pass images and keypoints to their children, which must
+    # augment both in the same way
+    aug = iaa.Alpha(1.0, first=iaa.Affine(rotate=(-90, 90), order=0))
+
+    def _load_blob_batches():
+        for _ in sm.xrange(4):
+            yield _create_blob_batch(8)
+
+    loader = ia.BatchLoader(_load_blob_batches)
+    bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=2)
+    nb_batches = 0
+    while True:
+        batch_aug = bg_augmenter.get_batch()
+        if batch_aug is None:
+            break
+        assert _get_max_blob_keypoint_distance(batch_aug) < 2.0
+        nb_batches += 1
+    assert nb_batches == 4
+    loader.terminate()
+    bg_augmenter.terminate()
+
+    batches_aug = list(aug.augment_batches([_create_blob_batch(8) for _ in sm.xrange(2)], background=True))
+    assert all([_get_max_blob_keypoint_distance(batch_aug) < 2.0 for batch_aug in batches_aug])
+
+
+def test_AugmentationPool():
+    reseed()
+
+    def _create_batches(nb_batches):
+        return [ia.Batch(images=np.full((2, 4, 4, 3), i, dtype=np.uint8),
+                         keypoints=[ia.KeypointsOnImage([ia.Keypoint(x=1, y=2)], shape=(4, 4, 3))] * 2,
+                         data=i)
+                for i in sm.xrange(nb_batches)]
+
+    with ia.AugmentationPool(iaa.Add(1), nb_workers=2, queue_size=4) as pool:
+        pids = [worker.pid for worker in pool.workers]
+
+        # batches are returned in order and the workers are reused for each stream
+        for _ in sm.xrange(3):
+            batches_aug = list(pool.map_batches(_create_batches(10)))
+            assert [batch_aug.data for batch_aug in batches_aug] == list(sm.xrange(10))
+            assert all([np.all(batch_aug.images_aug == batch_aug.data + 1) for batch_aug in batches_aug])
+            assert all([batch_aug.keypoints_aug[0].keypoints[0].y == 2 for batch_aug in batches_aug])
+        assert [worker.pid for worker in pool.workers] == pids
+        assert all([worker.is_alive() for worker in pool.workers])
+        assert list(pool.map_batches([])) == []
+
+        batches_aug = list(pool.map_batches(_create_batches(10), ordered=False))
+        assert sorted([batch_aug.data for batch_aug in batches_aug]) == list(sm.xrange(10))
+
+        # the augmenter is only sent again if it changed
+        aug = iaa.Add(2)
+        pool.set_augmenter(aug)
+        version = pool.augmenter_version
+        pool.set_augmenter(aug)
+        assert pool.augmenter_version == version
+        batches_aug = list(pool.map_batches(_create_batches(4), augseq=aug))
+        assert pool.augmenter_version == version
+        assert all([np.all(batch_aug.images_aug == batch_aug.data + 2) for batch_aug in batches_aug])
+
+        # streams that are not exhausted don't affect the next one
+        gen = pool.map_batches(_create_batches(20), augseq=iaa.Add(3))
+        assert next(gen).data == 0
+        gen.close()
+        batches_aug = list(pool.map_batches(_create_batches(5)))
+        assert [batch_aug.data for batch_aug in batches_aug] == list(sm.xrange(5))
+        assert all([np.all(batch_aug.images_aug == batch_aug.data + 3) for batch_aug in batches_aug])
+
+        # augment_batches() can use the pool
+        images = np.zeros((2, 4, 4, 3), dtype=np.uint8)
+        images_aug = list(iaa.Add(4).augment_batches([images, images], pool=pool))
+        assert len(images_aug) == 2
+        assert all([np.all(images_aug_i == 4) for images_aug_i in images_aug])
+
+        # errors in the workers are raised in the main process
+        got_exception = False
+        try:
+            _ = list(pool.map_batches([ia.Batch(images=images, keypoints=[])], augseq=iaa.Noop()))
+        except Exception as exc:
+            assert "failed in background process" in str(exc)
+            got_exception = True
+        assert got_exception
+
+    assert pool.closed
+    assert not any([worker.is_alive() for worker in pool.workers])
+
+    # no more than reorder_window batches are taken from the stream before
+    # the first one was yielded
+    nb_taken = []
+
+    def _count_batches(batches):
+        for batch in batches:
+            nb_taken.append(batch.data)
+            yield batch
+
+    with ia.AugmentationPool(iaa.Add(1), nb_workers=2, queue_size=10, reorder_window=3) as pool:
+        assert pool.reorder_window == 3
+        for ordered in [True, False]:
+            nb_taken = []
+            gen = pool.map_batches(_count_batches(_create_batches(20)), ordered=ordered)
+            _ = next(gen)
+            time.sleep(0.2)
+            assert len(nb_taken) <= 3 + 1
+            batches_aug = [_] + list(gen)
+            assert len(batches_aug) == 20
+            assert len(nb_taken) == 20
+
+    # workers that die are detected instead of waiting forever
+    pool = ia.AugmentationPool(iaa.Add(1), nb_workers=2)
+    for worker in pool.workers:
+        worker.terminate()
+        worker.join()
+    got_exception = False
+    try:
+        _ = list(pool.map_batches(_create_batches(5)))
+    except Exception as exc:
+        assert "died unexpectedly" in str(exc)
+        got_exception = True
+    assert got_exception
+    assert pool.closed
+
+
+# module-level, as AugmentationPool pickles its augmenter
+def _fill_with_nb_threads(images, random_state, parents, hooks):
+    return [np.full_like(image, cv2.getNumThreads()) for image in images]
+
+
+# module-level, so that it can be used as a process target
+def _configure_threads_and_report(queue, nb_threads, cpu_affinity):
+    ia.configure_worker_threads(nb_threads, cpu_affinity)
+    affinity = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    queue.put((cv2.getNumThreads(), os.environ.get("OMP_NUM_THREADS"), iaa.get_n_jobs(), affinity))
+
+
+def test_configure_worker_threads():
+    reseed()
+
+    # run in a separate process to not change the settings of the tests
+    cores = ia.get_available_cpu_cores()
+    assert len(cores) >= 1
+    try:
+        # the worker inherits the number of jobs of the parent
+        iaa.set_n_jobs(4)
+        queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=_configure_threads_and_report, args=(queue, 1, cores[0:1]))
+        worker.start()
+        nb_threads, omp_num_threads, n_jobs, affinity = queue.get(timeout=10)
+        worker.join()
+    finally:
+        iaa.set_n_jobs(1)
+    assert nb_threads == 1
+    assert omp_num_threads == "1"
+    assert n_jobs == 1
+    assert affinity is None or affinity == cores[0:1]
+
+    # thread policy
+    configs = ia.imgaug._compute_worker_thread_configs(2, 3, False)
+    assert configs == [(3, None), (3, None)]
+    configs = ia.imgaug._compute_worker_thread_configs(2, None, False)
+    assert configs == [(None, None), (None, None)]
+    configs = ia.imgaug._compute_worker_thread_configs(len(cores) * 2, "auto", False)
+    assert all([nb_threads == 1 for nb_threads, _ in configs])
+    configs = ia.imgaug._compute_worker_thread_configs(1, "auto", True)
+    assert configs == [(len(cores), cores)]
+    configs = ia.imgaug._compute_worker_thread_configs(len(cores) + 1, 1, True)
+    assert [cpu_affinity for _, cpu_affinity in configs] == [[core] for core in cores] + [[cores[0]]]
+
+    # the workers of BackgroundAugmenter and AugmentationPool apply the policy
+    aug = iaa.Lambda(_fill_with_nb_threads, None, None)
+    images = np.zeros((1, 2, 2, 1), dtype=np.uint8)
+
+    def _load_batches():
+        yield ia.Batch(images=images)
+
+    batch_loader = ia.BatchLoader(_load_batches)
+    bg_augmenter = ia.BackgroundAugmenter(batch_loader, aug, nb_workers=2, threads_per_worker=3)
+    batch_aug = bg_augmenter.get_batch()
+    assert np.all(np.array(batch_aug.images_aug) == 3)
+    batch_loader.terminate()
+    bg_augmenter.terminate()
+
+    with ia.AugmentationPool(aug, nb_workers=1, threads_per_worker=2) as pool:
+        batches_aug = list(pool.map_batches([ia.Batch(images=images)]))
+        assert np.all(np.array(batches_aug[0].images_aug) == 2)
+
+    # by default, the libraries' thread counts are not changed
+    with ia.AugmentationPool(aug, nb_workers=1) as pool:
+        batches_aug = list(pool.map_batches([ia.Batch(images=images)]))
+        assert np.all(np.array(batches_aug[0].images_aug) == cv2.getNumThreads())
+
 
 def test_Noop():
     reseed()
@@ -10267,6 +11387,21 @@ def test_ElasticTransformation():
     assert heatmaps.max_value - 1e-6 < observed.max_value < heatmaps.max_value + 1e-6
     assert np.sum(observed.get_arr() > 0.01) == 0
 
+    # heatmaps that are smaller than their image are warped at the image's
+    # size, the values are clipped to [0.0, 1.0] as cubic interpolation
+    # overshoots at the edges of the checkerboard
+    arr = np.zeros((16, 16, 1), dtype=np.float32)
+    arr[0::2, 0::2] = 1.0
+    arr[1::2, 1::2] = 1.0
+    heatmaps = ia.HeatmapsOnImage(arr, shape=(32, 32, 3))
+    aug = iaa.ElasticTransformation(alpha=3.0, sigma=0.5, order=3)
+    observed = aug.augment_heatmaps([heatmaps])[0]
+    assert observed.shape == (32, 32, 3)
+    assert observed.arr_0to1.shape == (16, 16, 1)
+    assert np.min(observed.arr_0to1) >= 0.0
+    assert np.max(observed.arr_0to1) <= 1.0
+    assert not np.allclose(observed.arr_0to1, arr)
+
     # mode
     # no proper tests here, because unclear how to test
     aug = iaa.ElasticTransformation(alpha=0.25, sigma=1.0, mode=ia.ALL)
@@ -10316,6 +11451,141 @@ def test_ElasticTransformation():
     assert params[4].value == "constant"
 
 
+def test_HomographyChain():
+    reseed()
+
+    img = np.arange(6*8).reshape((6, 8)).astype(np.uint8)
+    kps = [ia.KeypointsOnImage([ia.Keypoint(x=1, y=2), ia.Keypoint(x=5, y=4)], shape=(6, 8))]
+
+    # flips only, should be equal to non-fused flips
+    aug = iaa.HomographyChain([iaa.Fliplr(1.0), iaa.Flipud(1.0)])
+    observed = aug.augment_image(img)
+    expected = np.flipud(np.fliplr(img))
+    assert np.array_equal(observed, expected)
+    assert aug.interpolation == cv2.INTER_NEAREST
+
+    observed = aug.augment_keypoints(kps)
+    expected = [ia.KeypointsOnImage([ia.Keypoint(x=6, y=3), ia.Keypoint(x=2, y=1)], shape=(6, 8))]
+    assert keypoints_equal(observed, expected)
+
+    # crop without keep_size changes image size
+    aug = iaa.HomographyChain([iaa.Fliplr(1.0), iaa.Crop(px=(1, 0, 0, 2), keep_size=False)])
+    observed = aug.augment_image(img)
+    expected = np.fliplr(img)[1:, 2:]
+    assert np.array_equal(observed, expected)
+
+    observed = aug.augment_keypoints(kps)
+    expected = [ia.KeypointsOnImage([ia.Keypoint(x=6-2, y=2-1), ia.Keypoint(x=2-2, y=4-1)], shape=(5, 6))]
+    assert keypoints_equal(observed, expected)
+    assert observed[0].shape == (5, 6)
+
+    # heatmaps
+    heatmaps_arr = np.zeros((6, 8, 1), dtype=np.float32)
+    heatmaps_arr[0, 0, 0] = 1.0
+    heatmaps = ia.HeatmapsOnImage(heatmaps_arr, shape=(6, 8, 3))
+    aug = iaa.HomographyChain([iaa.Fliplr(1.0), iaa.Flipud(1.0)])
+    observed = aug.augment_heatmaps([heatmaps])[0]
+    assert observed.shape == (6, 8, 3)
+    assert np.allclose(observed.get_arr()[..., 0], np.flipud(np.fliplr(heatmaps_arr[..., 0])))
+
+    # settings are derived from children
+    aug = iaa.HomographyChain([iaa.Affine(rotate=10, order=3, cval=128), iaa.Fliplr(0.5)])
+    assert aug.interpolation == cv2.INTER_CUBIC
+    assert aug.cval == 128
+
+    # children without homography support are not allowed
+    got_exception = False
+    try:
+        _ = iaa.HomographyChain([iaa.Fliplr(0.5), iaa.Add(10)])
+    except Exception:
+        got_exception = True
+    assert got_exception
+
+    # children with different interpolations are only fused if the
+    # interpolation is provided explicitly
+    got_exception = False
+    try:
+        _ = iaa.HomographyChain([iaa.Affine(rotate=10, order=1), iaa.Scale(0.5, interpolation="cubic")])
+    except Exception:
+        got_exception = True
+    assert got_exception
+    aug = iaa.HomographyChain(
+        [iaa.Affine(rotate=10, order=1), iaa.Scale(0.5, interpolation="cubic")],
+        interpolation=cv2.INTER_LINEAR
+    )
+    assert aug.interpolation == cv2.INTER_LINEAR
+
+    # fused sequence should lead to (nearly) the same results as non-fused one
+    image = ia.quokka(size=(64, 64))
+    images = np.uint8([image] * 4)
+    keypoints = [ia.KeypointsOnImage([ia.Keypoint(x=10, y=20), ia.Keypoint(x=40, y=30)], shape=image.shape)] * 4
+    seq = iaa.Sequential([
+        iaa.Fliplr(0.5),
+        iaa.Affine(rotate=(-20, 20), translate_px=(-4, 4)),
+        iaa.Crop(px=(0, 8), keep_size=False),
+        iaa.Scale({"height": 48, "width": 56}, interpolation="linear")
+    ], random_state=1)
+    seq.localize_random_state_()
+    seq_det = seq.to_deterministic()
+    seq_fused = seq_det.deepcopy().compile()
+    assert len(seq_fused) == 1
+    assert isinstance(seq_fused[0], iaa.HomographyChain)
+
+    observed = np.array(seq_fused.augment_images(images))
+    expected = np.array(seq_det.augment_images(images))
+    assert observed.shape == expected.shape == (4, 48, 56, 3)
+    assert np.median(np.abs(observed.astype(np.int32) - expected.astype(np.int32))) <= 2
+
+    observed = seq_fused.augment_keypoints(keypoints)
+    expected = seq_det.augment_keypoints(keypoints)
+    assert keypoints_equal(observed, expected, eps=1.0)
+    assert all([kps_i.shape == (48, 56, 3) for kps_i in observed])
+
+    # compile() only fuses runs of at least two geometric children and
+    # splits runs with conflicting cvals
+    seq = iaa.Sequential([
+        iaa.Fliplr(0.5),
+        iaa.Add(10),
+        iaa.Fliplr(0.5),
+        iaa.Affine(rotate=10, cval=0),
+        iaa.Affine(rotate=10, cval=255),
+        iaa.Flipud(0.5),
+        iaa.Affine(rotate=10, mode="edge")
+    ])
+    seq_fused = seq.compile()
+    assert [aug.__class__.__name__ for aug in seq_fused] == ["Fliplr", "Add", "HomographyChain", "HomographyChain", "Affine"]
+    assert len(seq_fused[2].children) == 2
+    assert len(seq_fused[3].children) == 2
+    assert seq_fused[2].cval == 0
+    assert seq_fused[3].cval == 255
+    assert len(seq) == 7
+
+    # compile() splits runs with conflicting interpolations and never fuses
+    # children whose resampling a single warp cannot reproduce
+    seq = iaa.Sequential([
+        iaa.Fliplr(0.5),
+        iaa.Affine(rotate=10, order=1),
+        iaa.Scale(0.5, interpolation="cubic"),
+        iaa.Flipud(0.5),
+        iaa.Scale(2.0, interpolation="area"),
+        iaa.Crop(px=(0, 4), keep_size=True),
+        iaa.PerspectiveTransform(scale=0.05, keep_size=True),
+        iaa.Fliplr(0.5)
+    ])
+    seq_fused = seq.compile()
+    assert [aug.__class__.__name__ for aug in seq_fused] == [
+        "HomographyChain", "HomographyChain", "Scale", "CropAndPad", "PerspectiveTransform", "Fliplr"
+    ]
+    assert len(seq_fused[0].children) == 2
+    assert len(seq_fused[1].children) == 2
+    assert seq_fused[0].interpolation == cv2.INTER_LINEAR
+    assert seq_fused[1].interpolation == cv2.INTER_CUBIC
+
+    # random order sequences are not fused
+    seq = iaa.Sequential([iaa.Fliplr(0.5), iaa.Flipud(0.5)], random_order=True)
+    assert [aug.__class__.__name__ for aug in seq.compile()] == ["Fliplr", "Flipud"]
+
+
 def test_copy_dtypes_for_restore():
     # TODO using dtype=np.bool is causing this to fail as it ends up being <type bool> instead of
     # <type 'numpy.bool_'>. Any problems from that for the library?
@@ -10508,6 +11778,128 @@ def test_invert_reduce_to_nonempty():
     assert kpsois_recovered == []
 
 
+# module-level, so that it can be used as a process target
+def _blur_in_process(queue, images):
+    queue.put(iaa.GaussianBlur(sigma=1.0).augment_images(images))
+
+
+def test_set_n_jobs():
+    reseed()
+
+    assert iaa.get_n_jobs() == 1
+
+    images = np.uint8([ia.quokka(size=(32, 32))] * 6)
+    augs = [
+        iaa.Affine(rotate=(-20, 20), translate_px=(-4, 4)),
+        iaa.AffineCv2(rotate=(-20, 20)),
+        iaa.PiecewiseAffine(scale=0.05),
+        iaa.PerspectiveTransform(scale=0.1),
+        iaa.ElasticTransformation(alpha=(0, 5.0), sigma=0.25),
+        iaa.GaussianBlur(sigma=(0, 3.0)),
+        iaa.AverageBlur(k=(1, 5)),
+        iaa.MedianBlur(k=(1, 5)),
+        iaa.BilateralBlur(d=(1, 5)),
+        iaa.Superpixels(p_replace=0.5, n_segments=(4, 16)),
+        iaa.Sharpen(alpha=(0, 1.0)),
+        iaa.Grayscale(alpha=(0, 1.0)),
+        iaa.Sequential([iaa.Fliplr(0.5), iaa.Affine(rotate=(-20, 20))]).compile()
+    ]
+
+    try:
+        for aug in augs:
+            aug_det = aug.to_deterministic()
+            iaa.set_n_jobs(1)
+            expected = aug_det.augment_images(images)
+            iaa.set_n_jobs(4)
+            assert iaa.get_n_jobs() == 4
+            observed = aug_det.augment_images(images)
+            assert array_equal_lists(list(observed), list(expected))
+            observed = aug_det.augment_images(list(images))
+            assert array_equal_lists(list(observed), list(expected))
+
+        # results are returned in order
+        iaa.set_n_jobs(3)
+        assert iaa.map_per_image(lambda i: i * 2, 10) == [i * 2 for i in range(10)]
+
+        # forked processes create their own thread pool, the parent's one
+        # has no threads in them
+        iaa.set_n_jobs(2)
+        expected = iaa.GaussianBlur(sigma=1.0).augment_images(images)
+        queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=_blur_in_process, args=(queue, images))
+        worker.start()
+        observed = queue.get(timeout=60)
+        worker.join()
+        assert array_equal_lists(list(observed), list(expected))
+
+        iaa.set_n_jobs(None)
+        assert iaa.get_n_jobs() >= 1
+
+        got_exception = False
+        try:
+            iaa.set_n_jobs(0)
+        except Exception:
+            got_exception = True
+        assert got_exception
+    finally:
+        iaa.set_n_jobs(1)
+    assert iaa.get_n_jobs() == 1
+
+
+def test_subselect_rows():
+    reseed()
+    from imgaug.augmenters import meta
+
+    images = np.arange(5*2*2*1).astype(np.uint8).reshape((5, 2, 2, 1))
+
+    # contiguous indices lead to views, others to copies
+    images_sub = meta.subselect_rows(images, np.int64([1, 2, 3]))
+    assert np.may_share_memory(images_sub, images)
+    assert np.array_equal(images_sub, images[1:4])
+    images_sub = meta.subselect_rows(images, np.int64([0, 2]))
+    assert not np.may_share_memory(images_sub, images)
+    assert np.array_equal(images_sub, images[[0, 2]])
+    images_sub = meta.subselect_rows(list(images), np.int64([0, 2]))
+    assert isinstance(images_sub, list)
+    assert len(images_sub) == 2
+
+    # writing back views augmented in-place, copies and new arrays
+    images_sub = meta.subselect_rows(images, np.int64([1, 2]))
+    images_sub += 100
+    observed = meta.invert_subselect_rows_(images, np.int64([1, 2]), images_sub)
+    assert observed is images
+    assert np.all(images[1:3] >= 100)
+    observed = meta.invert_subselect_rows_(images, np.int64([0, 4]), np.zeros((2, 2, 2, 1), dtype=np.uint8))
+    assert observed is images
+    assert np.all(images[[0, 4]] == 0)
+    observed = meta.invert_subselect_rows_(images, np.int64([]), [])
+    assert observed is images
+
+    # shape changes turn arrays into lists
+    observed = meta.invert_subselect_rows_(images, np.int64([3]), [np.zeros((1, 1, 1), dtype=np.uint8)])
+    assert isinstance(observed, list)
+    assert [image.shape for image in observed] == [(2, 2, 1)] * 3 + [(1, 1, 1)] + [(2, 2, 1)]
+    assert np.may_share_memory(observed[0], images)
+
+    # SomeOf and Sometimes augment contiguous rows in-place
+    images = np.zeros((4, 2, 2, 1), dtype=np.uint8)
+    observed = iaa.SomeOf(2, [iaa.Add(1), iaa.Add(2)]).augment_images(images, copy=False)
+    assert observed is images
+    assert np.all(images == 3)
+    observed = iaa.Sometimes(1.0, iaa.Add(1)).augment_images(images, copy=False)
+    assert observed is images
+    assert np.all(images == 4)
+
+    # results stay the same for non-contiguous rows and shape changes
+    aug = iaa.Sometimes(0.5, iaa.Add(10), iaa.Crop(px=(1, 0, 0, 0), keep_size=False))
+    images = np.zeros((20, 4, 4, 1), dtype=np.uint8)
+    observed = aug.augment_images(images)
+    assert isinstance(observed, list)
+    assert all([(image.shape == (4, 4, 1) and np.all(image == 10)) or (image.shape == (3, 4, 1) and np.all(image == 0))
+                for image in observed])
+    assert np.all(images == 0)
+
+
 def test_Augmenter():
     reseed()
 
@@ -11127,6 +12519,139 @@ def test_Augmenter_augment_segmentation_maps():
     assert np.allclose(segmap_aug.arr, expected)
 
 
+def test_Augmenter_augment_images_copy():
+    reseed()
+
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    images = np.zeros((2, 4, 4, 3), dtype=np.uint8)
+
+    # top-level calls copy by default
+    aug = iaa.Add(10)
+    observed = aug.augment_images(images)
+    assert np.all(observed == 10)
+    assert np.all(images == 0)
+
+    observed = aug.augment_images([image, image])
+    assert all([np.all(image_aug == 10) for image_aug in observed])
+    assert np.all(image == 0)
+
+    observed = aug.augment_images(images, copy=True)
+    assert np.all(observed == 10)
+    assert np.all(images == 0)
+
+    # copy=False augments in-place
+    images_owned = np.copy(images)
+    observed = aug.augment_images(images_owned, copy=False)
+    assert np.all(observed == 10)
+    assert np.all(images_owned == 10)
+
+    observed = aug.augment_image(np.copy(image), copy=False)
+    assert np.all(observed == 10)
+
+    # children work on the buffer handed to them by their parent
+    # instead of copying it again
+    seen = []
+
+    def func_images(images, random_state, parents, hooks):
+        seen.append(images)
+        return images
+
+    seq = iaa.Sequential([
+        iaa.Lambda(func_images=func_images, func_heatmaps=None, func_keypoints=None),
+        iaa.Add(10),
+        iaa.Lambda(func_images=func_images, func_heatmaps=None, func_keypoints=None)
+    ])
+    observed = seq.augment_images(images)
+    assert len(seen) == 2
+    assert seen[0] is seen[1]
+    assert seen[0] is not images
+    assert np.all(observed == 10)
+    assert np.all(images == 0)
+
+    # direct calls with parents still copy by default
+    seen = []
+    lambda_aug = iaa.Lambda(func_images=func_images, func_heatmaps=None, func_keypoints=None)
+    _ = lambda_aug.augment_images(images, parents=[seq])
+    assert seen[0] is not images
+    observed = iaa.Add(10).augment_images(images, parents=[seq])
+    assert np.all(observed == 10)
+    assert np.all(images == 0)
+
+    # both branches of Alpha must see the non-augmented images
+    aug = iaa.Alpha(0.5, first=iaa.Add(10), second=iaa.Add(30))
+    observed = aug.augment_images(images)
+    assert np.all(observed == 20)
+    assert np.all(images == 0)
+
+
+def test_Augmenter_augment_heatmaps_keypoints_copy():
+    reseed()
+
+    kpsoi = ia.KeypointsOnImage([ia.Keypoint(x=1, y=2)], shape=(4, 4, 3))
+    heatmaps = ia.HeatmapsOnImage(np.zeros((4, 4, 1), dtype=np.float32), shape=(4, 4, 3))
+    heatmaps.arr_0to1[0, 0, 0] = 1.0
+
+    # top-level calls copy by default
+    aug = iaa.Fliplr(1.0)
+    observed = aug.augment_keypoints([kpsoi])
+    assert observed[0] is not kpsoi
+    assert observed[0].keypoints[0].x == 2
+    assert kpsoi.keypoints[0].x == 1
+
+    observed = aug.augment_heatmaps([heatmaps])
+    assert observed[0] is not heatmaps
+    assert np.isclose(observed[0].get_arr()[0, 3, 0], 1.0)
+    assert np.isclose(heatmaps.get_arr()[0, 0, 0], 1.0)
+
+    # copy=False augments in-place
+    kpsoi_owned = kpsoi.deepcopy()
+    observed = aug.augment_keypoints([kpsoi_owned], copy=False)
+    assert observed[0] is kpsoi_owned
+    assert kpsoi_owned.keypoints[0].x == 2
+
+    # children do not copy the data handed to them by their parent
+    seen_kps = []
+    seen_heatmaps = []
+
+    def func_heatmaps(heatmaps, random_state, parents, hooks):
+        seen_heatmaps.extend(heatmaps)
+        return heatmaps
+
+    def func_keypoints(keypoints_on_images, random_state, parents, hooks):
+        seen_kps.extend(keypoints_on_images)
+        return keypoints_on_images
+
+    def create_lambda():
+        return iaa.Lambda(func_images=None, func_heatmaps=func_heatmaps, func_keypoints=func_keypoints)
+
+    seq = iaa.Sequential([create_lambda(), iaa.Add(10), iaa.Fliplr(1.0), create_lambda()])
+    observed_kps = seq.augment_keypoints([kpsoi])
+    observed_heatmaps = seq.augment_heatmaps([heatmaps])
+    assert seen_kps[0] is seen_kps[1] is observed_kps[0]
+    assert seen_kps[0] is not kpsoi
+    assert seen_heatmaps[0] is seen_heatmaps[1] is observed_heatmaps[0]
+    assert seen_heatmaps[0] is not heatmaps
+    assert observed_kps[0].keypoints[0].x == 2
+    assert kpsoi.keypoints[0].x == 1
+    assert np.isclose(heatmaps.get_arr()[0, 0, 0], 1.0)
+
+    # direct calls with parents still copy by default
+    observed = iaa.Fliplr(1.0).augment_keypoints([kpsoi], parents=[seq])
+    assert observed[0].keypoints[0].x == 2
+    assert kpsoi.keypoints[0].x == 1
+    observed = iaa.Fliplr(1.0).augment_heatmaps([heatmaps], parents=[seq])
+    assert np.isclose(observed[0].get_arr()[0, 3, 0], 1.0)
+    assert np.isclose(heatmaps.get_arr()[0, 0, 0], 1.0)
+
+    # both branches of Alpha must see the non-augmented keypoints
+    aug = iaa.Alpha(1.0, first=iaa.Fliplr(1.0), second=iaa.Fliplr(1.0))
+    observed = aug.augment_keypoints([kpsoi])
+    assert observed[0].keypoints[0].x == 2
+    aug = iaa.Alpha(0.0, first=iaa.Fliplr(1.0), second=iaa.Fliplr(1.0))
+    observed = aug.augment_keypoints([kpsoi])
+    assert observed[0].keypoints[0].x == 2
+
+
 def test_Augmenter_find():
     reseed()
 
@@ -12568,6 +14093,232 @@ def test_2d_inputs():
     assert array_equal_lists(observed, images_list2d3d)
 
 
+def test_Augmenter_snapshot_random_states():
+    reseed()
+
+    image = np.arange(10*20).reshape((10, 20)).astype(np.uint8)
+    images = np.uint8([image] * 16)
+    keypoints = [ia.KeypointsOnImage([ia.Keypoint(x=x, y=y) for y in sm.xrange(10) for x in sm.xrange(20)], shape=(10, 20))] * 16
+
+    for localize in [False, True]:
+        seq = iaa.Sequential([
+            iaa.Fliplr(0.5),
+            iaa.Sometimes(0.5, iaa.Flipud(1.0)),
+            iaa.Add((-10, 10)),
+            iaa.SomeOf((0, 2), [iaa.Fliplr(0.5), iaa.Flipud(0.5)])
+        ])
+        if localize:
+            seq.localize_random_state_()
+
+        # same results after restoring
+        snapshot = seq.snapshot_random_states()
+        images_aug1 = seq.augment_images(images)
+        seq.restore_random_states(snapshot)
+        images_aug2 = seq.augment_images(images)
+        assert np.array_equal(images_aug1, images_aug2)
+
+        # new results without restoring
+        images_aug3 = seq.augment_images(images)
+        assert not np.array_equal(images_aug1, images_aug3)
+
+        # keypoints are augmented in the same way as images
+        # (the image value at each keypoint reflects its original position)
+        snapshot = seq.snapshot_random_states()
+        images_aug = seq.augment_images(images)
+        seq.restore_random_states(snapshot)
+        keypoints_aug = seq.augment_keypoints(keypoints)
+        for image_aug, kpsoi_orig, kpsoi_aug in zip(images_aug, keypoints, keypoints_aug):
+            for kp_orig, kp_aug in zip(kpsoi_orig.keypoints, kpsoi_aug.keypoints):
+                value_orig = image[kp_orig.y, kp_orig.x]
+                value_aug = image_aug[int(round(kp_aug.y)), int(round(kp_aug.x))]
+                assert abs(int(value_orig) - int(value_aug)) <= 10
+
+        # every distinct random state is saved exactly once
+        snapshot = seq.snapshot_random_states()
+        if localize:
+            assert len(snapshot) == 1 + len(seq.get_all_children(flat=True))
+        else:
+            assert len(snapshot) == 1
+            assert snapshot[0][0] is ia.current_random_state()
+
+
+def test_Augmenter_augment_batch():
+    reseed()
+
+    image = ia.quokka(size=(32, 48))
+    images = np.uint8([image] * 4)
+    heatmaps_arr = np.zeros((32, 48, 1), dtype=np.float32)
+    heatmaps_arr[8:24, 12:36, 0] = 1.0
+    heatmaps = [ia.HeatmapsOnImage(heatmaps_arr, shape=(32, 48, 3)) for _ in sm.xrange(4)]
+    segmap_arr = np.zeros((32, 48), dtype=np.int32)
+    segmap_arr[4:12, 4:20] = 1
+    segmap_arr[20:28, 24:40] = 2
+    segmaps = [ia.SegmentationMapOnImage(segmap_arr, shape=(32, 48, 3), nb_classes=3) for _ in sm.xrange(4)]
+    keypoints = [ia.KeypointsOnImage([ia.Keypoint(x=10, y=5), ia.Keypoint(x=30, y=20)], shape=(32, 48, 3)) for _ in sm.xrange(4)]
+    bbs = [ia.BoundingBoxesOnImage([ia.BoundingBox(x1=5, y1=6, x2=20, y2=25, label="a")], shape=(32, 48, 3)) for _ in sm.xrange(4)]
+
+    seq = iaa.Sequential([
+        iaa.Fliplr(0.5),
+        iaa.Sometimes(0.5, iaa.Affine(rotate=(-20, 20)), iaa.Affine(scale=(0.8, 1.2))),
+        iaa.SomeOf((0, 2), [iaa.Flipud(0.5), iaa.Add((-10, 10)), iaa.Affine(translate_px=(-3, 3))]),
+        iaa.ElasticTransformation(alpha=(0, 3.0), sigma=0.5),
+        iaa.Sequential([iaa.Fliplr(0.5), iaa.Affine(shear=(-10, 10))]).compile(),
+        iaa.Crop(px=(0, 4), keep_size=False)
+    ], random_order=True)
+
+    for _ in sm.xrange(5):
+        seq_det = seq.to_deterministic()
+        batch = ia.Batch(images=images, heatmaps=heatmaps, segmentation_maps=segmaps, keypoints=keypoints, bounding_boxes=bbs)
+        batch_aug = seq_det.augment_batch(batch)
+        assert batch_aug is batch
+
+        # same results as for separate calls
+        images_aug = seq_det.augment_images(images)
+        heatmaps_aug = seq_det.augment_heatmaps(heatmaps)
+        segmaps_aug = seq_det.augment_segmentation_maps(segmaps)
+        keypoints_aug = seq_det.augment_keypoints(keypoints)
+        bbs_aug = seq_det.augment_bounding_boxes(bbs)
+
+        assert array_equal_lists(list(batch.images_aug), list(images_aug))
+        for heatmaps_i_batch, heatmaps_i in zip(batch.heatmaps_aug, heatmaps_aug):
+            assert heatmaps_i_batch.shape == heatmaps_i.shape
+            assert np.allclose(heatmaps_i_batch.get_arr(), heatmaps_i.get_arr())
+        for segmap_i_batch, segmap_i in zip(batch.segmentation_maps_aug, segmaps_aug):
+            assert segmap_i_batch.shape == segmap_i.shape
+            assert np.array_equal(segmap_i_batch.get_arr_int(), segmap_i.get_arr_int())
+        assert keypoints_equal(batch.keypoints_aug, keypoints_aug)
+        for bbsoi_batch, bbsoi in zip(batch.bounding_boxes_aug, bbs_aug):
+            assert bbsoi_batch.shape == bbsoi.shape
+            for bb_batch, bb in zip(bbsoi_batch.bounding_boxes, bbsoi.bounding_boxes):
+                assert np.allclose([bb_batch.x1, bb_batch.y1, bb_batch.x2, bb_batch.y2], [bb.x1, bb.y1, bb.x2, bb.y2])
+                assert bb_batch.label == "a"
+
+    # inputs are not changed
+    assert np.array_equal(images[0], image)
+    assert np.allclose(heatmaps[0].get_arr(), heatmaps_arr)
+    assert keypoints[0].keypoints[0].x == 10
+
+    # 2D images and only some modalities
+    images_2d = np.zeros((2, 8, 10), dtype=np.uint8)
+    images_2d[:, :, 0] = 255
+    batch = iaa.Fliplr(1.0).augment_batch(ia.Batch(images=images_2d, images_gt=list(images_2d)))
+    assert batch.images_aug.shape == (2, 8, 10)
+    assert np.all(batch.images_aug[:, :, -1] == 255)
+    assert [image_gt.shape for image_gt in batch.images_gt_aug] == [(8, 10), (8, 10)]
+    assert batch.heatmaps_aug is None
+    assert batch.keypoints_aug is None
+    assert batch.bounding_boxes_aug is None
+
+    # empty batch
+    batch = seq.augment_batch(ia.Batch(images=[]))
+    assert batch.images_aug == []
+
+    # columns must have the same number of rows
+    got_exception = False
+    try:
+        _ = seq.augment_batch(ia.Batch(images=images, keypoints=keypoints[0:2]))
+    except Exception:
+        got_exception = True
+    assert got_exception
+
+
+def _create_blob_batch(nb_images):
+    # images with a small blob and a keypoint at the blob's center
+    images = np.zeros((nb_images, 64, 64, 3), dtype=np.uint8)
+    images[:, 10:14, 20:24, :] = 255
+    keypoints = [ia.KeypointsOnImage([ia.Keypoint(x=21.5, y=11.5)], shape=(64, 64, 3)) for _ in sm.xrange(nb_images)]
+    return ia.Batch(images=images, keypoints=keypoints)
+
+
+def _get_max_blob_keypoint_distance(batch_aug):
+    distances = []
+    for image_aug, kpsoi_aug in zip(batch_aug.images_aug, batch_aug.keypoints_aug):
+        ys, xs = np.nonzero(image_aug[..., 0] > 0)
+        if len(xs) > 0:
+            distances.append(np.sqrt((np.mean(xs) - kpsoi_aug.keypoints[0].x) ** 2
+                                     + (np.mean(ys) - kpsoi_aug.keypoints[0].y) ** 2))
+    return max(distances)
+
+
+def test_Augmenter_augment_batch_containers():
+    reseed()
+
+    # containers without their own _augment_batch() pass each column to
+    # their children, which must not advance their random states in between
+    augs = [
+        iaa.Alpha(1.0, first=iaa.Affine(rotate=(-90, 90), order=0)),
+        iaa.AlphaElementwise(1.0, first=iaa.Affine(rotate=(-90, 90), order=0)),
+        iaa.WithChannels(None, iaa.Affine(rotate=(-90, 90), order=0)),
+        iaa.WithColorspace("HSV", children=iaa.Affine(rotate=(-90, 90), order=0)),
+        iaa.Alpha(1.0, first=iaa.Sequential([iaa.Affine(rotate=(-90, 90), order=0), iaa.Fliplr(0.5)]).compile())
+    ]
+    for aug in augs:
+        for _ in sm.xrange(3):
+            batch_aug = aug.augment_batch(_create_blob_batch(16))
+            assert _get_max_blob_keypoint_distance(batch_aug) < 2.0
+
+
+def test_Augmenter_augment_batch_seed():
+    reseed()
+
+    images = [np.full((8, 8, 3), i*10, dtype=np.uint8) for i in sm.xrange(6)]
+    keypoints = [ia.KeypointsOnImage([ia.Keypoint(x=1, y=2)], shape=(8, 8, 3)) for _ in sm.xrange(6)]
+    aug = iaa.Sequential([iaa.Fliplr(0.5), iaa.Add((-5, 5)), iaa.Affine(translate_px={"x": (-2, 2)})])
+
+    def _augment(indices, epoch, seed):
+        batch = ia.Batch(images=[images[i] for i in indices], keypoints=[keypoints[i] for i in indices],
+                         sample_ids=[100 + i for i in indices], epoch=epoch)
+        batch_aug = aug.augment_batch(batch, seed=seed)
+        return dict([(i, (image_aug, kpsoi_aug.keypoints[0].x))
+                     for i, image_aug, kpsoi_aug in zip(indices, batch_aug.images_aug, batch_aug.keypoints_aug)])
+
+    # results of each sample don't depend on the other samples in the batch
+    # or on the previous random states
+    results_full = _augment([0, 1, 2, 3, 4, 5], 0, 1)
+    aug.reseed(123)
+    results_split = _augment([4, 1], 0, 1)
+    results_split.update(_augment([5, 0, 2, 3], 0, 1))
+    for i in sm.xrange(6):
+        assert np.array_equal(results_full[i][0], results_split[i][0])
+        assert np.isclose(results_full[i][1], results_split[i][1])
+    assert len(set([int(np.sum(image_aug)) for image_aug, _ in results_full.values()])) > 1
+
+    # other epochs and seeds lead to other results
+    results_epoch = _augment([0, 1, 2, 3, 4, 5], 1, 1)
+    results_seed = _augment([0, 1, 2, 3, 4, 5], 0, 2)
+    assert not all([np.array_equal(results_full[i][0], results_epoch[i][0]) for i in sm.xrange(6)])
+    assert not all([np.array_equal(results_full[i][0], results_seed[i][0]) for i in sm.xrange(6)])
+
+    # sample ids are required
+    got_exception = False
+    try:
+        _ = aug.augment_batch(ia.Batch(images=images), seed=1)
+    except Exception as exc:
+        assert "sample_ids" in str(exc)
+        got_exception = True
+    assert got_exception
+
+    # background augmentation is independent of the number of workers and the batch size
+    def _create_load_func(batch_size):
+        def _load_func():
+            for i in sm.xrange(0, 6, batch_size):
+                indices = list(sm.xrange(i, min(i+batch_size, 6)))
+                yield ia.Batch(images=[images[j] for j in indices], sample_ids=[100 + j for j in indices], data=indices)
+        return _load_func
+
+    for nb_workers, batch_size in [(1, 6), (3, 1), (2, 4)]:
+        loader = ia.BatchLoader(_create_load_func(batch_size))
+        bg_augmenter = ia.BackgroundAugmenter(loader, aug, nb_workers=nb_workers, seed=1)
+        while True:
+            batch_aug = bg_augmenter.get_batch()
+            if batch_aug is None:
+                break
+            for i, image_aug in zip(batch_aug.data, batch_aug.images_aug):
+                assert np.array_equal(image_aug, results_full[i][0])
+        loader.terminate()
+        bg_augmenter.terminate()
+
+
 def test_Augmenter_augment_batches():
     reseed()
 
@@ -12759,6 +14510,71 @@ def test_Augmenter_augment_batches():
     """
 
 
+def test_Augmenter_augment_batches_async():
+    if sys.version_info < (3, 7):
+        return
+    import asyncio
+
+    reseed()
+
+    images = [np.full((4, 4, 3), i, dtype=np.uint8) for i in sm.xrange(10)]
+
+    # the async generator is driven manually, as this file has to remain
+    # valid python 2 syntax
+    def _collect(aug, batches, nb_batches=None, **kwargs):
+        loop = asyncio.new_event_loop()
+        gen = aug.augment_batches_async(batches, **kwargs)
+        batches_aug = []
+        try:
+            while nb_batches is None or len(batches_aug) < nb_batches:
+                try:
+                    batches_aug.append(loop.run_until_complete(gen.__anext__()))
+                except StopAsyncIteration:
+                    break
+            loop.run_until_complete(gen.aclose())
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+        return batches_aug
+
+    class _AsyncSource(object):
+        def __init__(self):
+            self.idx = 0
+
+        def __aiter__(self):
+            return self
+
+        def __anext__(self):
+            if self.idx >= len(images):
+                raise StopAsyncIteration
+            batch = ia.Batch(images=[images[self.idx]], data=self.idx)
+            self.idx += 1
+            return asyncio.sleep(0, result=batch)
+
+    # order and results are independent of the number of workers
+    aug = iaa.Sequential([iaa.Fliplr(0.5), iaa.Add((-5, 5))])
+    results = []
+    for nb_workers in [1, 3]:
+        aug.reseed(1)
+        batches = [ia.Batch(images=[image], data=i) for i, image in enumerate(images)]
+        batches_aug = _collect(aug, batches, nb_workers=nb_workers, max_in_flight=4)
+        assert [batch_aug.data for batch_aug in batches_aug] == list(sm.xrange(10))
+        results.append([batch_aug.images_aug[0] for batch_aug in batches_aug])
+    assert array_equal_lists(results[0], results[1])
+    assert not all([np.array_equal(image_aug, image) for image_aug, image in zip(results[0], images)])
+
+    # async iterables and processes
+    batches_aug = _collect(iaa.Add(1), _AsyncSource(), nb_workers=2, processes=True)
+    assert [batch_aug.data for batch_aug in batches_aug] == list(sm.xrange(10))
+    assert all([np.all(batch_aug.images_aug[0] == batch_aug.data + 1) for batch_aug in batches_aug])
+
+    # stopping early cancels the remaining batches
+    source = _AsyncSource()
+    batches_aug = _collect(iaa.Add(1), source, nb_batches=1, nb_workers=1, max_in_flight=2)
+    assert [batch_aug.data for batch_aug in batches_aug] == [0]
+    assert source.idx == 2
+
+
 def test_determinism():
     reseed()
 
@@ -15795,3 +17611,150 @@ def reseed(seed=0):
 
 if __name__ == "__main__":
     main()
+
+
+def test_AugmentationServer():
+    # not imported by default
+    from imgaug import serve
+
+    reseed()
+
+    def _create_batches(nb_batches, value=0):
+        return [ia.Batch(images=np.full((2, 4, 4, 3), value, dtype=np.uint8), sample_ids=[2*i, 2*i+1], data=i)
+                for i in sm.xrange(nb_batches)]
+
+    def _start(server):
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    tmpdir = tempfile.mkdtemp()
+    address = os.path.join(tmpdir, "imgaug.sock")
+    pipelines = {"add1": iaa.Add(1), "add2": iaa.Add(2), "noise": iaa.AdditiveGaussianNoise(scale=20)}
+    authkey = b"secret"
+    server = serve.AugmentationServer(pipelines, address, authkey, nb_workers=2, max_in_flight=2)
+    thread = _start(server)
+
+    with serve.AugmentationClient(address, authkey) as client:
+        assert client.get_pipelines() == ["add1", "add2", "noise"]
+
+        # batches are returned in order, also if more are in flight than the
+        # server passes to its workers
+        batches_aug = list(client.augment_batches(_create_batches(10), "add1", max_in_flight=5))
+        assert [batch_aug.data for batch_aug in batches_aug] == list(sm.xrange(10))
+        assert all([np.all(batch_aug.images_aug == 1) for batch_aug in batches_aug])
+        assert np.all(client.augment_batch(_create_batches(1)[0], "add2").images_aug == 2)
+
+        # seeded batches don't depend on the worker
+        images_aug = [client.augment_batch(_create_batches(1, 128)[0], "noise", seed=1).images_aug
+                      for _ in sm.xrange(4)]
+        assert all([np.array_equal(images_aug_i, images_aug[0]) for images_aug_i in images_aug])
+
+        # streams that are not exhausted don't affect the next one
+        gen = client.augment_batches(_create_batches(10), "add1", max_in_flight=4)
+        assert next(gen).data == 0
+        gen.close()
+        batches_aug = list(client.augment_batches(_create_batches(3), "add2"))
+        assert [batch_aug.data for batch_aug in batches_aug] == [0, 1, 2]
+        assert all([np.all(batch_aug.images_aug == 2) for batch_aug in batches_aug])
+
+        # errors are raised in the client
+        for batch, pipeline, expected in [(_create_batches(1)[0], "foo", "Unknown pipeline"),
+                                          (ia.Batch(images=np.zeros((2, 4, 4, 3), dtype=np.uint8), keypoints=[]),
+                                           "add1", "failed on the server")]:
+            got_exception = False
+            try:
+                _ = client.augment_batch(batch, pipeline)
+            except Exception as exc:
+                assert expected in str(exc)
+                got_exception = True
+            assert got_exception
+
+    # several clients share the server
+    def _run_client(pipeline, value, results):
+        with serve.AugmentationClient(address, authkey) as client:
+            results[pipeline] = list(client.augment_batches(_create_batches(20), pipeline))
+
+    results = dict()
+    threads = [threading.Thread(target=_run_client, args=(pipeline, value, results))
+               for pipeline, value in [("add1", 1), ("add2", 2)]]
+    for client_thread in threads:
+        client_thread.start()
+    for client_thread in threads:
+        client_thread.join(timeout=60)
+    assert all([np.all(batch_aug.images_aug == 1) for batch_aug in results["add1"]])
+    assert all([np.all(batch_aug.images_aug == 2) for batch_aug in results["add2"]])
+    assert all([len(batches_aug) == 20 for batches_aug in results.values()])
+
+    # clients with the wrong authkey are rejected
+    got_exception = False
+    try:
+        _ = serve.AugmentationClient(address, b"wrong")
+    except multiprocessing.AuthenticationError:
+        got_exception = True
+    assert got_exception
+
+    server.close()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert server.closed
+
+    # an authkey is required, as batches are unpickled
+    got_exception = False
+    try:
+        _ = serve.AugmentationServer(pipelines, ("127.0.0.1", 0), None, nb_workers=1)
+    except Exception as exc:
+        assert "authkey" in str(exc)
+        got_exception = True
+    assert got_exception
+
+    with serve.AugmentationServer(pipelines, ("127.0.0.1", 0), authkey, nb_workers=1) as server:
+        thread = _start(server)
+        with serve.AugmentationClient(server.address, authkey) as client:
+            assert np.all(client.augment_batch(_create_batches(1)[0], "add1").images_aug == 1)
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+    # closing the server while batches are dispatched
+    errors = []
+    excepthook = getattr(threading, "excepthook", None)
+    if excepthook is not None:
+        threading.excepthook = lambda args: errors.append(args.exc_value)
+    try:
+        server = serve.AugmentationServer({"blur": iaa.GaussianBlur(sigma=1.0)}, address, authkey, nb_workers=2,
+                                          max_in_flight=1)
+        thread = _start(server)
+
+        def _run_until_closed():
+            try:
+                with serve.AugmentationClient(address, authkey) as client:
+                    _ = list(client.augment_batches(_create_batches(200), "blur", max_in_flight=200))
+            except (IOError, OSError, EOFError):
+                pass
+
+        client_thread = threading.Thread(target=_run_until_closed)
+        client_thread.start()
+        time.sleep(0.5)
+        server.close()
+        thread.join(timeout=10)
+        server._dispatcher.join(timeout=10)
+        client_thread.join(timeout=10)
+        assert not server._dispatcher.is_alive()
+        assert not client_thread.is_alive()
+    finally:
+        if excepthook is not None:
+            threading.excepthook = excepthook
+    assert errors == []
+
+    # command line options
+    assert serve._parse_threads_per_worker("auto") == "auto"
+    assert serve._parse_threads_per_worker("none") is None
+    assert serve._parse_threads_per_worker("2") == 2
+
+    # pipelines of the command line server
+    assert isinstance(serve._load_pipeline("imgaug.augmenters:Noop"), iaa.Noop)
+    filepath = os.path.join(tmpdir, "aug.pkl")
+    with open(filepath, "wb") as f:
+        pickle.dump(iaa.Add(1), f)
+    assert isinstance(serve._load_pipeline(filepath), iaa.Add)